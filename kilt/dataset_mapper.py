@@ -8,52 +8,296 @@
 import json
 import sys
 import multiprocessing
+import os
+import queue
+import shutil
+import threading
 
 from multiprocessing.pool import ThreadPool
 
 from kilt.knowledge_source import KnowledgeSource
+from kilt.token_cache import TokenCache
+
+MANIFEST_FILE = "manifest.jsonl"
+CONFIG_FILE = "config.json"
+WRITER_POLL_SECONDS = 1.0
+
+# state of a worker process of map_dataset, set once by init_process
+_process_state = {}
 
 
 def run_thread(args):
     dataset = args["dataset"]
-    return dataset.process_chunk(args["chunk"], args["ks"], args["id"])
+    return args["id"], dataset.process_chunk(args["chunk"], args["ks"], args["id"])
+
+
+def init_process(dataset, page_cache_bytes):
+    # the dataset (with its spacy model) is received once per process and
+    # each process connects to the knowledge source with its own client
+    _process_state["dataset"] = dataset
+    _process_state["ks"] = KnowledgeSource(page_cache_bytes=page_cache_bytes)
+
+
+def run_process(args):
+    id, chunk = args
+    dataset = _process_state["dataset"]
+    return id, dataset.process_chunk(chunk, _process_state["ks"], id)
+
+
+def iter_chunks(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bounded(iterable, semaphore, stopped):
+    # the pools consume their input eagerly: wait for a free slot before
+    # handing over each element
+    for x in iterable:
+        semaphore.acquire()
+        if stopped.is_set():
+            return
+        yield x
+
+
+def run_writer(write, args, errors):
+    # the exception of the writer thread is kept to be raised by map_dataset
+    try:
+        write(*args)
+    except Exception as e:
+        errors.append(e)
+
+
+def put_record(records_queue, item, writer):
+    """
+    Queues item for the writer thread unless it died (e.g. on a full disk),
+    in which case nothing drains the queue anymore and False is returned.
+    """
+    while writer.is_alive():
+        try:
+            records_queue.put(item, timeout=WRITER_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def write_records(output_file, records_queue):
+    with open(output_file, "w+") as outfile:
+        written = 0
+        while True:
+            item = records_queue.get()
+            if item is None:
+                break
+            _, kilt_data, _ = item
+            for data in kilt_data:
+                json.dump(data, outfile)
+                outfile.write("\n")
+            written += len(kilt_data)
+            print("written {} records".format(written), end="\r")
+            sys.stdout.flush()
+    print()
+
 
+def get_shard_file(shard_directory, id):
+    return os.path.join(shard_directory, "shard-{:06d}.jsonl".format(id))
 
-def map_dataset(dataset):
+
+def load_manifest(shard_directory):
+    """Returns chunk id -> manifest entry of the completed shards."""
+    manifest = {}
+    manifest_file = os.path.join(shard_directory, MANIFEST_FILE)
+    if os.path.isfile(manifest_file):
+        with open(manifest_file, "r") as fin:
+            for line in fin:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # truncated by a crash while appending
+                    continue
+                manifest[entry["id"]] = entry
+    return manifest
+
+
+def load_shard_config(shard_directory, config):
+    """
+    Returns the chunking config of the shards in shard_directory, or
+    stores config if this is the first run: resuming a job must split the
+    dataset in the same chunks, whatever the machine it runs on.
+    """
+    config_file = os.path.join(shard_directory, CONFIG_FILE)
+    if os.path.isfile(config_file):
+        with open(config_file, "r") as fin:
+            return json.load(fin)
+    os.makedirs(shard_directory, exist_ok=True)
+    with open(config_file, "w") as fout:
+        json.dump(config, fout)
+    return config
+
+
+def write_shards(shard_directory, records_queue):
+    with open(os.path.join(shard_directory, MANIFEST_FILE), "a") as manifest:
+        while True:
+            item = records_queue.get()
+            if item is None:
+                break
+            id, kilt_data, meta = item
+            shard_file = get_shard_file(shard_directory, id)
+            with open(shard_file + ".tmp", "w") as outfile:
+                for data in kilt_data:
+                    json.dump(data, outfile)
+                    outfile.write("\n")
+            os.replace(shard_file + ".tmp", shard_file)
+            # a shard is done once it is in the manifest
+            manifest.write(
+                json.dumps({"id": id, "records": len(kilt_data), "metadata": meta})
+                + "\n"
+            )
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            print("shard {} done".format(id), end="\r")
+            sys.stdout.flush()
+    print()
+
+
+def merge_shards(shard_directory, ids, output_file):
+    with open(output_file, "wb") as fout:
+        for id in ids:
+            with open(get_shard_file(shard_directory, id), "rb") as fin:
+                shutil.copyfileobj(fin, fout)
+
+
+def map_dataset(
+    dataset,
+    page_cache_bytes=None,
+    token_cache_bytes=None,
+    use_processes=False,
+    chunks_per_process=4,
+    start_method=None,
+    chunk_size=1000,
+    max_pending_chunks=None,
+    shard_directory=None,
+):
+    """
+    Maps the dataset with a pool of worker threads (default) or, with
+    use_processes, of worker processes that are not limited by the GIL.
+    In the process mode the dataset is split in chunks_per_process chunks
+    per worker, streamed to the workers as they become free, and the
+    caches are per process.
+    Datasets that set streaming are streamed with iter_records: their
+    records are mapped in chunks of chunk_size with process_chunk. The
+    mapped records are written to the output file as the chunks complete,
+    with at most max_pending_chunks (default: twice the number of workers)
+    in flight, so that the memory used does not grow with the size of the
+    dataset.
+    With shard_directory, each chunk is written to its own shard file and
+    recorded in a manifest (with its metadata, which must be json
+    serializable): a job that is restarted skips the completed shards, and
+    the shards are concatenated into the output file at the end.
+    """
     print("Processing {} dataset.".format(dataset.name))
-    ks = KnowledgeSource()
+    # the page cache is shared (and locked) across the worker threads
+    ks = KnowledgeSource(page_cache_bytes=page_cache_bytes)
+    # and so is the cache of the paragraphs tokenized by match_answer
+    if token_cache_bytes and dataset.token_cache is None:
+        dataset.token_cache = TokenCache(token_cache_bytes)
 
     num_threads = (
         min(dataset.max_chunks, int(multiprocessing.cpu_count()))
         if dataset.max_chunks and dataset.max_chunks > 0
         else int(multiprocessing.cpu_count())
     )
-    print("num_threads", num_threads)
-    pool = ThreadPool(num_threads)
-    chunks = dataset.get_chunks(num_threads)
-    results = pool.map(
-        run_thread,
-        [
-            {"id": id, "chunk": chunk, "ks": ks, "dataset": dataset}
-            for id, chunk in enumerate(chunks)
-        ],
-    )
+    if max_pending_chunks is None:
+        max_pending_chunks = 2 * num_threads
 
-    kilt_data = []
-    metadata = []
-    for x in results:
-        kd, meta = x
-        kilt_data.extend(kd)
-        metadata.append(meta)
+    if dataset.is_streaming():
+        config = {"chunk_size": chunk_size}
+    elif use_processes:
+        config = {"num_chunks": num_threads * chunks_per_process}
+    else:
+        config = {"num_chunks": num_threads}
+    manifest = {}
+    if shard_directory:
+        config = load_shard_config(shard_directory, config)
+        manifest = load_manifest(shard_directory)
+        print("{} shards already done".format(len(manifest)))
 
-    pool.terminate()
-    pool.join()
+    if "chunk_size" in config:
+        chunks = iter_chunks(dataset.iter_records(), config["chunk_size"])
+    else:
+        chunks = dataset.get_chunks(config["num_chunks"])
+    num_chunks = 0
 
-    dataset.postprocess_metadata(metadata)
+    def chunks_todo():
+        # skips the shards completed by a previous run
+        nonlocal num_chunks
+        for id, chunk in enumerate(chunks):
+            num_chunks = id + 1
+            if id not in manifest:
+                yield id, chunk
 
-    with open(dataset.output_file, "w+") as outfile:
-        for idx, data in enumerate(kilt_data):
-            print(round(idx * 100 / len(kilt_data), 2), "%", end="\r")
-            sys.stdout.flush()
-            json.dump(data, outfile)
-            outfile.write("\n")
+    pending = threading.Semaphore(max_pending_chunks)
+    stopped = threading.Event()
+    chunks_to_map = bounded(chunks_todo(), pending, stopped)
+
+    if use_processes:
+        print("num_processes", num_threads)
+        pool = multiprocessing.get_context(start_method).Pool(
+            num_threads, initializer=init_process, initargs=(dataset, page_cache_bytes)
+        )
+        results = pool.imap(run_process, chunks_to_map)
+    else:
+        print("num_threads", num_threads)
+        pool = ThreadPool(num_threads)
+        results = pool.imap(
+            run_thread,
+            (
+                {"id": id, "chunk": chunk, "ks": ks, "dataset": dataset}
+                for id, chunk in chunks_to_map
+            ),
+        )
+
+    # results are streamed back in the order of the chunks and written by a
+    # separate thread
+    records_queue = queue.Queue(maxsize=max_pending_chunks)
+    if shard_directory:
+        write, args = write_shards, (shard_directory, records_queue)
+    else:
+        write, args = write_records, (dataset.output_file, records_queue)
+    writer_errors = []
+    writer = threading.Thread(target=run_writer, args=(write, args, writer_errors))
+    writer.start()
+
+    metadata = {id: entry["metadata"] for id, entry in manifest.items()}
+    try:
+        for id, (kilt_data, meta) in results:
+            pending.release()
+            if not put_record(records_queue, (id, kilt_data, meta), writer):
+                break
+            metadata[id] = meta
+    finally:
+        # unblock the pool if it is still waiting for a slot
+        stopped.set()
+        pending.release()
+        put_record(records_queue, None, writer)
+        writer.join()
+        pool.terminate()
+        pool.join()
+    if writer_errors:
+        raise writer_errors[0]
+
+    if shard_directory:
+        merge_shards(shard_directory, range(num_chunks), dataset.output_file)
+
+    dataset.postprocess_metadata([metadata[id] for id in range(num_chunks)])
+
+    if not use_processes:
+        if ks.page_cache is not None:
+            print("page cache", ks.page_cache.stats())
+        if dataset.token_cache is not None:
+            print("token cache", dataset.token_cache.stats())
@@ -13,10 +13,15 @@ from kilt.configs import mapping
 
 
 class Dataset(ABC):
-    def __init__(self, name):
+    # datasets that implement iter_records set it to be streamed by map_dataset
+    streaming = False
+
+    def __init__(self, name, token_cache=None):
         self.name = name
         self.output_file = None
         self.max_chunks = None
+        # optional kilt.token_cache.TokenCache shared by the match_answer calls
+        self.token_cache = token_cache
 
     @classmethod
     def from_default_config(cls, name):
@@ -44,6 +49,18 @@ class Dataset(ABC):
         """
         pass
 
+    def iter_records(self):
+        """
+        Yields the records of the dataset (the elements of its chunks) one
+        at a time, reading the input incrementally. Datasets that set
+        streaming are streamed by map_dataset instead of loaded with
+        get_chunks.
+        """
+        raise NotImplementedError
+
+    def is_streaming(self):
+        return self.streaming
+
     @abstractmethod
     def process_chunk(self, chunk, ks, chunk_id):
         """
@@ -4,6 +4,7 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import itertools
 import json
 import random
 import sys
@@ -113,6 +114,8 @@ def convert_to_KILT_format(
 
 
 class EntityLinkingDataset(Dataset):
+    streaming = True
+
     def __init__(
         self,
         name,
@@ -131,15 +134,21 @@ class EntityLinkingDataset(Dataset):
         self.max_chunks = max_chunks
 
     def get_chunks(self, num_chunks):
+        return utils.chunk_it(list(self.iter_records()), num_chunks)
 
-        data = []
+    def iter_records(self):
+        # one document at a time, as the context is reset at each -DOCSTART-
+        document = []
         with open(self.input_file, "r") as fin:
-            data = fin.readlines()
-
-        # a single chunk for entity linking
-        return [data]
+            for line in fin:
+                if "-DOCSTART-" in line and document:
+                    yield document
+                    document = []
+                document.append(line)
+        if document:
+            yield document
 
-    def process_chunk(self, lines, ks, chunk_id=-1):
+    def process_chunk(self, documents, ks, chunk_id=-1):
 
         kilt_records = []
 
@@ -155,7 +164,7 @@ class EntityLinkingDataset(Dataset):
         # question id in the document
         question_i = 0
 
-        for line in tqdm(lines):
+        for line in tqdm(itertools.chain.from_iterable(documents)):
 
             if "-DOCSTART-" in line:
                 # new document is starting
@@ -5,7 +5,6 @@
 # LICENSE file in the root directory of this source tree.
 
 import json
-import spacy
 import sys
 import unicodedata
 
@@ -16,18 +15,26 @@ pp = pprint.PrettyPrinter(indent=4)
 
 import kilt.kilt_utils as utils
 from kilt.datasets.base_dataset import Dataset
+from kilt.tokenizer import load_tokenizer
 
 
 class FactVerificationDataset(Dataset):
     def __init__(
-        self, name, claims_input_file, evidence_directory_path, output_file, log_file
+        self,
+        name,
+        claims_input_file,
+        evidence_directory_path,
+        output_file,
+        log_file,
+        token_cache=None,
+        tokenizer="spacy",
     ):
-        super().__init__(name)
+        super().__init__(name, token_cache=token_cache)
         self.claims_input_file = claims_input_file
         self.evidence_directory_path = evidence_directory_path
         self.output_file = output_file
         self.log_file = log_file
-        self.nlp = spacy.load("en_core_web_sm")
+        self.nlp = load_tokenizer(tokenizer)
 
     def _normalize(self, text):
         replacements = {
@@ -181,7 +188,11 @@ class FactVerificationDataset(Dataset):
                 kilt_record_output = []
 
                 paragraph_id, start_character, end_character, bleu = utils.match_answer(
-                    text, page, nlp=self.nlp, debug=False
+                    text,
+                    page,
+                    nlp=self.nlp,
+                    debug=False,
+                    token_cache=self.token_cache,
                 )
 
                 kilt_record_output.append(
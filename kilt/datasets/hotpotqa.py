@@ -8,11 +8,11 @@ import json
 import sys
 import os
 
-import spacy
 import pprint
 
 import kilt.kilt_utils as utils
 from kilt.datasets.base_dataset import Dataset
+from kilt.tokenizer import load_tokenizer
 from kilt.datasets.hotpotqa_ks import load_ks
 
 
@@ -27,13 +27,15 @@ class HotpotQADataset(Dataset):
         get_only_original_evidence,
         max_chunks=None,
         debug=False,
+        token_cache=None,
+        tokenizer="spacy",
     ):
-        super().__init__(name)
+        super().__init__(name, token_cache=token_cache)
         self.input_file = input_file
         self.output_file = output_file
         self.log_file = log_file
         self.hotpotqa_ks = load_ks(ks_directory, verbose=True)
-        self.nlp = spacy.load("en_core_web_sm")
+        self.nlp = load_tokenizer(tokenizer)
         self.max_chunks = max_chunks
         self.debug = debug
         self.get_only_original_evidence = get_only_original_evidence
@@ -83,6 +85,7 @@ class HotpotQADataset(Dataset):
 
             local_missing_page = False
             local_exact_match = True
+            evidences = []
             for evidence in datapoint["supporting_facts"]:
                 title = evidence[0]
                 sent_id = evidence[1]
@@ -106,7 +109,25 @@ class HotpotQADataset(Dataset):
                     if len(pages) == 0:
                         local_missing_page = True
                         break
+                    evidences.append((text, pages))
+
+            if not local_missing_page:
+                # match all the supporting facts of the datapoint in one batch
+                matches = iter(
+                    utils.match_answers_batch(
+                        [
+                            (text, page)
+                            for text, pages in evidences
+                            for page in pages
+                            if text and len(text) > 0
+                        ],
+                        nlp=self.nlp,
+                        debug=False,
+                        token_cache=self.token_cache,
+                    )
+                )
 
+                for text, pages in evidences:
                     bleu = -1
                     paragraph_id = -1
                     start_character = -1
@@ -119,9 +140,7 @@ class HotpotQADataset(Dataset):
                                 local_start_character,
                                 local_end_character,
                                 local_bleu,
-                            ) = utils.match_answer(
-                                text, page, nlp=self.nlp, debug=False
-                            )
+                            ) = next(matches)
 
                             if local_bleu > bleu:
                                 paragraph_id = local_paragraph_id
@@ -8,20 +8,30 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import json
-import spacy
 import sys
 import re
 import kilt.kilt_utils as utils
 from kilt.datasets.base_dataset import Dataset
+from kilt.tokenizer import load_tokenizer
 
 
 class NaturalQuestionsDataset(Dataset):
-    def __init__(self, name, input_file, output_file, log_file):
-        super().__init__(name)
+    streaming = True
+
+    def __init__(
+        self,
+        name,
+        input_file,
+        output_file,
+        log_file,
+        token_cache=None,
+        tokenizer="spacy",
+    ):
+        super().__init__(name, token_cache=token_cache)
         self.input_file = input_file
         self.output_file = output_file
         self.log_file = log_file
-        self.nlp = spacy.load("en_core_web_sm")
+        self.nlp = load_tokenizer(tokenizer)
 
     def get_chunks(self, num_chunks):
         all_data = []
@@ -34,6 +44,30 @@ class NaturalQuestionsDataset(Dataset):
         print("{} examples in the dataset".format(n))
         return utils.chunk_it(all_data, num_chunks)
 
+    def iter_records(self):
+        with open(self.input_file, "r") as infile:
+            for line in infile:
+                yield json.loads(line)
+
+    def get_answer_spans(self, annotations, document_text):
+        """
+        Returns the text of the short and long answers of the annotations,
+        in the order they are mapped.
+        """
+        document_tokens = document_text.split()
+        answer_spans = []
+        for annotation in annotations:
+            if "short_answers" in annotation:
+                for short_answer in annotation["short_answers"]:
+                    s = short_answer["start_token"]
+                    e = short_answer["end_token"]
+                    answer_spans.append(" ".join(document_tokens[s:e]).strip())
+            if "long_answer" in annotation:
+                s = annotation["long_answer"]["start_token"]
+                e = annotation["long_answer"]["end_token"]
+                answer_spans.append(" ".join(document_tokens[s:e]).strip())
+        return answer_spans
+
     def process_chunk(self, chunk, ks, chunk_id=-1):
         missing_pages = 0.0
         short_exact_match = 0.0
@@ -83,6 +117,20 @@ class NaturalQuestionsDataset(Dataset):
                 local_sem = 0.0
                 local_sfm = 0.0
 
+                # match all the answers of the datapoint in one batch
+                answer_spans = self.get_answer_spans(
+                    annotations, datapoint["document_text"]
+                )
+                matches = zip(
+                    answer_spans,
+                    utils.match_answers_batch(
+                        [(answer_span, page) for answer_span in answer_spans],
+                        nlp=self.nlp,
+                        debug=False,
+                        token_cache=self.token_cache,
+                    ),
+                )
+
                 for annotation in annotations:
 
                     if "short_answers" in annotation:
@@ -90,19 +138,10 @@ class NaturalQuestionsDataset(Dataset):
 
                         # scan all possible short answers
                         for answer_index in range(len(short_answers)):
-                            s = short_answers[answer_index]["start_token"]
-                            e = short_answers[answer_index]["end_token"]
-                            short_answer = datapoint["document_text"].split()[s:e]
-                            answer_span = " ".join(short_answer).strip()
-
                             (
-                                paragraph_id,
-                                start_character,
-                                end_character,
-                                bleu,
-                            ) = utils.match_answer(
-                                answer_span, page, nlp=self.nlp, debug=False
-                            )
+                                answer_span,
+                                (paragraph_id, start_character, end_character, bleu),
+                            ) = next(matches)
 
                             kilt_record_output.append(
                                 {
@@ -145,21 +184,10 @@ class NaturalQuestionsDataset(Dataset):
 
                     if "long_answer" in annotation:
 
-                        long_answer = annotation["long_answer"]
-
-                        s = long_answer["start_token"]
-                        e = long_answer["end_token"]
-                        long_answer = datapoint["document_text"].split()[s:e]
-                        answer_span = " ".join(long_answer).strip()
-
                         (
-                            paragraph_id,
-                            start_character,
-                            end_character,
-                            bleu,
-                        ) = utils.match_answer(
-                            answer_span, page, nlp=self.nlp, debug=False
-                        )
+                            answer_span,
+                            (paragraph_id, start_character, end_character, bleu),
+                        ) = next(matches)
 
                         kilt_record_output.append(
                             {
@@ -8,21 +8,29 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import json
-import spacy
 import sys
 import re
 import kilt.kilt_utils as utils
 from kilt.datasets.base_dataset import Dataset
+from kilt.tokenizer import load_tokenizer
 from kilt import knowledge_source # remove later
 
 
 class TriviaQADataset(Dataset):
-    def __init__(self, name, input_file, output_file, log_file):
-        super().__init__(name)
+    def __init__(
+        self,
+        name,
+        input_file,
+        output_file,
+        log_file,
+        token_cache=None,
+        tokenizer="spacy",
+    ):
+        super().__init__(name, token_cache=token_cache)
         self.input_file = "/private/home/angelafan/robocheckers/KIB/wikipedia-test.json"
         self.output_file = output_file
         self.log_file = log_file
-        self.nlp = spacy.load("en_core_web_sm")
+        self.nlp = load_tokenizer(tokenizer)
 
     def get_chunks(self, num_chunks):
         with open(self.input_file, "r", encoding='utf-8') as infile:
@@ -62,10 +70,26 @@ class TriviaQADataset(Dataset):
             wiki_titles = [i["Title"] for i in wikipedia_pages]
             dataset_id = datapoint["QuestionId"]
 
+            # match all the (answer, page) pairs of the question in one batch
+            title_pages = {title: ks.get_pages_by_title(title) for title in wiki_titles}
+            matches = iter(
+                utils.match_answers_batch(
+                    [
+                        (answer, title_pages[title][0])
+                        for answer in answers
+                        for title in wiki_titles
+                        if title_pages[title]
+                    ],
+                    nlp=self.nlp,
+                    debug=False,
+                    token_cache=self.token_cache,
+                )
+            )
+
             # group by question,
             for answer_index, answer in enumerate(answers):
                 for title in wiki_titles:
-                    page = ks.get_pages_by_title(title)
+                    page = title_pages[title]
                     if not page:
                         missing_pages += 1 # metric will be inflated since its on each unfetchable page
                     else:
@@ -88,9 +112,7 @@ class TriviaQADataset(Dataset):
                             start_character,
                             end_character,
                             bleu,
-                        ) = utils.match_answer(
-                            answer_span, page, nlp=self.nlp, debug=False
-                        )
+                        ) = next(matches)
 
                         kilt_record_output = {
                             # answer in textual form
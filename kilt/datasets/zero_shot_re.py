@@ -4,20 +4,33 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
-import spacy
 import uuid
 
 import kilt.kilt_utils as utils
 from kilt.datasets.base_dataset import Dataset
+from kilt.tokenizer import load_tokenizer
+
+# number of datapoints whose sentences are matched in one batch
+MATCH_BATCH_SIZE = 64
 
 
 class ZeroShotREDataset(Dataset):
-    def __init__(self, name, input_file, output_file, max_chunks):
-        super().__init__(name)
+    streaming = True
+
+    def __init__(
+        self,
+        name,
+        input_file,
+        output_file,
+        max_chunks,
+        token_cache=None,
+        tokenizer="spacy",
+    ):
+        super().__init__(name, token_cache=token_cache)
         self.input_file = input_file
         self.output_file = output_file
         self.max_chunks = max_chunks
-        self.nlp = spacy.load("en_core_web_sm")
+        self.nlp = load_tokenizer(tokenizer)
 
     def get_uuid(self):
         return str(uuid.uuid4())
@@ -29,8 +42,9 @@ class ZeroShotREDataset(Dataset):
         wikipedia_title,
         sentence,
         answer_spans,
-        ks,
+        pages,
         entry_id,
+        match=None,
     ):
         kilt_entry = {}
         kilt_entry["id"] = entry_id
@@ -42,21 +56,24 @@ class ZeroShotREDataset(Dataset):
             "wikidata_relation": wikidata_relation,
             "question_template": question_template,
         }
-        print("Getting wiki page for", wikipedia_title)
-        pages = ks.get_pages_by_title(wikipedia_title)
-
         if len(pages) <= 0:
             kilt_entry["output"] = [
                 {"answer": answer_span, "provenance": []}
                 for answer_span in answer_spans
             ]
             return kilt_entry
-        print("matching answer")
         # We take the first returned page from the list.
-        paragraph_id, start_character, end_character, bleu = utils.match_answer(
-            sentence, pages[0], nlp=self.nlp, debug=False
-        )
-        print("done matching answer")
+        if match is None:
+            print("matching answer")
+            match = utils.match_answer(
+                sentence,
+                pages[0],
+                nlp=self.nlp,
+                debug=False,
+                token_cache=self.token_cache,
+            )
+            print("done matching answer")
+        paragraph_id, start_character, end_character, bleu = match
 
         for answer_span in answer_spans:
             output = {"answer": answer_span, "provenance": []}
@@ -81,36 +98,61 @@ class ZeroShotREDataset(Dataset):
             data = fin.readlines()
         return utils.chunk_it(data, num_chunks)
 
+    def iter_records(self):
+        with open(self.input_file, "r") as fin:
+            yield from fin
+
     def process_chunk(self, chunk, ks, chunk_id):
         kilt_data = []
         missing_pages = 0
         negative_samples = 0
-        for i, line in enumerate(chunk):
-            print("Processed {} lines for chunk {}".format(i, chunk_id))
-            print("Processing:", line)
-            fields = line.strip().split("\t")
-            # Leave out negative samples (samples where one can't infer the
-            # answer from the provided sentence).
-            if len(fields) <= 4:
-                negative_samples += 1
-                continue
-            wikidata_relation, question_template, wikipedia_title, sentence = fields[
-                0:4
-            ]
-            answer_spans = fields[4:]
-            kilt_entry = self.map_datapoint(
-                wikidata_relation,
-                question_template,
-                wikipedia_title,
-                sentence,
-                answer_spans,
-                ks,
-                self.get_uuid(),
+        for batch_start in range(0, len(chunk), MATCH_BATCH_SIZE):
+            datapoints = []
+            for i, line in enumerate(
+                chunk[batch_start : batch_start + MATCH_BATCH_SIZE], batch_start
+            ):
+                print("Processed {} lines for chunk {}".format(i, chunk_id))
+                print("Processing:", line)
+                fields = line.strip().split("\t")
+                # Leave out negative samples (samples where one can't infer the
+                # answer from the provided sentence).
+                if len(fields) <= 4:
+                    negative_samples += 1
+                    continue
+                print("Getting wiki page for", fields[2])
+                datapoints.append((fields, ks.get_pages_by_title(fields[2])))
+
+            # match the sentences of the batch on their first page
+            print("matching answers")
+            matches = iter(
+                utils.match_answers_batch(
+                    [(fields[3], pages[0]) for fields, pages in datapoints if pages],
+                    nlp=self.nlp,
+                    debug=False,
+                    token_cache=self.token_cache,
+                )
             )
-            if kilt_entry is None:
-                missing_pages += 1
-                continue
-            kilt_data.append(kilt_entry)
+            print("done matching answers")
+
+            for fields, pages in datapoints:
+                wikidata_relation, question_template, wikipedia_title, sentence = (
+                    fields[0:4]
+                )
+                answer_spans = fields[4:]
+                kilt_entry = self.map_datapoint(
+                    wikidata_relation,
+                    question_template,
+                    wikipedia_title,
+                    sentence,
+                    answer_spans,
+                    pages,
+                    self.get_uuid(),
+                    match=next(matches) if pages else None,
+                )
+                if kilt_entry is None:
+                    missing_pages += 1
+                    continue
+                kilt_data.append(kilt_entry)
         return kilt_data, [missing_pages, negative_samples]
 
     def postprocess_metadata(self, metadata):
@@ -7,12 +7,19 @@
 
 import nltk
 import json
+import math
 import os
 import logging
 import sys
 import time
 import string
 import random
+import bisect
+
+from kilt.token_cache import TokenCache, estimate_index_size
+
+PIPE_BATCH_SIZE = 256
+EXACT_MATCH_SEPARATOR = "\x00"
 
 ENT_START = "[START_ENT]"
 ENT_END = "[END_ENT]"
@@ -132,6 +139,153 @@ def get_bleu(candidate_tokens, gold_tokens):
     return BLEUscore
 
 
+def _bleu_weights(gold_tokens):
+    # same weights as get_bleu
+    if len(gold_tokens) < 4:
+        return [1.0 / len(gold_tokens) for _ in range(len(gold_tokens))]
+    return (0.25, 0.25, 0.25, 0.25)
+
+
+def _bleu_from_counts(numerators, denominators, weights, candidate_len, gold_len):
+    # sentence_bleu (no smoothing) from the clipped n-gram counts, with the
+    # same floating point operations, so that the scores are identical
+    if numerators[0] == 0:
+        return 0
+    if gold_len > candidate_len:
+        bp = 1
+    else:
+        bp = math.exp(1 - candidate_len / gold_len)
+    s = (
+        w * math.log(numerator / denominator if numerator else sys.float_info.min)
+        for w, numerator, denominator in zip(weights, numerators, denominators)
+    )
+    return bp * math.exp(math.fsum(s))
+
+
+def find_bleu_span(
+    paragraph_tokens, answer_tokens, max_bleu=None, start_token=None, end_token=None
+):
+    """
+    Scans all the [init, end] token windows of a paragraph for the one
+    with the highest get_bleu(window, answer_tokens), continuing the search
+    state (max_bleu, start_token, end_token) of match_answer, with the same
+    tie-break (the shortest span wins) and stopping at the first perfect
+    score. Returns the updated (max_bleu, start_token, end_token, updated),
+    updated telling whether the best span is now in this paragraph.
+
+    The clipped n-gram counts are updated incrementally as end advances and
+    the windows whose BLEU cannot reach max_bleu are skipped: the brevity
+    penalty only decreases with the window length and the unigram precision
+    is bounded by the answer tokens left in the paragraph.
+    """
+    updated = False
+    gold = [x for x in answer_tokens if len(x.strip()) > 0]
+    if not gold:
+        # get_bleu is always 0, keep the plain scan
+        for init in range(len(paragraph_tokens)):
+            for end in range(init, len(paragraph_tokens)):
+                BLEU = get_bleu(paragraph_tokens[init : end + 1], answer_tokens)
+                if (
+                    not max_bleu
+                    or BLEU > max_bleu
+                    or (
+                        BLEU == max_bleu
+                        and end_token
+                        and start_token
+                        and (end + 1 - init) < (end_token - start_token)
+                    )
+                ):
+                    max_bleu = BLEU
+                    start_token = init
+                    end_token = end
+                    updated = True
+        return max_bleu, start_token, end_token, updated
+
+    weights = _bleu_weights(gold)
+    orders = len(weights)
+    gold_counts = []
+    denominators = []
+    for n in range(1, orders + 1):
+        counts = {}
+        for i in range(len(gold) - n + 1):
+            ngram = tuple(gold[i : i + n])
+            counts[ngram] = counts.get(ngram, 0) + 1
+        gold_counts.append(counts)
+        denominators.append(max(1, len(gold) - n + 1))
+    gold_unigrams = set(gold)
+
+    # hits[i]: tokens in paragraph_tokens[i:] that are answer tokens
+    hits = [0] * (len(paragraph_tokens) + 1)
+    for i in range(len(paragraph_tokens) - 1, -1, -1):
+        hits[i] = hits[i + 1] + (
+            1
+            if len(paragraph_tokens[i].strip()) > 0
+            and paragraph_tokens[i] in gold_unigrams
+            else 0
+        )
+
+    def can_reach(unigram_matches):
+        # upper bound of the BLEU of a window with that many unigram matches
+        # (slightly loosened so that rounding never prunes a reachable score)
+        p1 = min(1.0, unigram_matches / denominators[0])
+        return not max_bleu or p1 ** weights[0] * (1 + 1e-9) >= max_bleu
+
+    for init in range(len(paragraph_tokens)):
+        if not can_reach(hits[init]):
+            # hits is non-increasing, so no later window can do better
+            break
+        window = []
+        span_counts = [{} for _ in range(orders)]
+        numerators = [0] * orders
+        for end in range(init, len(paragraph_tokens)):
+            token = paragraph_tokens[end]
+            if len(token.strip()) > 0:
+                window.append(token)
+                for n in range(1, min(orders, len(window)) + 1):
+                    ngram = tuple(window[-n:])
+                    gold_count = gold_counts[n - 1].get(ngram)
+                    if gold_count:
+                        count = span_counts[n - 1].get(ngram, 0)
+                        if count < gold_count:
+                            numerators[n - 1] += 1
+                        span_counts[n - 1][ngram] = count + 1
+
+            BLEU = _bleu_from_counts(
+                numerators, denominators, weights, len(window), len(gold)
+            )
+
+            # if there is the same BLEU, the shortest answer should win
+            if (
+                not max_bleu
+                or BLEU > max_bleu
+                or (
+                    BLEU == max_bleu
+                    and end_token
+                    and start_token
+                    and (end + 1 - init) < (end_token - start_token)
+                )
+            ):
+                max_bleu = BLEU
+                start_token = init
+                end_token = end
+                updated = True
+
+            if max_bleu == 1:
+                break
+
+            # longer windows have a smaller brevity penalty and at most
+            # hits[end + 1] more unigram matches
+            if max_bleu and len(window) >= len(gold):
+                if math.exp(1 - len(window) / len(gold)) < max_bleu:
+                    break
+            if not can_reach(numerators[0] + hits[end + 1]):
+                break
+        if max_bleu == 1:
+            break
+
+    return max_bleu, start_token, end_token, updated
+
+
 # split a list in num parts evenly
 def chunk_it(seq, num):
     assert num > 0
@@ -193,6 +347,118 @@ def create_logdir_with_timestamp(base_logdir):
     return log_directory
 
 
+def tokenize_paragraph(paragraph, nlp=None, normalize_text=True, doc=None):
+    """
+    Returns the tokens of a paragraph and their character offsets, as used
+    by match_answer: the tokens of nlp (a spacy pipeline or a
+    kilt.tokenizer.RegexTokenizer) when given, whitespace tokens (with
+    unreliable 0 offsets) otherwise. doc is nlp(paragraph) if already
+    computed.
+    """
+    paragraph_tokens = []
+    paragraph_offsets = []
+
+    if nlp == None:
+        for token in paragraph.split():
+            paragraph_tokens.append(token)
+            paragraph_offsets.append(0)  # offset are unreliable without nlp
+    else:
+        for token in nlp(paragraph) if doc is None else doc:
+            paragraph_tokens.append(token.text)
+            # idx	int	The character offset of the token within the parent document.
+            paragraph_offsets.append(token.idx)
+
+    if normalize_text:
+        # Remove “characters with encodings larger than 3 bytes” using Python 3
+        paragraph_tokens = [
+            normalize_answer(
+                "".join(char for char in x if len(char.encode("utf-8")) < 3)
+            )
+            for x in paragraph_tokens
+        ]
+
+    return paragraph_tokens, paragraph_offsets
+
+
+def _token_cache_key(page, paragraph_id, nlp, normalize_text):
+    return (
+        str(page["wikipedia_id"]),
+        paragraph_id,
+        normalize_text,
+        "split" if nlp == None else getattr(nlp, "tokenizer_name", "nlp"),
+    )
+
+
+def get_paragraph_tokens(
+    page, paragraph_id, nlp=None, normalize_text=True, token_cache=None
+):
+    """
+    tokenize_paragraph for the paragraph_id-th paragraph of page, plus the
+    set of its tokens. Results are looked up in and stored to token_cache
+    (a kilt.token_cache.TokenCache) when given and the page has an id.
+    """
+    paragraph = page["text"][paragraph_id]
+    if token_cache is None or page.get("wikipedia_id") is None:
+        paragraph_tokens, paragraph_offsets = tokenize_paragraph(
+            paragraph, nlp, normalize_text
+        )
+        return paragraph_tokens, paragraph_offsets, set(paragraph_tokens)
+
+    key = _token_cache_key(page, paragraph_id, nlp, normalize_text)
+    entry = token_cache.get(key, paragraph)
+    if entry is None:
+        paragraph_tokens, paragraph_offsets = tokenize_paragraph(
+            paragraph, nlp, normalize_text
+        )
+        entry = token_cache.put(key, paragraph, paragraph_tokens, paragraph_offsets)
+    return entry
+
+
+def build_page_token_index(page, normalize_text=True):
+    """
+    Inverted index from the (whitespace, optionally normalized) tokens of
+    the paragraphs of page to the sorted ids of the paragraphs they occur in.
+    """
+    token_index = {}
+    for idx, paragraph in enumerate(page["text"]):
+        paragraph_tokens, _ = tokenize_paragraph(paragraph, None, normalize_text)
+        for token in set(paragraph_tokens):
+            if token not in token_index:
+                token_index[token] = []
+            token_index[token].append(idx)
+    return token_index
+
+
+def get_page_token_index(page, normalize_text=True, token_cache=None):
+    """
+    build_page_token_index, looked up in and stored to token_cache when
+    given and the page has an id.
+    """
+    wikipedia_id = page.get("wikipedia_id")
+    if token_cache is None or wikipedia_id is None:
+        return build_page_token_index(page, normalize_text)
+
+    key = (str(wikipedia_id), None, normalize_text, "split")
+    text = tuple(page["text"])
+    token_index = token_cache.get(key, text)
+    if token_index is None:
+        token_index = build_page_token_index(page, normalize_text)
+        token_cache.put_value(key, text, token_index, estimate_index_size(token_index))
+    return token_index
+
+
+def count_token_intersections(token_index, tokens):
+    """
+    Returns paragraph_id -> number of distinct tokens that occur in the
+    paragraph, for the paragraphs with at least one of them.
+    """
+    counts = {}
+    for token in set(tokens):
+        for idx in token_index.get(token, ()):
+            counts[idx] = counts.get(idx, 0) + 1
+    return counts
+
+
 def match_answer(
     answer,
     page,
@@ -203,7 +469,12 @@ def match_answer(
     normalize_text=True,
     fast=False,
     approximate_search=False,
+    token_cache=None,
+    use_token_index=False,
+    exact_match=None,
 ):
+    # exact_match is the result of find_exact_matches for the answer, if
+    # already computed
     # if nlp == None:
     #    nlp = spacy.load("en_core_web_sm")
 
@@ -238,49 +509,70 @@ def match_answer(
     tokenized_paragraphs = []
     tokenized_paragraphs_offset = []
 
-    for idx, paragraph in enumerate(page["text"]):
+    if use_token_index:
+        # count the intersections on the posting lists of the (whitespace)
+        # answer tokens, and only tokenize the paragraphs that are needed
+        if nlp == None or approximate_search:
+            index_answer_tokens = answer_tokens
+        else:
+            index_answer_tokens = [
+                (
+                    "".join(char for char in x if len(char.encode("utf-8")) < 3).lower()
+                    if normalize_text
+                    else x
+                )
+                for x in answer.split()
+            ]
+        intersections = count_token_intersections(
+            get_page_token_index(page, normalize_text, token_cache),
+            index_answer_tokens,
+        )
 
-        index = paragraph.find(answer)
-        if index >= 0:
-            assert paragraph[index : index + len(answer)] == answer
-            return idx, index, index + len(original_answer), 1.0
+    for idx, paragraph in enumerate(page["text"]):
 
-        index = paragraph.find(original_answer)
-        if index >= 0:
-            assert paragraph[index : index + len(original_answer)] == original_answer
-            return idx, index, index + len(original_answer), 1.0
+        if exact_match is None:
+            index = paragraph.find(answer)
+            if index >= 0:
+                assert paragraph[index : index + len(answer)] == answer
+                return idx, index, index + len(original_answer), 1.0
 
-        paragraph_tokens = []
-        paragraph_offsets = []
+            index = paragraph.find(original_answer)
+            if index >= 0:
+                assert (
+                    paragraph[index : index + len(original_answer)] == original_answer
+                )
+                return idx, index, index + len(original_answer), 1.0
 
-        if nlp == None or approximate_search:
-            seen = ""
-            for token in paragraph.split():
-                paragraph_tokens.append(token)
-                paragraph_offsets.append(0)  # offset are unreliable without nlp
-                seen += str(token) + " "
-        else:
-            for token in nlp(paragraph):
-                paragraph_tokens.append(token.text)
-                # idx	int	The character offset of the token within the parent document.
-                paragraph_offsets.append(token.idx)
+        elif exact_match and exact_match[0] == idx:
+            index = exact_match[1]
+            return idx, index, index + len(original_answer), 1.0
 
-        if normalize_text:
-            # Remove “characters with encodings larger than 3 bytes” using Python 3
-            paragraph_tokens = [
-                normalize_answer(
-                    "".join(char for char in x if len(char.encode("utf-8")) < 3)
-                )
-                for x in paragraph_tokens
-            ]
+        if use_token_index:
+            intersection = intersections.get(idx, 0)
+            if intersection < len(index_answer_tokens):
+                tokenized_paragraphs.append(None)
+                tokenized_paragraphs_offset.append(None)
+                if intersection not in candidate_dict:
+                    candidate_dict[intersection] = []
+                candidate_dict[intersection].append(idx)
+                continue
+
+        paragraph_tokens, paragraph_offsets, paragraph_token_set = get_paragraph_tokens(
+            page,
+            idx,
+            None if approximate_search else nlp,
+            normalize_text,
+            token_cache,
+        )
 
         tokenized_paragraphs.append(paragraph_tokens)
         tokenized_paragraphs_offset.append(paragraph_offsets)
 
         # token intersection
-        intersection = len(set(paragraph_tokens).intersection(set(answer_tokens)))
+        if not use_token_index:
+            intersection = len(paragraph_token_set.intersection(answer_tokens))
 
-        if intersection == len(answer_tokens):
+        if use_token_index or intersection == len(answer_tokens):
             # I found all the tokens, let me see if there is a perfect match
             ax = " ".join([x.strip() for x in answer_tokens if len(x.strip()) > 0])
             for w_start in range(len(paragraph_tokens)):
@@ -338,16 +630,25 @@ def match_answer(
     if fast:
         return candidate_idx[0], -1, -1, -1
 
+    for idx in candidate_idx:
+        if tokenized_paragraphs[idx] is None:
+            paragraph_tokens, paragraph_offsets, _ = get_paragraph_tokens(
+                page,
+                idx,
+                None if approximate_search else nlp,
+                normalize_text,
+                token_cache,
+            )
+            tokenized_paragraphs[idx] = paragraph_tokens
+            tokenized_paragraphs_offset[idx] = paragraph_offsets
+
     if nlp != None and approximate_search:
         # now get the proper tokenized version for the candidate idx and answer
         answer_tokens = [token.text for token in nlp(answer)]
         for idx in candidate_idx:
-            paragraph_tokens = []
-            paragraph_offsets = []
-            for token in nlp(page["text"][idx]):
-                paragraph_tokens.append(token.text)
-                # idx	int	The character offset of the token within the parent document.
-                paragraph_offsets.append(token.idx)
+            paragraph_tokens, paragraph_offsets, _ = get_paragraph_tokens(
+                page, idx, nlp, False, token_cache
+            )
             tokenized_paragraphs[idx] = paragraph_tokens
             tokenized_paragraphs_offset[idx] = paragraph_offsets
 
@@ -369,34 +670,11 @@ def match_answer(
         # fuzzy match
         if not found:
 
-            # TODO: add span tollerance to speed up! Not sure about this
-            # SPAN_TOLLERANCE = int(len(answer_tokens) / 2)
-
-            for init in range(len(paragraph_tokens)):
-                for end in range(init, len(paragraph_tokens)):
-                    candidate = paragraph_tokens[init : end + 1]
-                    BLEU = get_bleu(candidate, answer_tokens)
-
-                    # if there is the same BLEU, the shortest answer should win
-                    if (
-                        not max_bleu
-                        or BLEU > max_bleu
-                        or (
-                            BLEU == max_bleu
-                            and end_token
-                            and start_token
-                            and (end + 1 - init) < (end_token - start_token)
-                        )
-                    ):
-                        max_bleu = BLEU
-                        paragraph_id = idx
-                        start_token = init
-                        end_token = end
-
-                    if max_bleu == 1:
-                        break
-                if max_bleu == 1:
-                    break
+            max_bleu, start_token, end_token, updated = find_bleu_span(
+                paragraph_tokens, answer_tokens, max_bleu, start_token, end_token
+            )
+            if updated:
+                paragraph_id = idx
             if max_bleu == 1:
                 break
 
@@ -432,3 +710,136 @@ def match_answer(
         end_character = paragraph_offsets[end_token] + len(paragraph_tokens[end_token])
 
     return paragraph_id, start_character, end_character, max_bleu
+
+
+def find_exact_matches(answers, page, normalize_text=True):
+    """
+    Returns, for each answer, the (paragraph_id, start_character) of its
+    first exact occurrence in page as match_answer finds it (the normalized
+    answer first, then the answer as is), or False if there is none. The
+    paragraphs are joined once, so that each variant of each answer is
+    searched with a single scan of the page; answers that could match
+    across the separator are None (to be searched paragraph by paragraph).
+    """
+    paragraphs = page["text"]
+    text = EXACT_MATCH_SEPARATOR.join(paragraphs)
+    starts = []
+    start = 0
+    for paragraph in paragraphs:
+        starts.append(start)
+        start += len(paragraph) + len(EXACT_MATCH_SEPARATOR)
+
+    def first_occurrence(variant):
+        index = text.find(variant)
+        if index < 0:
+            return None
+        paragraph_id = bisect.bisect_right(starts, index) - 1
+        return paragraph_id, index - starts[paragraph_id]
+
+    exact_matches = []
+    for answer in answers:
+        variants = [normalize_answer(answer) if normalize_text else answer, answer]
+        if any(EXACT_MATCH_SEPARATOR in variant for variant in variants):
+            exact_matches.append(None)
+            continue
+        occurrences = []
+        if paragraphs:
+            occurrences = [x for x in map(first_occurrence, variants) if x]
+        if not occurrences:
+            exact_matches.append(False)
+            continue
+        # the normalized answer wins within the same paragraph
+        paragraph_id = min(x[0] for x in occurrences)
+        exact_matches.append(next(x for x in occurrences if x[0] == paragraph_id))
+    return exact_matches
+
+
+def _paragraphs_to_tokenize(answer, page, normalize_text, exact_match):
+    # the paragraphs scanned by match_answer before an exact string match
+    if exact_match is None:
+        original_answer = answer
+        if normalize_text:
+            answer = normalize_answer(answer)
+        for idx, paragraph in enumerate(page["text"]):
+            if paragraph.find(answer) >= 0 or paragraph.find(original_answer) >= 0:
+                break
+            yield idx
+    else:
+        yield from range(exact_match[0] if exact_match else len(page["text"]))
+
+
+def match_answers_batch(
+    pairs, nlp=None, token_cache=None, batch_size=PIPE_BATCH_SIZE, n_process=1, **kwargs
+):
+    """
+    Returns the match_answer results for each (answer, page) of pairs. The
+    paragraphs match_answer tokenizes with nlp are first collected across
+    all the pairs, deduplicated and tokenized with a single nlp.pipe call
+    (only the tokenizer runs, the pipeline components are disabled).
+    The exact matches of all the answers of a page are searched first (see
+    find_exact_matches), and only the paragraphs before them tokenized.
+    Other keyword arguments are passed to match_answer. The tokenizations
+    are stored in token_cache, which should be large enough to hold the
+    ones of a whole batch (by default, an unbounded cache for the batch).
+    """
+    if token_cache is None:
+        token_cache = TokenCache(float("inf"))
+    normalize_text = kwargs.get("normalize_text", True)
+
+    # exact matching pass, with a single scan of each page per answer
+    answers_by_page = {}
+    for i, (answer, page) in enumerate(pairs):
+        if id(page) not in answers_by_page:
+            answers_by_page[id(page)] = (page, [])
+        answers_by_page[id(page)][1].append(i)
+    exact_matches = [None] * len(pairs)
+    for page, indexes in answers_by_page.values():
+        for i, exact_match in zip(
+            indexes,
+            find_exact_matches([pairs[i][0] for i in indexes], page, normalize_text),
+        ):
+            exact_matches[i] = exact_match
+
+    if (
+        nlp != None
+        and not kwargs.get("approximate_search")
+        and not kwargs.get("use_token_index")
+    ):
+        keys = {}  # paragraph -> cache keys
+        for (answer, page), exact_match in zip(pairs, exact_matches):
+            if page.get("wikipedia_id") is None:
+                continue
+            for idx in _paragraphs_to_tokenize(
+                answer, page, normalize_text, exact_match
+            ):
+                paragraph = page["text"][idx]
+                key = _token_cache_key(page, idx, nlp, normalize_text)
+                if not token_cache.contains(key, paragraph):
+                    if paragraph not in keys:
+                        keys[paragraph] = []
+                    keys[paragraph].append(key)
+
+        docs = nlp.pipe(
+            keys.keys(),
+            batch_size=batch_size,
+            n_process=n_process,
+            disable=getattr(nlp, "pipe_names", []),
+        )
+        for (paragraph, paragraph_keys), doc in zip(keys.items(), docs):
+            paragraph_tokens, paragraph_offsets = tokenize_paragraph(
+                paragraph, nlp, normalize_text, doc=doc
+            )
+            for key in paragraph_keys:
+                token_cache.put(key, paragraph, paragraph_tokens, paragraph_offsets)
+
+    return [
+        match_answer(
+            answer,
+            page,
+            nlp=nlp,
+            token_cache=token_cache,
+            exact_match=exact_match,
+            **kwargs
+        )
+        for (answer, page), exact_match in zip(pairs, exact_matches)
+    ]
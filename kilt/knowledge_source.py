@@ -4,6 +4,17 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import json
+import mmap
+import os
+import threading
+import time
+import weakref
+
 from pymongo import MongoClient
 import requests
 from urllib.parse import unquote
@@ -12,7 +23,53 @@ from bs4 import BeautifulSoup
 import urllib.parse as urlparse
 from urllib.parse import parse_qs
 
+from kilt.ks.offset_index import (
+    ANCHOR_GRAPH_DIRECTORY,
+    CATEGORY_INDEX_DIRECTORY,
+    INDEXED_FIELDS,
+    PAGE_FILTER_DIRECTORY,
+    PARAGRAPH_STORE_DIRECTORY,
+    TITLE_INDEX_DIRECTORY,
+    URL_INDEX_DIRECTORY,
+    OffsetIndex,
+    build_offset_index,
+    default_index_directory,
+    is_valid_index,
+    iter_records,
+)
+from kilt.ks.anchor_graph import AnchorGraph, is_anchor_graph
+from kilt.ks.block_store import BlockStore
+from kilt.ks.bloom_filter import PageFilter, is_page_filter
+from kilt.ks.category_index import CategoryIndex, is_category_index
+from kilt.ks.lookup_stats import LookupStats
+from kilt.ks.page_cache import PageCache
+from kilt.ks.paragraph_store import ParagraphStore, is_paragraph_store
+from kilt.ks.url_index import UrlIndex, is_url_index, parse_wikipedia_url
+from kilt.ks.title_index import (
+    TitleIndex,
+    build_title_index,
+    is_title_index,
+    rank_candidates,
+)
+
 DEFAULT_MONGO_CONNECTION_STRING = "mongodb://127.0.0.1:27017/admin"
+BULK_QUERY_SIZE = 1000
+# $slice count of a paragraph range open at the end
+MAX_SLICE = 2**31 - 1
+
+# the mongoDB knowledge sources whose client lock is reset in a forked child
+_client_locks = weakref.WeakSet()
+
+
+def _reset_client_locks():
+    # a lock held by another thread of the parent at the fork stays locked
+    # in the child, where that thread does not exist
+    for ks in list(_client_locks):
+        ks._client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_client_locks)
 
 
 def _get_pageid_from_api(title, client=None):
@@ -67,34 +124,386 @@ def _get_title_from_wikipedia_url(url, client=None):
     return title
 
 
-class KnowledgeSource:
-    def __init__(
-        self,
-        mongo_connection_string=None,
-        database="kilt",
-        collection="knowledgesource",
-    ):
-        if not mongo_connection_string:
-            mongo_connection_string = DEFAULT_MONGO_CONNECTION_STRING
-        self.client = MongoClient(mongo_connection_string)
-        self.db = self.client[database][collection]
+def project_page(page, fields=None, paragraphs=None):
+    """
+    Restricts a page to the given top-level fields (plus _id, as mongoDB
+    does) and its text to the paragraphs in the range paragraphs=(start, end).
+    """
+    if page is None or (fields is None and paragraphs is None):
+        return page
+    if fields is None:
+        projected = dict(page)
+    else:
+        projected = {
+            field: page[field] for field in ["_id"] + list(fields) if field in page
+        }
+    if paragraphs is not None and "text" in projected:
+        start, end = paragraphs
+        projected["text"] = projected["text"][start:end]
+    return projected
+
+
+def copy_page(page, fields=None, paragraphs=None):
+    """
+    Returns a shallow copy of a cached page, projected as project_page does,
+    with its own text list so that changing it does not change the cache.
+    """
+    if page is None:
+        return None
+    page = dict(project_page(page, fields, paragraphs))
+    if "text" in page:
+        page["text"] = list(page["text"])
+    return page
 
+
+def _instrumented(method):
+    """Records the latency and result size of a lookup in lookup_stats."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.lookup_stats is None:
+            return method(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+        except Exception:
+            self.lookup_stats.record(
+                method.__name__, time.perf_counter() - start, args=args, error=True
+            )
+            raise
+        self.lookup_stats.record(
+            method.__name__, time.perf_counter() - start, result, args
+        )
+        return result
+
+    return wrapper
+
+
+class BaseKnowledgeSource(ABC):
+    """
+    Subclasses implement the _fetch_* methods against their storage; the
+    public lookups add the optional page cache on top.
+    """
+
+    # optional kilt.ks.title_index.TitleIndex used by get_pages_by_title
+    title_index = None
+    # optional kilt.ks.page_cache.PageCache shared by all lookups
+    page_cache = None
+    # optional kilt.ks.url_index.UrlIndex used by get_page_from_url
+    url_index = None
+    # optional kilt.ks.paragraph_store.ParagraphStore used by get_paragraph
+    paragraph_store = None
+    # optional kilt.ks.anchor_graph.AnchorGraph used by get_out_links / get_in_links
+    anchor_graph = None
+    # optional kilt.ks.category_index.CategoryIndex used by category / qid lookups
+    category_index = None
+    # optional kilt.ks.bloom_filter.PageFilter skipping lookups that cannot succeed
+    page_filter = None
+    # optional kilt.ks.lookup_stats.LookupStats recording the lookups
+    lookup_stats = None
+
+    def enable_page_cache(self, max_bytes):
+        """Caches pages in a LRU cache holding about max_bytes of pages."""
+        self.page_cache = PageCache(max_bytes)
+        return self.page_cache
+
+    def enable_lookup_stats(self, slow_threshold=None):
+        """
+        Records call counts, latencies and returned bytes of the lookups,
+        logging the ones slower than slow_threshold seconds.
+        """
+        self.lookup_stats = LookupStats(slow_threshold)
+        return self.lookup_stats
+
+    def _count_event(self, name):
+        if self.lookup_stats is not None:
+            self.lookup_stats.count_event(name)
+
+    def open_paragraph_store(self, directory):
+        """Serves get_paragraph / get_span from a paragraph store."""
+        self.paragraph_store = ParagraphStore(directory)
+        return self.paragraph_store
+
+    def open_anchor_graph(self, directory):
+        """Serves get_out_links / get_in_links from an anchor graph."""
+        self.anchor_graph = AnchorGraph(directory)
+        return self.anchor_graph
+
+    def open_category_index(self, directory):
+        """Serves category and wikidata id lookups from a category index."""
+        self.category_index = CategoryIndex(directory)
+        return self.category_index
+
+    def open_page_filter(self, directory):
+        """Skips the id and title lookups of pages certainly not stored."""
+        self.page_filter = PageFilter(directory)
+        return self.page_filter
+
+    def _close_indexes(self):
+        for index in [
+            self.title_index,
+            self.url_index,
+            self.paragraph_store,
+            self.anchor_graph,
+            self.category_index,
+            self.page_filter,
+        ]:
+            if index is not None:
+                index.close()
+
+    def _may_have_id(self, wikipedia_id):
+        return self.page_filter is None or self.page_filter.might_contain_id(
+            wikipedia_id
+        )
+
+    def _may_have_title(self, wikipedia_title):
+        return self.page_filter is None or self.page_filter.might_contain_title(
+            wikipedia_title
+        )
+
+    @abstractmethod
     def get_all_pages_cursor(self):
-        cursor = self.db.find({})
-        return cursor
+        raise NotImplementedError
 
+    @abstractmethod
     def get_num_pages(self):
-        return self.db.estimated_document_count()
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_partition(self, partition, num_partitions):
+        """
+        Iterates over one of num_partitions disjoint slices of the knowledge
+        source, so that several processes or nodes can scan it in parallel.
+        The union of all the partitions contains every page exactly once.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def _fetch_page_by_id(self, wikipedia_id, fields=None, paragraphs=None):
+        raise NotImplementedError
 
-    def get_page_by_id(self, wikipedia_id):
-        page = self.db.find_one({"_id": str(wikipedia_id)})
+    @abstractmethod
+    def _fetch_page_by_title(self, wikipedia_title, fields=None, paragraphs=None):
+        raise NotImplementedError
+
+    def _fetch_pages_by_ids(self, wikipedia_ids, fields=None):
+        return [
+            self._fetch_page_by_id(wikipedia_id, fields)
+            for wikipedia_id in wikipedia_ids
+        ]
+
+    def _fetch_pages_by_titles(self, wikipedia_titles, fields=None):
+        return [self._fetch_page_by_title(title, fields) for title in wikipedia_titles]
+
+    @_instrumented
+    def get_page_by_id(self, wikipedia_id, fields=None, paragraphs=None):
+        """
+        Returns the page with the given wikipedia id or None.
+        fields (e.g. ["wikipedia_title", "text"]) restricts the returned
+        top-level fields and paragraphs=(start, end) returns only
+        text[start:end], so that only the needed data is read and decoded.
+        """
+        if self.page_cache is not None:
+            page = self.page_cache.get(wikipedia_id)
+            if page is not None:
+                return copy_page(page, fields, paragraphs)
+        if not self._may_have_id(wikipedia_id):
+            return None
+        page = self._fetch_page_by_id(wikipedia_id, fields, paragraphs)
+        full_page = fields is None and paragraphs is None
+        if page and self.page_cache is not None and full_page:
+            self.page_cache.put(page)
+            return copy_page(page)
         return page
 
-    def get_page_by_title(self, wikipedia_title, attempt=0):
-        page = self.db.find_one({"wikipedia_title": str(wikipedia_title)})
+    @_instrumented
+    def get_page_by_title(
+        self, wikipedia_title, attempt=0, fields=None, paragraphs=None
+    ):
+        """Same as get_page_by_id, for an exact title."""
+        if self.page_cache is not None:
+            page = self.page_cache.get_by_title(str(wikipedia_title))
+            if page is not None:
+                return copy_page(page, fields, paragraphs)
+        if not self._may_have_title(wikipedia_title):
+            return None
+        page = self._fetch_page_by_title(wikipedia_title, fields, paragraphs)
+        full_page = fields is None and paragraphs is None
+        if page and self.page_cache is not None and full_page:
+            self.page_cache.put(page, wikipedia_title=str(wikipedia_title))
+            return copy_page(page)
         return page
 
-    def get_page_from_url(self, url):
+    @_instrumented
+    def get_pages_by_ids(self, wikipedia_ids, fields=None):
+        """
+        Returns the pages for a list of wikipedia ids in input order, with
+        None in place of the ids missing from the knowledge source.
+        fields restricts the returned top-level fields, as in get_page_by_id.
+        """
+        if self.page_cache is None and self.page_filter is None:
+            return self._fetch_pages_by_ids(wikipedia_ids, fields)
+        pages = [None] * len(wikipedia_ids)
+        if self.page_cache is not None:
+            pages = [
+                copy_page(self.page_cache.get(wikipedia_id), fields)
+                for wikipedia_id in wikipedia_ids
+            ]
+        missing = [
+            i
+            for i, page in enumerate(pages)
+            if page is None and self._may_have_id(wikipedia_ids[i])
+        ]
+        fetched = self._fetch_pages_by_ids([wikipedia_ids[i] for i in missing], fields)
+        for i, page in zip(missing, fetched):
+            if page and self.page_cache is not None and fields is None:
+                self.page_cache.put(page)
+                page = copy_page(page)
+            pages[i] = page
+        return pages
+
+    @_instrumented
+    def get_pages_by_titles(self, wikipedia_titles, fields=None):
+        """
+        Returns the pages for a list of titles in input order, with None in
+        place of the titles missing from the knowledge source.
+        """
+        if self.page_cache is None and self.page_filter is None:
+            return self._fetch_pages_by_titles(wikipedia_titles, fields)
+        pages = [None] * len(wikipedia_titles)
+        if self.page_cache is not None:
+            pages = [
+                copy_page(self.page_cache.get_by_title(str(title)), fields)
+                for title in wikipedia_titles
+            ]
+        missing = [
+            i
+            for i, page in enumerate(pages)
+            if page is None and self._may_have_title(wikipedia_titles[i])
+        ]
+        fetched = self._fetch_pages_by_titles(
+            [wikipedia_titles[i] for i in missing], fields
+        )
+        for i, page in zip(missing, fetched):
+            if page and self.page_cache is not None and fields is None:
+                self.page_cache.put(page, wikipedia_title=str(wikipedia_titles[i]))
+                page = copy_page(page)
+            pages[i] = page
+        return pages
+
+    @_instrumented
+    def get_paragraph(self, wikipedia_id, paragraph_id):
+        """Returns the text of paragraph paragraph_id of a page or None."""
+        if self.paragraph_store is not None:
+            return self.paragraph_store.get_paragraph(wikipedia_id, paragraph_id)
+        if paragraph_id < 0:
+            return None
+        page = self.get_page_by_id(
+            wikipedia_id, fields=["text"], paragraphs=(paragraph_id, paragraph_id + 1)
+        )
+        if not page or not page.get("text"):
+            return None
+        return page["text"][0]
+
+    @_instrumented
+    def get_span(self, wikipedia_id, paragraph_id, start_character, end_character):
+        """
+        Returns the text of a provenance span, i.e.
+        text[paragraph_id][start_character:end_character], or None.
+        """
+        if self.paragraph_store is not None:
+            return self.paragraph_store.get_span(
+                wikipedia_id, paragraph_id, start_character, end_character
+            )
+        paragraph = self.get_paragraph(wikipedia_id, paragraph_id)
+        if paragraph is None:
+            return None
+        return paragraph[start_character:end_character]
+
+    @_instrumented
+    def get_out_links(self, wikipedia_id):
+        """
+        Returns the (wikipedia_id, paragraph_id) pairs of the pages linked
+        from a page, paragraph_id being the paragraph of the anchor.
+        Requires an anchor graph (see kilt.ks.anchor_graph).
+        """
+        if self.anchor_graph is None:
+            raise ValueError("no anchor graph, see build_anchor_graph")
+        return self.anchor_graph.out_links(wikipedia_id)
+
+    @_instrumented
+    def get_in_links(self, wikipedia_id):
+        """
+        Returns the (wikipedia_id, paragraph_id) pairs of the pages linking
+        to a page, paragraph_id being the paragraph of the anchor.
+        Requires an anchor graph (see kilt.ks.anchor_graph).
+        """
+        if self.anchor_graph is None:
+            raise ValueError("no anchor graph, see build_anchor_graph")
+        return self.anchor_graph.in_links(wikipedia_id)
+
+    def _get_category_index(self):
+        if self.category_index is None:
+            raise ValueError("no category index, see build_category_index")
+        return self.category_index
+
+    @_instrumented
+    def get_ids_by_category(self, category):
+        """Returns the sorted wikipedia_ids of the pages in a category."""
+        return self._get_category_index().lookup_category(category)
+
+    @_instrumented
+    def get_id_by_qid(self, qid):
+        """Returns the wikipedia_id of the page of a wikidata id or None."""
+        return self._get_category_index().lookup_qid(qid)
+
+    @_instrumented
+    def get_qid_by_id(self, wikipedia_id):
+        """Returns the wikidata id (e.g. "Q42") of a page or None."""
+        return self._get_category_index().get_qid(wikipedia_id)
+
+    @_instrumented
+    def get_page_by_qid(self, qid, fields=None, paragraphs=None):
+        wikipedia_id = self.get_id_by_qid(qid)
+        if wikipedia_id is None:
+            return None
+        return self.get_page_by_id(wikipedia_id, fields=fields, paragraphs=paragraphs)
+
+    @_instrumented
+    def get_pages_by_title(self, wikipedia_title):
+        """
+        Returns all the candidate pages for a title, matching it exactly,
+        case/unicode/underscore insensitively or through an alternate
+        (redirect) title. The exact match comes first.
+        Without a title index only the exact match is returned.
+        """
+        if self.title_index is None:
+            page = self.get_page_by_title(wikipedia_title)
+            return [page] if page else []
+
+        wikipedia_ids = self.title_index.lookup(wikipedia_title)
+        pages = [page for page in self.get_pages_by_ids(wikipedia_ids) if page]
+        return rank_candidates(wikipedia_title, pages)
+
+    @_instrumented
+    def get_page_from_url(self, url, online=None):
+        """
+        Returns the page a wikipedia url points to or None.
+        With an url index the url is resolved locally; the live wikipedia
+        fallback (step 3) is used only when online is True, which is the
+        default without an url index.
+        """
+        if online is None:
+            online = self.url_index is None
+
+        if self.url_index is not None:
+            wikipedia_ids = self.url_index.resolve(url)
+            pages = [page for page in self.get_pages_by_ids(wikipedia_ids) if page]
+            if pages:
+                self._count_event("url_index")
+                _, _, title = parse_wikipedia_url(url)
+                return rank_candidates(title, pages)[0] if title else pages[0]
+
         page = None
 
         # 1. try to look for title in the url
@@ -103,18 +512,623 @@ class KnowledgeSource:
         if "title" in record:
             title = record["title"][0].replace("_", " ")
             page = self.get_page_by_title(title)
+            if page != None:
+                self._count_event("url_title_parameter")
 
         # 2. try another way to look for title in the url
         if page == None:
             title = url.split("/")[-1].replace("_", " ")
             page = self.get_page_by_title(title)
+            if page != None:
+                self._count_event("url_title_path")
 
         # 3. try to retrieve the current wikipedia_id from the url
-        if page == None:
+        if page == None and online:
+            start = time.perf_counter()
             title = _get_title_from_wikipedia_url(url, client=self.client)
             if title:
                 pageid = _get_pageid_from_api(title, client=self.client)
                 if pageid:
                     page = self.get_page_by_id(pageid)
+            if self.lookup_stats is not None:
+                self.lookup_stats.record(
+                    "wikipedia_api", time.perf_counter() - start, args=(url,)
+                )
+            if page != None:
+                self._count_event("url_wikipedia_api")
+
+        if page == None:
+            self._count_event("url_not_found")
 
         return page
+
+
+class KnowledgeSource(BaseKnowledgeSource):
+    """
+    Knowledge source stored in mongoDB. The client is created lazily and
+    again after a fork (MongoClient is not fork-safe), and the object
+    pickles as its connection spec, so it can be passed to
+    multiprocessing workers. A copy starts with an empty page cache and
+    lookup stats if they are enabled; the indexes opened with open_* after
+    __init__ are not reopened.
+    """
+
+    def __init__(
+        self,
+        mongo_connection_string=None,
+        database="kilt",
+        collection="knowledgesource",
+        title_index_directory=None,
+        page_cache_bytes=None,
+        bulk_query_size=BULK_QUERY_SIZE,
+        url_index_directory=None,
+        paragraph_store_directory=None,
+        anchor_graph_directory=None,
+        category_index_directory=None,
+        page_filter_directory=None,
+        max_pool_size=None,
+        connect_timeout_ms=None,
+        socket_timeout_ms=None,
+        server_selection_timeout_ms=None,
+        read_preference=None,
+    ):
+        # everything needed to rebuild the object in another process
+        self._spec = dict(
+            mongo_connection_string=mongo_connection_string,
+            database=database,
+            collection=collection,
+            title_index_directory=title_index_directory,
+            page_cache_bytes=page_cache_bytes,
+            bulk_query_size=bulk_query_size,
+            url_index_directory=url_index_directory,
+            paragraph_store_directory=paragraph_store_directory,
+            anchor_graph_directory=anchor_graph_directory,
+            category_index_directory=category_index_directory,
+            page_filter_directory=page_filter_directory,
+            max_pool_size=max_pool_size,
+            connect_timeout_ms=connect_timeout_ms,
+            socket_timeout_ms=socket_timeout_ms,
+            server_selection_timeout_ms=server_selection_timeout_ms,
+            read_preference=read_preference,
+        )
+        if not mongo_connection_string:
+            mongo_connection_string = DEFAULT_MONGO_CONNECTION_STRING
+        self.mongo_connection_string = mongo_connection_string
+        self.database = database
+        self.collection = collection
+        self.client_options = {
+            key: value
+            for key, value in [
+                ("maxPoolSize", max_pool_size),
+                ("connectTimeoutMS", connect_timeout_ms),
+                ("socketTimeoutMS", socket_timeout_ms),
+                ("serverSelectionTimeoutMS", server_selection_timeout_ms),
+                ("readPreference", read_preference),
+            ]
+            if value is not None
+        }
+        self._client = None
+        self._pid = None
+        self._client_lock = threading.Lock()
+        _client_locks.add(self)
+
+        self.bulk_query_size = bulk_query_size
+        if title_index_directory:
+            self.title_index = TitleIndex(title_index_directory)
+        if url_index_directory:
+            self.url_index = UrlIndex(url_index_directory)
+        if paragraph_store_directory:
+            self.open_paragraph_store(paragraph_store_directory)
+        if anchor_graph_directory:
+            self.open_anchor_graph(anchor_graph_directory)
+        if category_index_directory:
+            self.open_category_index(category_index_directory)
+        if page_filter_directory:
+            self.open_page_filter(page_filter_directory)
+        if page_cache_bytes:
+            self.enable_page_cache(page_cache_bytes)
+
+    def __getstate__(self):
+        spec = dict(self._spec)
+        if self.page_cache is not None:
+            spec["page_cache_bytes"] = self.page_cache.max_bytes
+        slow_threshold = None
+        if self.lookup_stats is not None:
+            slow_threshold = self.lookup_stats.slow_threshold
+        return {
+            "spec": spec,
+            "lookup_stats": self.lookup_stats is not None,
+            "slow_threshold": slow_threshold,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state["spec"])
+        if state["lookup_stats"]:
+            self.enable_lookup_stats(state["slow_threshold"])
+
+    @property
+    def client(self):
+        """The MongoClient of the current process, created on first use."""
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._client_lock:
+                if self._client is None or self._pid != pid:
+                    # a client inherited from the parent process is dropped,
+                    # not closed, as its sockets are shared with the parent
+                    self._client = MongoClient(
+                        self.mongo_connection_string,
+                        connect=False,
+                        **self.client_options
+                    )
+                    self._pid = pid
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.database][self.collection]
+
+    def close(self):
+        self._close_indexes()
+        if self._client is not None and self._pid == os.getpid():
+            self._client.close()
+        self._client = None
+
+    def get_all_pages_cursor(self):
+        cursor = self.db.find({})
+        return cursor
+
+    def get_num_pages(self):
+        return self.db.estimated_document_count()
+
+    def _id_boundary(self, position):
+        cursor = self.db.find({}, {"_id": 1}).sort("_id", 1).skip(position).limit(1)
+        for page in cursor:
+            return page["_id"]
+        return None
+
+    def iter_partition(self, partition, num_partitions):
+        # each partition is a contiguous range of _id, bounded by the _id
+        # found at its start position in the _id index
+        if num_partitions <= 0 or partition < 0 or partition >= num_partitions:
+            raise ValueError(
+                "invalid partition {}/{}".format(partition, num_partitions)
+            )
+        num_pages = self.get_num_pages()
+        query = {}
+        if partition > 0:
+            lower = self._id_boundary(num_pages * partition // num_partitions)
+            if lower is None:
+                return
+            query["$gte"] = lower
+        if partition < num_partitions - 1:
+            upper = self._id_boundary(num_pages * (partition + 1) // num_partitions)
+            if upper is not None:
+                query["$lt"] = upper
+        for page in self.db.find({"_id": query} if query else {}):
+            yield page
+
+    @staticmethod
+    def _text_slice(paragraphs):
+        """
+        Returns the $slice of the paragraph range, [] if the range is empty
+        and None if it depends on the number of paragraphs of the page.
+        """
+        start, end = paragraphs
+        if start is None:
+            start = 0
+        if start >= 0:
+            if end is None:
+                return [start, MAX_SLICE]
+            if end >= 0:
+                # $slice needs a positive count
+                return [start, end - start] if end > start else []
+        elif end is None:
+            return start
+        return None
+
+    def _projection(self, fields, paragraphs):
+        if fields is None and paragraphs is None:
+            return None
+        projection = {}
+        if fields is not None:
+            projection = {field: 1 for field in fields}
+        if paragraphs is not None and (fields is None or "text" in fields):
+            text_slice = self._text_slice(paragraphs)
+            if text_slice == []:
+                # the text is not fetched and set to [] by _slice_text
+                if fields is None:
+                    projection["text"] = 0
+                else:
+                    del projection["text"]
+                    # an empty projection would return every field
+                    projection.setdefault("_id", 1)
+            elif text_slice is not None:
+                projection["text"] = {"$slice": text_slice}
+        return projection or None
+
+    def _slice_text(self, page, fields, paragraphs):
+        # the ranges that $slice cannot express are sliced as the other
+        # backends do, on the whole text
+        if page is None or paragraphs is None:
+            return page
+        if fields is None or "text" in fields:
+            text_slice = self._text_slice(paragraphs)
+            if text_slice == []:
+                page["text"] = []
+            elif text_slice is None and "text" in page:
+                page["text"] = page["text"][slice(*paragraphs)]
+        return page
+
+    def _fetch_page_by_id(self, wikipedia_id, fields=None, paragraphs=None):
+        page = self.db.find_one(
+            {"_id": str(wikipedia_id)}, self._projection(fields, paragraphs)
+        )
+        return self._slice_text(page, fields, paragraphs)
+
+    def _fetch_page_by_title(self, wikipedia_title, fields=None, paragraphs=None):
+        page = self.db.find_one(
+            {"wikipedia_title": str(wikipedia_title)},
+            self._projection(fields, paragraphs),
+        )
+        return self._slice_text(page, fields, paragraphs)
+
+    def _find_in(self, field, keys, fields=None):
+        projection = None
+        if fields is not None:
+            # the key field is needed to match the pages to the keys
+            projection = {name: 1 for name in list(fields) + [field]}
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for i in range(0, len(unique_keys), self.bulk_query_size):
+            batch = unique_keys[i : i + self.bulk_query_size]
+            for page in self.db.find({field: {"$in": batch}}, projection):
+                # keep the first match, as find_one does
+                found.setdefault(page[field], page)
+        pages = [found.get(key) for key in keys]
+        if fields is not None and field != "_id" and field not in fields:
+            for page in found.values():
+                del page[field]
+        return pages
+
+    def _fetch_pages_by_ids(self, wikipedia_ids, fields=None):
+        keys = [str(wikipedia_id) for wikipedia_id in wikipedia_ids]
+        return self._find_in("_id", keys, fields)
+
+    def _fetch_pages_by_titles(self, wikipedia_titles, fields=None):
+        keys = [str(title) for title in wikipedia_titles]
+        return self._find_in("wikipedia_title", keys, fields)
+
+
+class FileKnowledgeSource(BaseKnowledgeSource):
+    """
+    Serves pages straight from the jsonl knowledge source (e.g.
+    kilt_knowledgesource.json) by memory-mapping it, without MongoDB.
+    A sidecar offset index is built next to the file on first use.
+    """
+
+    def __init__(
+        self, ks_file, index_directory=None, build_index=True, page_cache_bytes=None
+    ):
+        if index_directory is None:
+            index_directory = default_index_directory(ks_file)
+        if not is_valid_index(ks_file, index_directory):
+            if not build_index:
+                raise ValueError(
+                    "missing or stale index {} for {}".format(index_directory, ks_file)
+                )
+            build_offset_index(ks_file, index_directory)
+
+        self.ks_file = ks_file
+        self.index_directory = index_directory
+        self.client = None
+        self.index = OffsetIndex(index_directory)
+        self._file = open(ks_file, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        title_index_directory = os.path.join(index_directory, TITLE_INDEX_DIRECTORY)
+        if not is_title_index(title_index_directory) and build_index:
+            build_title_index(self.get_all_pages_cursor(), title_index_directory)
+        if is_title_index(title_index_directory):
+            self.title_index = TitleIndex(title_index_directory)
+
+        url_index_directory = os.path.join(index_directory, URL_INDEX_DIRECTORY)
+        if is_url_index(url_index_directory):
+            self.url_index = UrlIndex(url_index_directory)
+
+        paragraph_store_directory = os.path.join(
+            index_directory, PARAGRAPH_STORE_DIRECTORY
+        )
+        if is_paragraph_store(paragraph_store_directory):
+            self.open_paragraph_store(paragraph_store_directory)
+
+        anchor_graph_directory = os.path.join(index_directory, ANCHOR_GRAPH_DIRECTORY)
+        if is_anchor_graph(anchor_graph_directory):
+            self.open_anchor_graph(anchor_graph_directory)
+
+        category_index_directory = os.path.join(
+            index_directory, CATEGORY_INDEX_DIRECTORY
+        )
+        if is_category_index(category_index_directory):
+            self.open_category_index(category_index_directory)
+
+        page_filter_directory = os.path.join(index_directory, PAGE_FILTER_DIRECTORY)
+        if is_page_filter(page_filter_directory):
+            self.open_page_filter(page_filter_directory)
+
+        if page_cache_bytes:
+            self.enable_page_cache(page_cache_bytes)
+
+    def _read_page(self, offset, length):
+        return json.loads(self._mmap[offset : offset + length])
+
+    def _read_fields(self, record, fields, paragraphs):
+        if fields is None or any(field not in INDEXED_FIELDS for field in fields):
+            page = self._read_page(*self.index.location(record))
+            return project_page(page, fields, paragraphs)
+
+        # decode only the requested values (and paragraphs) of the record
+        page = {}
+        for field in ["_id"] + [field for field in fields if field != "_id"]:
+            if field == "text" and paragraphs is not None:
+                num_paragraphs = self.index.num_paragraphs(record)
+                page["text"] = [
+                    self._read_page(*self.index.paragraph_span(record, paragraph_id))
+                    for paragraph_id in range(num_paragraphs)[slice(*paragraphs)]
+                ]
+            else:
+                span = self.index.field_span(record, field)
+                if span is not None:
+                    page[field] = self._read_page(*span)
+        return page
+
+    def get_all_pages_cursor(self):
+        for _, _, line in iter_records(self.ks_file):
+            yield json.loads(line)
+
+    def get_num_pages(self):
+        return len(self.index)
+
+    def iter_partition(self, partition, num_partitions):
+        # byte ranges of about the same size, aligned to record boundaries
+        start, end = self.index.partition_range(partition, num_partitions)
+        for _, _, line in iter_records(self.ks_file, start, end):
+            yield json.loads(line)
+
+    def _fetch_page_by_id(self, wikipedia_id, fields=None, paragraphs=None):
+        record = self.index.record_number(wikipedia_id)
+        if record < 0:
+            return None
+        if fields is None and paragraphs is None:
+            return self._read_page(*self.index.location(record))
+        return self._read_fields(record, fields, paragraphs)
+
+    def _fetch_page_by_title(self, wikipedia_title, fields=None, paragraphs=None):
+        wikipedia_id = self.index.lookup_title(wikipedia_title)
+        if wikipedia_id is None:
+            return None
+        return self._fetch_page_by_id(wikipedia_id, fields, paragraphs)
+
+    def _fetch_pages_by_ids(self, wikipedia_ids, fields=None):
+        if fields is not None:
+            # only the requested fields are decoded, page by page
+            return [
+                (
+                    None
+                    if wikipedia_id is None
+                    else self._fetch_page_by_id(wikipedia_id, fields)
+                )
+                for wikipedia_id in wikipedia_ids
+            ]
+        locations = [self.index.lookup(wikipedia_id) for wikipedia_id in wikipedia_ids]
+
+        # read in file order so that a large batch is a single forward scan
+        pages = [None] * len(locations)
+        order = sorted(
+            (i for i, location in enumerate(locations) if location is not None),
+            key=lambda i: locations[i][0],
+        )
+        for i in order:
+            pages[i] = self._read_page(*locations[i])
+        return pages
+
+    def _fetch_pages_by_titles(self, wikipedia_titles, fields=None):
+        return self._fetch_pages_by_ids(
+            [self.index.lookup_title(title) for title in wikipedia_titles], fields
+        )
+
+    def close(self):
+        self.index.close()
+        self._close_indexes()
+        self._mmap.close()
+        self._file.close()
+
+
+class BlockKnowledgeSource(BaseKnowledgeSource):
+    """
+    Reads the knowledge source from the zstd-compressed block store written
+    by kilt.ks.block_store.export_block_store (see
+    scripts/export_ks_block_store.py): a lookup decompresses only the block
+    of about 64 pages containing the page.
+    """
+
+    def __init__(self, directory, page_cache_bytes=None, cached_blocks=16):
+        self.directory = directory
+        self.client = None
+        self.store = BlockStore(directory, cached_blocks=cached_blocks)
+
+        title_index_directory = os.path.join(directory, TITLE_INDEX_DIRECTORY)
+        if is_title_index(title_index_directory):
+            self.title_index = TitleIndex(title_index_directory)
+        url_index_directory = os.path.join(directory, URL_INDEX_DIRECTORY)
+        if is_url_index(url_index_directory):
+            self.url_index = UrlIndex(url_index_directory)
+        paragraph_store_directory = os.path.join(directory, PARAGRAPH_STORE_DIRECTORY)
+        if is_paragraph_store(paragraph_store_directory):
+            self.open_paragraph_store(paragraph_store_directory)
+        anchor_graph_directory = os.path.join(directory, ANCHOR_GRAPH_DIRECTORY)
+        if is_anchor_graph(anchor_graph_directory):
+            self.open_anchor_graph(anchor_graph_directory)
+        category_index_directory = os.path.join(directory, CATEGORY_INDEX_DIRECTORY)
+        if is_category_index(category_index_directory):
+            self.open_category_index(category_index_directory)
+        page_filter_directory = os.path.join(directory, PAGE_FILTER_DIRECTORY)
+        if is_page_filter(page_filter_directory):
+            self.open_page_filter(page_filter_directory)
+
+        if page_cache_bytes:
+            self.enable_page_cache(page_cache_bytes)
+
+    def get_all_pages_cursor(self):
+        return self.store.iter_blocks()
+
+    def get_num_pages(self):
+        return len(self.store)
+
+    def iter_partition(self, partition, num_partitions):
+        if num_partitions <= 0 or partition < 0 or partition >= num_partitions:
+            raise ValueError(
+                "invalid partition {}/{}".format(partition, num_partitions)
+            )
+        num_blocks = self.store.num_blocks()
+        return self.store.iter_blocks(
+            num_blocks * partition // num_partitions,
+            num_blocks * (partition + 1) // num_partitions,
+        )
+
+    def _fetch_page_by_id(self, wikipedia_id, fields=None, paragraphs=None):
+        return project_page(self.store.get_page(wikipedia_id), fields, paragraphs)
+
+    def _fetch_page_by_title(self, wikipedia_title, fields=None, paragraphs=None):
+        wikipedia_id = self.store.lookup_title(wikipedia_title)
+        if wikipedia_id is None:
+            return None
+        return self._fetch_page_by_id(wikipedia_id, fields, paragraphs)
+
+    def _fetch_pages_by_ids(self, wikipedia_ids, fields=None):
+        slots = [self.store.slot(wikipedia_id) for wikipedia_id in wikipedia_ids]
+
+        # read in store order so that each block is decompressed once
+        pages = [None] * len(slots)
+        order = sorted(
+            (i for i, slot in enumerate(slots) if slot >= 0), key=lambda i: slots[i]
+        )
+        for i in order:
+            pages[i] = project_page(self.store.read_slot(slots[i]), fields)
+        return pages
+
+    def _fetch_pages_by_titles(self, wikipedia_titles, fields=None):
+        return self._fetch_pages_by_ids(
+            [self.store.lookup_title(title) for title in wikipedia_titles], fields
+        )
+
+    def close(self):
+        self.store.close()
+        self._close_indexes()
+
+
+class AsyncKnowledgeSource:
+    """
+    asyncio front-end for a (blocking) knowledge source.
+    At most max_in_flight backend calls run at the same time, on a dedicated
+    thread pool. Concurrent get_page_by_id / get_page_by_title calls are
+    coalesced into get_pages_by_ids / get_pages_by_titles batches of up to
+    batch_size keys, so thousands of awaited lookups turn into a few bulk
+    queries while the event loop keeps doing CPU work.
+    """
+
+    def __init__(self, ks=None, max_in_flight=16, batch_size=BULK_QUERY_SIZE):
+        self.ks = ks if ks is not None else KnowledgeSource()
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._semaphore = None
+        self._semaphore_loop = None
+        self._pending = {"id": [], "title": []}
+        self._scheduled = {"id": False, "title": False}
+        # the loop only keeps weak references to its tasks
+        self._tasks = set()
+
+    def _get_semaphore(self, loop):
+        # before python 3.10 a semaphore is bound to the loop it is created
+        # on, so a new one is needed e.g. for each asyncio.run
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        async with self._get_semaphore(loop):
+            return await loop.run_in_executor(
+                self._executor, functools.partial(fn, *args, **kwargs)
+            )
+
+    async def _batched(self, kind, key):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[kind].append((key, future))
+        if not self._scheduled[kind]:
+            # collect all the lookups issued in this iteration of the loop
+            self._scheduled[kind] = True
+            loop.call_soon(self._flush, kind)
+        return await future
+
+    def _flush(self, kind):
+        self._scheduled[kind] = False
+        pending, self._pending[kind] = self._pending[kind], []
+        for i in range(0, len(pending), self.batch_size):
+            task = asyncio.ensure_future(
+                self._run_batch(kind, pending[i : i + self.batch_size])
+            )
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, kind, batch):
+        if kind == "id":
+            fetch = self.ks.get_pages_by_ids
+        else:
+            fetch = self.ks.get_pages_by_titles
+        try:
+            pages = await self._run(fetch, [key for key, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), page in zip(batch, pages):
+            if not future.done():
+                future.set_result(page)
+
+    async def get_page_by_id(self, wikipedia_id, fields=None, paragraphs=None):
+        if fields is None and paragraphs is None:
+            return await self._batched("id", str(wikipedia_id))
+        return await self._run(
+            self.ks.get_page_by_id, wikipedia_id, fields=fields, paragraphs=paragraphs
+        )
+
+    async def get_page_by_title(self, wikipedia_title, fields=None, paragraphs=None):
+        if fields is None and paragraphs is None:
+            return await self._batched("title", str(wikipedia_title))
+        return await self._run(
+            self.ks.get_page_by_title,
+            wikipedia_title,
+            fields=fields,
+            paragraphs=paragraphs,
+        )
+
+    async def get_pages_by_ids(self, wikipedia_ids, fields=None):
+        return await self._run(self.ks.get_pages_by_ids, wikipedia_ids, fields=fields)
+
+    async def get_pages_by_titles(self, wikipedia_titles, fields=None):
+        return await self._run(
+            self.ks.get_pages_by_titles, wikipedia_titles, fields=fields
+        )
+
+    async def get_pages_by_title(self, wikipedia_title):
+        return await self._run(self.ks.get_pages_by_title, wikipedia_title)
+
+    async def get_page_from_url(self, url):
+        return await self._run(self.ks.get_page_from_url, url)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,276 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import bisect
+import json
+import os
+import sys
+from array import array
+from urllib.parse import unquote
+
+from kilt.ks.arrays import ArrayWriter, MappedArray, write_array
+from kilt.ks.offset_index import get_record_id
+from kilt.ks.title_index import get_alternate_titles, normalize_title
+
+META_FILE = "meta.json"
+IDS_FILE = "ids.q"
+RECORDS_FILE = "records.q"
+OUT_OFFSETS_FILE = "out_offsets.i"
+OUT_TARGETS_FILE = "out_targets.i"
+OUT_PARAGRAPHS_FILE = "out_paragraphs.i"
+IN_OFFSETS_FILE = "in_offsets.i"
+IN_SOURCES_FILE = "in_sources.i"
+IN_PARAGRAPHS_FILE = "in_paragraphs.i"
+# links in the order of the second scan, removed once sorted
+EDGE_SOURCES_FILE = "edge_sources.i.tmp"
+EDGE_TARGETS_FILE = "edge_targets.i.tmp"
+EDGE_PARAGRAPHS_FILE = "edge_paragraphs.i.tmp"
+
+MAX_EDGES = 2**31 - 1
+
+
+class TitleResolver:
+    """
+    Resolves anchor hrefs (url-quoted titles) to wikipedia_ids: exact title
+    first, then normalized current or alternate title.
+    """
+
+    def __init__(self):
+        self.exact = {}
+        self.normalized = {}
+
+    def add(self, page):
+        wikipedia_id = get_record_id(page)
+        self.exact.setdefault(page["wikipedia_title"], wikipedia_id)
+        for title in [page["wikipedia_title"]] + get_alternate_titles(page):
+            self.normalized.setdefault(normalize_title(title), wikipedia_id)
+
+    def resolve(self, href):
+        title = unquote(href).split("#")[0]
+        wikipedia_id = self.exact.get(title)
+        if wikipedia_id is None:
+            wikipedia_id = self.normalized.get(normalize_title(title))
+        return wikipedia_id
+
+
+def _write_csr(directory, counts, edges, offsets_file, nodes_file, paragraphs_file):
+    """
+    Counting sort of the (record, node, paragraph_id) edges by record, where
+    counts[record + 1] is the number of edges of the record.
+    """
+    for i in range(len(counts) - 1):
+        counts[i + 1] += counts[i]
+    write_array(os.path.join(directory, offsets_file), "i", counts)
+
+    num_edges = counts[-1]
+    nodes = array("i", bytes(4 * num_edges))
+    paragraphs = array("i", bytes(4 * num_edges))
+    for record, node, paragraph_id in edges:
+        position = counts[record]
+        nodes[position] = node
+        paragraphs[position] = paragraph_id
+        counts[record] += 1
+    write_array(os.path.join(directory, nodes_file), "i", nodes)
+    write_array(os.path.join(directory, paragraphs_file), "i", paragraphs)
+
+
+def build_anchor_graph(ks, directory, verbose=False):
+    """
+    Resolves the href of every anchor of the knowledge source ks to a
+    wikipedia_id and stores the link graph in CSR form: per record (in
+    the order of the first cursor) the targets and paragraph ids of its
+    outgoing links, and the sources and paragraph ids of its incoming links.
+    Reads ks.get_all_pages_cursor() twice, the two cursors do not need to
+    return the pages in the same order. Anchors to missing pages are
+    dropped.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    # pass 1: titles and records
+    resolver = TitleResolver()
+    ids = []
+    for n, page in enumerate(ks.get_all_pages_cursor()):
+        resolver.add(page)
+        ids.append((get_record_id(page), n))
+    ids.sort()
+    record_of = {wikipedia_id: n for wikipedia_id, n in ids}
+    num_records = len(ids)
+
+    # pass 2: links in the order of the second cursor, stored with the
+    # record of their source page (looked up by id) and sorted afterwards
+    edge_files = [
+        os.path.join(directory, filename)
+        for filename in [EDGE_SOURCES_FILE, EDGE_TARGETS_FILE, EDGE_PARAGRAPHS_FILE]
+    ]
+    edge_sources, edge_targets, edge_paragraphs = [
+        ArrayWriter(filename, "i") for filename in edge_files
+    ]
+    out_counts = array("q", [0]) * (num_records + 1)
+    in_counts = array("q", [0]) * (num_records + 1)
+    linked = bytearray(num_records)
+    unresolved = 0
+    for n, page in enumerate(ks.get_all_pages_cursor()):
+        if verbose and n % 100000 == 0:
+            sys.stdout.write("linked {} pages\r".format(n))
+            sys.stdout.flush()
+        source = record_of.get(get_record_id(page))
+        if source is None or linked[source]:
+            # added since the first pass or returned twice by the cursor
+            continue
+        linked[source] = 1
+        for anchor in page.get("anchors") or []:
+            target = resolver.resolve(anchor["href"])
+            if target is None:
+                unresolved += 1
+                continue
+            edge_sources.append(source)
+            edge_targets.append(target)
+            edge_paragraphs.append(anchor["paragraph_id"])
+            out_counts[source + 1] += 1
+            in_counts[record_of[target] + 1] += 1
+        if edge_targets.count > MAX_EDGES:
+            raise ValueError("too many links for int32 offsets")
+    num_edges = edge_targets.count
+    for x in [edge_sources, edge_targets, edge_paragraphs]:
+        x.close()
+    del resolver
+
+    # outgoing links: counting sort of the edges by source record
+    edges = [MappedArray(filename, "i") for filename in edge_files]
+    _write_csr(
+        directory,
+        out_counts,
+        zip(*edges),
+        OUT_OFFSETS_FILE,
+        OUT_TARGETS_FILE,
+        OUT_PARAGRAPHS_FILE,
+    )
+    for x in edges:
+        x.close()
+    for filename in edge_files:
+        os.remove(filename)
+
+    # incoming links: counting sort of the edges by target record
+    record_ids = array("q", [0]) * num_records
+    for wikipedia_id, n in ids:
+        record_ids[n] = wikipedia_id
+    offsets = MappedArray(os.path.join(directory, OUT_OFFSETS_FILE), "i")
+    targets = MappedArray(os.path.join(directory, OUT_TARGETS_FILE), "i")
+    paragraphs = MappedArray(os.path.join(directory, OUT_PARAGRAPHS_FILE), "i")
+    _write_csr(
+        directory,
+        in_counts,
+        (
+            (record_of[targets[edge]], record_ids[source], paragraphs[edge])
+            for source in range(num_records)
+            for edge in range(offsets[source], offsets[source + 1])
+        ),
+        IN_OFFSETS_FILE,
+        IN_SOURCES_FILE,
+        IN_PARAGRAPHS_FILE,
+    )
+    for x in [offsets, targets, paragraphs]:
+        x.close()
+
+    write_array(os.path.join(directory, IDS_FILE), "q", (x[0] for x in ids))
+    write_array(os.path.join(directory, RECORDS_FILE), "q", (x[1] for x in ids))
+
+    with open(os.path.join(directory, META_FILE), "w") as fout:
+        json.dump(
+            {
+                "num_pages": num_records,
+                "num_links": num_edges,
+                "unresolved": unresolved,
+            },
+            fout,
+        )
+
+    if verbose:
+        print(
+            "stored {} links between {} pages ({} unresolved anchors)".format(
+                num_edges, num_records, unresolved
+            )
+        )
+    return directory
+
+
+def is_anchor_graph(directory):
+    return os.path.isfile(os.path.join(directory, META_FILE))
+
+
+class AnchorGraph:
+    """Memory-mapped reader for the graph written by build_anchor_graph."""
+
+    def __init__(self, directory):
+        def mapped(filename, typecode):
+            return MappedArray(os.path.join(directory, filename), typecode)
+
+        self.ids = mapped(IDS_FILE, "q")
+        self.records = mapped(RECORDS_FILE, "q")
+        self.out_offsets = mapped(OUT_OFFSETS_FILE, "i")
+        self.out_targets = mapped(OUT_TARGETS_FILE, "i")
+        self.out_paragraphs = mapped(OUT_PARAGRAPHS_FILE, "i")
+        self.in_offsets = mapped(IN_OFFSETS_FILE, "i")
+        self.in_sources = mapped(IN_SOURCES_FILE, "i")
+        self.in_paragraphs = mapped(IN_PARAGRAPHS_FILE, "i")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def record_number(self, wikipedia_id):
+        try:
+            wikipedia_id = int(wikipedia_id)
+        except (TypeError, ValueError):
+            return -1
+        pos = bisect.bisect_left(self.ids, wikipedia_id)
+        if pos < len(self.ids) and self.ids[pos] == wikipedia_id:
+            return self.records[pos]
+        return -1
+
+    @staticmethod
+    def _links(offsets, nodes, paragraphs, record):
+        if record < 0:
+            return []
+        start = offsets[record]
+        end = offsets[record + 1]
+        return list(zip(nodes[start:end], paragraphs[start:end]))
+
+    def out_links(self, wikipedia_id):
+        """
+        Returns the (target wikipedia_id, paragraph_id) pairs of the anchors
+        of a page, in page order.
+        """
+        return self._links(
+            self.out_offsets,
+            self.out_targets,
+            self.out_paragraphs,
+            self.record_number(wikipedia_id),
+        )
+
+    def in_links(self, wikipedia_id):
+        """
+        Returns the (source wikipedia_id, paragraph_id) pairs of the anchors
+        pointing to a page, where paragraph_id is in the source page.
+        """
+        return self._links(
+            self.in_offsets,
+            self.in_sources,
+            self.in_paragraphs,
+            self.record_number(wikipedia_id),
+        )
+
+    def close(self):
+        for x in [
+            self.ids,
+            self.records,
+            self.out_offsets,
+            self.out_targets,
+            self.out_paragraphs,
+            self.in_offsets,
+            self.in_sources,
+            self.in_paragraphs,
+        ]:
+            x.close()
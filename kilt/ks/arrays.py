@@ -0,0 +1,148 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import array
+import mmap
+import os
+
+
+def write_array(filename, typecode, values):
+    """
+    Stores values as a flat native-endian array of the given typecode
+    (e.g. "q" for int64, "i" for int32) that can be memory-mapped back.
+    """
+    data = array.array(typecode, values)
+    with open(filename, "wb") as fout:
+        data.tofile(fout)
+    return len(data)
+
+
+def write_sorted_pairs(keys_filename, values_filename, keys, values):
+    """
+    Stores the (key, value) pairs given as two parallel arrays sorted by key
+    (ties keep their order) as two flat int64 arrays.
+    """
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    write_array(keys_filename, "q", (keys[i] for i in order))
+    write_array(values_filename, "q", (values[i] for i in order))
+    return len(order)
+
+
+class ArrayWriter:
+    """Streams values to a flat array file readable with MappedArray."""
+
+    def __init__(self, filename, typecode, buffer_size=1 << 16):
+        self._file = open(filename, "wb")
+        self._buffer = array.array(typecode)
+        self._buffer_size = buffer_size
+        self.count = 0
+
+    def append(self, value):
+        self._buffer.append(value)
+        self.count += 1
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def flush(self):
+        self._buffer.tofile(self._file)
+        del self._buffer[:]
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class MappedFile:
+    """
+    Read-only memory map of a file. Empty files are supported (mmap does not
+    allow a zero-length mapping) and behave as an empty buffer.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.buffer = b""
+        self._views = []
+
+    def view(self, typecode):
+        """Returns a zero-copy memoryview of the file cast to typecode."""
+        view = memoryview(self.buffer).cast("B").cast(typecode)
+        self._views.append(view)
+        return view
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views = []
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self._file.close()
+
+
+class MappedArray:
+    """Memory-mapped array written by write_array."""
+
+    def __init__(self, filename, typecode):
+        self._mapped = MappedFile(filename)
+        self._view = self._mapped.view(typecode)
+
+    def __len__(self):
+        return len(self._view)
+
+    def __getitem__(self, idx):
+        return self._view[idx]
+
+    def close(self):
+        self._mapped.close()
+
+
+def write_string_table(prefix, strings):
+    """
+    Stores a list of strings as a utf-8 blob ({prefix}.bin) and an int64
+    offsets array ({prefix}.off) with len(strings) + 1 entries.
+    """
+    offsets = [0]
+    with open(prefix + ".bin", "wb") as fout:
+        for s in strings:
+            encoded = s.encode("utf-8")
+            fout.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    write_array(prefix + ".off", "q", offsets)
+    return len(offsets) - 1
+
+
+class StringTable:
+    """
+    Memory-mapped table written by write_string_table. Items are returned as
+    utf-8 bytes, so a table stored in sorted byte order can be searched with
+    bisect.
+    """
+
+    def __init__(self, prefix):
+        self._blob = MappedFile(prefix + ".bin")
+        self._offsets = MappedArray(prefix + ".off", "q")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if idx < 0 or idx >= len(self):
+            raise IndexError(idx)
+        return self._blob.buffer[self._offsets[idx] : self._offsets[idx + 1]]
+
+    def get_string(self, idx):
+        return self[idx].decode("utf-8")
+
+    def close(self):
+        self._blob.close()
+        self._offsets.close()
@@ -0,0 +1,248 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import bisect
+import json
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+import zstandard
+
+from kilt.ks.arrays import (
+    ArrayWriter,
+    MappedArray,
+    MappedFile,
+    StringTable,
+    write_array,
+    write_sorted_pairs,
+    write_string_table,
+)
+from kilt.ks.bloom_filter import PageFilterWriter
+from kilt.ks.offset_index import (
+    PAGE_FILTER_DIRECTORY,
+    TITLE_INDEX_DIRECTORY,
+    URL_INDEX_DIRECTORY,
+    get_record_id,
+)
+from kilt.ks.title_index import TitleIndexWriter
+from kilt.ks.url_index import UrlIndexWriter
+
+META_FILE = "meta.json"
+BLOCKS_FILE = "blocks.zst"
+BLOCK_OFFSETS_FILE = "block_offsets.q"
+IDS_FILE = "ids.q"
+ID_SLOTS_FILE = "id_slots.q"
+TITLES_PREFIX = "titles"
+TITLE_IDS_FILE = "title_ids.q"
+
+PAGES_PER_BLOCK = 64
+COMPRESSION_LEVEL = 9
+
+
+def export_block_store(
+    pages,
+    directory,
+    pages_per_block=PAGES_PER_BLOCK,
+    compression_level=COMPRESSION_LEVEL,
+    verbose=False,
+):
+    """
+    Writes the knowledge source as independent zstd frames of
+    pages_per_block jsonl records each, plus a wikipedia_id -> page number
+    index, a sorted title table, the title and url indexes and the page
+    filter, so that a page can be read by decompressing a single block.
+    """
+    os.makedirs(directory, exist_ok=True)
+    compressor = zstandard.ZstdCompressor(level=compression_level)
+
+    block_offsets = ArrayWriter(os.path.join(directory, BLOCK_OFFSETS_FILE), "q")
+    title_index_directory = os.path.join(directory, TITLE_INDEX_DIRECTORY)
+    title_index = TitleIndexWriter(title_index_directory)
+    url_index = UrlIndexWriter(
+        os.path.join(directory, URL_INDEX_DIRECTORY), title_index_directory
+    )
+    page_filter = PageFilterWriter(os.path.join(directory, PAGE_FILTER_DIRECTORY))
+    ids = array("q")
+    titles = []
+    buffer = []
+    offset = 0
+
+    with open(os.path.join(directory, BLOCKS_FILE), "wb") as fout:
+
+        def flush():
+            data = compressor.compress(b"".join(buffer))
+            block_offsets.append(offset)
+            fout.write(data)
+            del buffer[:]
+            return len(data)
+
+        for n, page in enumerate(pages):
+            if verbose and n % 100000 == 0:
+                sys.stdout.write("exported {} pages\r".format(n))
+                sys.stdout.flush()
+            wikipedia_id = get_record_id(page)
+            ids.append(wikipedia_id)
+            titles.append((page["wikipedia_title"].encode("utf-8"), wikipedia_id))
+            title_index.add(page)
+            url_index.add(page)
+            page_filter.add(page)
+            buffer.append(json.dumps(page, ensure_ascii=False).encode("utf-8") + b"\n")
+            if len(buffer) == pages_per_block:
+                offset += flush()
+        if buffer:
+            offset += flush()
+
+    block_offsets.append(offset)
+    block_offsets.close()
+
+    # slots are global page numbers: block = slot // pages_per_block
+    write_sorted_pairs(
+        os.path.join(directory, IDS_FILE),
+        os.path.join(directory, ID_SLOTS_FILE),
+        ids,
+        range(len(ids)),
+    )
+
+    titles.sort()
+    write_string_table(
+        os.path.join(directory, TITLES_PREFIX), (x[0].decode("utf-8") for x in titles)
+    )
+    write_array(os.path.join(directory, TITLE_IDS_FILE), "q", (x[1] for x in titles))
+
+    with open(os.path.join(directory, META_FILE), "w") as fout:
+        json.dump(
+            {
+                "num_pages": len(ids),
+                "pages_per_block": pages_per_block,
+                "compressed_bytes": offset,
+            },
+            fout,
+        )
+
+    title_index.close()
+    url_index.close()
+    page_filter.close()
+
+    if verbose:
+        print("exported {} pages in {} bytes".format(len(ids), offset))
+    return directory
+
+
+def is_block_store(directory):
+    return os.path.isfile(os.path.join(directory, META_FILE))
+
+
+class BlockStore:
+    """
+    Random access reader for the store written by export_block_store.
+    The most recently used decompressed blocks are kept in memory.
+    """
+
+    def __init__(self, directory, cached_blocks=16):
+        with open(os.path.join(directory, META_FILE), "r") as fin:
+            meta = json.load(fin)
+        self.num_pages = meta["num_pages"]
+        self.pages_per_block = meta["pages_per_block"]
+        self.blocks = MappedFile(os.path.join(directory, BLOCKS_FILE))
+        self.block_offsets = MappedArray(
+            os.path.join(directory, BLOCK_OFFSETS_FILE), "q"
+        )
+        self.ids = MappedArray(os.path.join(directory, IDS_FILE), "q")
+        self.id_slots = MappedArray(os.path.join(directory, ID_SLOTS_FILE), "q")
+        self.titles = StringTable(os.path.join(directory, TITLES_PREFIX))
+        self.title_ids = MappedArray(os.path.join(directory, TITLE_IDS_FILE), "q")
+
+        self.cached_blocks = cached_blocks
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __len__(self):
+        return self.num_pages
+
+    def num_blocks(self):
+        return len(self.block_offsets) - 1
+
+    def _decompressor(self):
+        # zstd decompression contexts are not thread-safe
+        if not hasattr(self._local, "decompressor"):
+            self._local.decompressor = zstandard.ZstdDecompressor()
+        return self._local.decompressor
+
+    def read_block(self, block):
+        """Returns the list of the raw jsonl records of a block."""
+        with self._lock:
+            lines = self._cache.get(block)
+            if lines is not None:
+                self._cache.move_to_end(block)
+                return lines
+        start = self.block_offsets[block]
+        end = self.block_offsets[block + 1]
+        data = self._decompressor().decompress(self.blocks.buffer[start:end])
+        lines = data.splitlines()
+        with self._lock:
+            self._cache[block] = lines
+            while len(self._cache) > self.cached_blocks:
+                self._cache.popitem(last=False)
+        return lines
+
+    def slot(self, wikipedia_id):
+        """Returns the global position of the page in the store or -1."""
+        try:
+            wikipedia_id = int(wikipedia_id)
+        except (TypeError, ValueError):
+            return -1
+        pos = bisect.bisect_left(self.ids, wikipedia_id)
+        if pos < len(self.ids) and self.ids[pos] == wikipedia_id:
+            return self.id_slots[pos]
+        return -1
+
+    def read_slot(self, slot):
+        lines = self.read_block(slot // self.pages_per_block)
+        return json.loads(lines[slot % self.pages_per_block])
+
+    def get_page(self, wikipedia_id):
+        slot = self.slot(wikipedia_id)
+        if slot < 0:
+            return None
+        return self.read_slot(slot)
+
+    def lookup_title(self, wikipedia_title):
+        """Returns the wikipedia_id for an exact title or None."""
+        key = str(wikipedia_title).encode("utf-8")
+        pos = bisect.bisect_left(self.titles, key)
+        if pos < len(self.titles) and self.titles[pos] == key:
+            return self.title_ids[pos]
+        return None
+
+    def iter_blocks(self, start=0, end=None):
+        """Yields the decoded pages of the blocks in [start, end)."""
+        if end is None:
+            end = self.num_blocks()
+        decompressor = zstandard.ZstdDecompressor()
+        for block in range(start, end):
+            data = decompressor.decompress(
+                self.blocks.buffer[
+                    self.block_offsets[block] : self.block_offsets[block + 1]
+                ]
+            )
+            for line in data.splitlines():
+                yield json.loads(line)
+
+    def close(self):
+        self._cache.clear()
+        for x in [
+            self.blocks,
+            self.block_offsets,
+            self.ids,
+            self.id_slots,
+            self.titles,
+            self.title_ids,
+        ]:
+            x.close()
@@ -0,0 +1,141 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import json
+import math
+import os
+from array import array
+
+from kilt.ks.offset_index import get_record_id
+from kilt.ks.title_index import get_alternate_titles, normalize_title
+
+META_FILE = "meta.json"
+BITS_FILE = "bits.bin"
+
+ERROR_RATE = 0.01
+
+
+def _hashes(key):
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+
+
+def _title_key(title):
+    return "t" + normalize_title(title)
+
+
+def _id_key(wikipedia_id):
+    return "i{}".format(int(wikipedia_id))
+
+
+class PageFilterWriter:
+    """
+    Hashes the ids and titles of the pages one at a time (only wikipedia_id,
+    wikipedia_title and history are read) and writes the Bloom filter of
+    build_page_filter, sized for the number of keys, on close.
+    """
+
+    def __init__(self, directory, error_rate=ERROR_RATE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.error_rate = error_rate
+        self._first = array("Q")
+        self._second = array("Q")
+
+    def add(self, page):
+        keys = [_id_key(get_record_id(page))]
+        for title in [page["wikipedia_title"]] + get_alternate_titles(page):
+            keys.append(_title_key(title))
+        for key in keys:
+            h1, h2 = _hashes(key)
+            self._first.append(h1)
+            self._second.append(h2)
+
+    def close(self):
+        first = self._first
+        second = self._second
+        error_rate = self.error_rate
+
+        num_keys = max(1, len(first))
+        num_bits = int(math.ceil(-num_keys * math.log(error_rate) / math.log(2) ** 2))
+        num_bits = max(8, (num_bits + 7) // 8 * 8)
+        num_hashes = max(1, int(round(num_bits / num_keys * math.log(2))))
+
+        bits = bytearray(num_bits // 8)
+        for h1, h2 in zip(first, second):
+            for i in range(num_hashes):
+                position = (h1 + i * h2) % num_bits
+                bits[position >> 3] |= 1 << (position & 7)
+
+        with open(os.path.join(self.directory, BITS_FILE), "wb") as fout:
+            fout.write(bits)
+        with open(os.path.join(self.directory, META_FILE), "w") as fout:
+            json.dump(
+                {
+                    "num_keys": len(first),
+                    "num_bits": num_bits,
+                    "num_hashes": num_hashes,
+                    "error_rate": error_rate,
+                },
+                fout,
+            )
+        self._first = array("Q")
+        self._second = array("Q")
+
+
+def build_page_filter(pages, directory, error_rate=ERROR_RATE):
+    """
+    Builds a Bloom filter over the normalized (current and alternate) titles
+    and the ids of the pages, sized for the given false positive rate.
+    pages is an iterable of knowledge source records (only wikipedia_id,
+    wikipedia_title and history are used).
+    """
+    writer = PageFilterWriter(directory, error_rate)
+    for page in pages:
+        writer.add(page)
+    writer.close()
+    return directory
+
+
+def is_page_filter(directory):
+    return os.path.isfile(os.path.join(directory, META_FILE))
+
+
+class PageFilter:
+    """
+    In-memory reader for the filter written by build_page_filter: a False
+    answer means the page is certainly not in the knowledge source.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, META_FILE), "r") as fin:
+            meta = json.load(fin)
+        self.num_bits = meta["num_bits"]
+        self.num_hashes = meta["num_hashes"]
+        with open(os.path.join(directory, BITS_FILE), "rb") as fin:
+            self.bits = fin.read()
+
+    def _contains(self, key):
+        h1, h2 = _hashes(key)
+        for i in range(self.num_hashes):
+            position = (h1 + i * h2) % self.num_bits
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def might_contain_title(self, wikipedia_title):
+        return self._contains(_title_key(wikipedia_title))
+
+    def might_contain_id(self, wikipedia_id):
+        try:
+            key = _id_key(wikipedia_id)
+        except (TypeError, ValueError):
+            return False
+        return self._contains(key)
+
+    def close(self):
+        self.bits = b""
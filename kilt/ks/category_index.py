@@ -0,0 +1,160 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import bisect
+import json
+import os
+import sys
+
+from kilt.ks.arrays import MappedArray, StringTable, write_array, write_string_table
+from kilt.ks.offset_index import get_record_id
+
+META_FILE = "meta.json"
+CATEGORIES_PREFIX = "categories"
+POSTINGS_OFFSETS_FILE = "postings_offsets.q"
+POSTINGS_FILE = "postings.q"
+QIDS_FILE = "qids.q"
+QID_IDS_FILE = "qid_ids.q"
+IDS_FILE = "ids.q"
+ID_QIDS_FILE = "id_qids.q"
+
+
+def get_categories(page):
+    """Returns the list of categories of a page (stored comma-separated)."""
+    categories = page.get("categories") or ""
+    return [x.strip() for x in categories.split(",") if x.strip()]
+
+
+def get_qid(page):
+    """Returns the wikidata id of a page as an int (Q42 -> 42) or None."""
+    wikidata_info = page.get("wikidata_info") or {}
+    return parse_qid(wikidata_info.get("wikidata_id"))
+
+
+def parse_qid(qid):
+    try:
+        return int(str(qid).strip().upper().lstrip("Q"))
+    except ValueError:
+        return None
+
+
+def build_category_index(pages, directory, verbose=False):
+    """
+    Builds the category -> wikipedia_ids posting lists (categories sorted,
+    ids sorted in each list) and the sorted qid <-> wikipedia_id tables.
+    pages is an iterable of knowledge source records (only wikipedia_id,
+    categories and wikidata_info are used).
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    postings = {}
+    qids = []
+    for n, page in enumerate(pages):
+        if verbose and n % 100000 == 0:
+            sys.stdout.write("indexed {} pages\r".format(n))
+            sys.stdout.flush()
+        wikipedia_id = get_record_id(page)
+        for category in get_categories(page):
+            postings.setdefault(category.encode("utf-8"), []).append(wikipedia_id)
+        qid = get_qid(page)
+        if qid is not None:
+            qids.append((qid, wikipedia_id))
+
+    categories = sorted(postings.keys())
+    offsets = [0]
+    for category in categories:
+        offsets.append(offsets[-1] + len(set(postings[category])))
+    write_string_table(
+        os.path.join(directory, CATEGORIES_PREFIX),
+        (x.decode("utf-8") for x in categories),
+    )
+    write_array(os.path.join(directory, POSTINGS_OFFSETS_FILE), "q", offsets)
+    write_array(
+        os.path.join(directory, POSTINGS_FILE),
+        "q",
+        (x for category in categories for x in sorted(set(postings[category]))),
+    )
+
+    qids.sort()
+    write_array(os.path.join(directory, QIDS_FILE), "q", (x[0] for x in qids))
+    write_array(os.path.join(directory, QID_IDS_FILE), "q", (x[1] for x in qids))
+    ids = sorted((wikipedia_id, qid) for qid, wikipedia_id in qids)
+    write_array(os.path.join(directory, IDS_FILE), "q", (x[0] for x in ids))
+    write_array(os.path.join(directory, ID_QIDS_FILE), "q", (x[1] for x in ids))
+
+    with open(os.path.join(directory, META_FILE), "w") as fout:
+        json.dump({"num_categories": len(categories), "num_qids": len(qids)}, fout)
+
+    if verbose:
+        print(
+            "indexed {} categories and {} wikidata ids".format(
+                len(categories), len(qids)
+            )
+        )
+    return directory
+
+
+def is_category_index(directory):
+    return os.path.isfile(os.path.join(directory, META_FILE))
+
+
+class CategoryIndex:
+    """Memory-mapped reader for the index written by build_category_index."""
+
+    def __init__(self, directory):
+        def mapped(filename):
+            return MappedArray(os.path.join(directory, filename), "q")
+
+        self.categories = StringTable(os.path.join(directory, CATEGORIES_PREFIX))
+        self.postings_offsets = mapped(POSTINGS_OFFSETS_FILE)
+        self.postings = mapped(POSTINGS_FILE)
+        self.qids = mapped(QIDS_FILE)
+        self.qid_ids = mapped(QID_IDS_FILE)
+        self.ids = mapped(IDS_FILE)
+        self.id_qids = mapped(ID_QIDS_FILE)
+
+    def lookup_category(self, category):
+        """Returns the sorted wikipedia_ids of the pages in a category."""
+        key = str(category).strip().encode("utf-8")
+        pos = bisect.bisect_left(self.categories, key)
+        if pos == len(self.categories) or self.categories[pos] != key:
+            return []
+        start = self.postings_offsets[pos]
+        end = self.postings_offsets[pos + 1]
+        return list(self.postings[start:end])
+
+    def lookup_qid(self, qid):
+        """Returns the wikipedia_id of the page of a wikidata id or None."""
+        qid = parse_qid(qid)
+        if qid is None:
+            return None
+        pos = bisect.bisect_left(self.qids, qid)
+        if pos < len(self.qids) and self.qids[pos] == qid:
+            return self.qid_ids[pos]
+        return None
+
+    def get_qid(self, wikipedia_id):
+        """Returns the wikidata id (e.g. "Q42") of a page or None."""
+        try:
+            wikipedia_id = int(wikipedia_id)
+        except (TypeError, ValueError):
+            return None
+        pos = bisect.bisect_left(self.ids, wikipedia_id)
+        if pos < len(self.ids) and self.ids[pos] == wikipedia_id:
+            return "Q{}".format(self.id_qids[pos])
+        return None
+
+    def close(self):
+        for x in [
+            self.categories,
+            self.postings_offsets,
+            self.postings,
+            self.qids,
+            self.qid_ids,
+            self.ids,
+            self.id_qids,
+        ]:
+            x.close()
@@ -0,0 +1,197 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from kilt.ks.page_cache import estimate_page_size
+
+logger = logging.getLogger("KILT")
+
+# latency histogram bucket upper bounds in seconds: 10us to ~2 minutes,
+# 4 buckets per doubling
+BUCKETS = [1e-5 * 2 ** (i / 4) for i in range(96)]
+MAX_LOGGED_ARGUMENTS = 200
+
+
+def result_size(result):
+    """Approximate size in bytes of what a lookup returned."""
+    if result is None:
+        return 0
+    if isinstance(result, dict):
+        return estimate_page_size(result)
+    if isinstance(result, str):
+        return len(result)
+    if isinstance(result, (list, tuple)):
+        return sum(result_size(x) for x in result)
+    return 0
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (0 < q <= 1)."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+        return float("inf")
+
+
+class LookupStats:
+    """
+    Thread-safe per-method call counts, latency histograms and returned
+    bytes of the knowledge source lookups, plus named event counters (e.g.
+    which get_page_from_url stage resolved an url). Lookups slower than
+    slow_threshold seconds are logged.
+    """
+
+    def __init__(self, slow_threshold=None):
+        self.slow_threshold = slow_threshold
+        self.started = time.time()
+        self._histograms = {}
+        self._bytes = {}
+        self._errors = {}
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def record(self, method, seconds, result=None, args=None, error=False):
+        size = result_size(result)
+        with self._lock:
+            histogram = self._histograms.get(method)
+            if histogram is None:
+                histogram = self._histograms[method] = Histogram()
+                self._bytes[method] = 0
+                self._errors[method] = 0
+            histogram.add(seconds)
+            self._bytes[method] += size
+            if error:
+                self._errors[method] += 1
+        if self.slow_threshold is not None and seconds >= self.slow_threshold:
+            arguments = ", ".join(repr(x) for x in args or ())
+            if len(arguments) > MAX_LOGGED_ARGUMENTS:
+                arguments = arguments[:MAX_LOGGED_ARGUMENTS] + "..."
+            logger.warning(
+                "slow knowledge source lookup {}({}): {:.3f}s".format(
+                    method, arguments, seconds
+                )
+            )
+
+    def count_event(self, name):
+        with self._lock:
+            self._events[name] = self._events.get(name, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            methods = {}
+            for method, histogram in sorted(self._histograms.items()):
+                methods[method] = {
+                    "count": histogram.count,
+                    "errors": self._errors[method],
+                    "seconds": histogram.sum,
+                    "bytes": self._bytes[method],
+                    "p50": histogram.percentile(0.5),
+                    "p95": histogram.percentile(0.95),
+                    "p99": histogram.percentile(0.99),
+                }
+            return {
+                "uptime": time.time() - self.started,
+                "methods": methods,
+                "events": dict(sorted(self._events.items())),
+            }
+
+    def to_json(self, filename=None):
+        """Returns the snapshot as json, also written to filename if given."""
+        data = json.dumps(self.snapshot(), indent=2)
+        if filename:
+            with open(filename, "w") as fout:
+                fout.write(data)
+        return data
+
+    def to_prometheus(self, filename=None, prefix="kilt_ks"):
+        """
+        Returns the stats in the Prometheus text exposition format, also
+        written to filename if given (e.g. for the node exporter textfile
+        collector).
+        """
+        lines = []
+        with self._lock:
+            metric = "{}_lookup_seconds".format(prefix)
+            lines.append("# TYPE {} histogram".format(metric))
+            for method, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    if count:
+                        lines.append(
+                            '{}_bucket{{method="{}",le="{:.6g}"}} {}'.format(
+                                metric, method, bound, cumulative
+                            )
+                        )
+                lines.append(
+                    '{}_bucket{{method="{}",le="+Inf"}} {}'.format(
+                        metric, method, histogram.count
+                    )
+                )
+                lines.append(
+                    '{}_sum{{method="{}"}} {}'.format(metric, method, histogram.sum)
+                )
+                lines.append(
+                    '{}_count{{method="{}"}} {}'.format(metric, method, histogram.count)
+                )
+            for name, values in [
+                ("lookup_bytes_total", self._bytes),
+                ("lookup_errors_total", self._errors),
+            ]:
+                metric = "{}_{}".format(prefix, name)
+                lines.append("# TYPE {} counter".format(metric))
+                for method, value in sorted(values.items()):
+                    lines.append('{}{{method="{}"}} {}'.format(metric, method, value))
+            metric = "{}_events_total".format(prefix)
+            lines.append("# TYPE {} counter".format(metric))
+            for name, value in sorted(self._events.items()):
+                lines.append('{}{{event="{}"}} {}'.format(metric, name, value))
+        data = "\n".join(lines) + "\n"
+        if filename:
+            # write and rename, so that a collector never reads a partial file
+            with open(filename + ".tmp", "w") as fout:
+                fout.write(data)
+            os.replace(filename + ".tmp", filename)
+        return data
+
+    def export_periodically(self, interval, json_file=None, prometheus_file=None):
+        """
+        Writes the json and/or Prometheus files every interval seconds from
+        a daemon thread. Returns a threading.Event that stops the export.
+        """
+        stop = threading.Event()
+
+        def export():
+            while not stop.wait(interval):
+                if json_file:
+                    self.to_json(json_file)
+                if prometheus_file:
+                    self.to_prometheus(prometheus_file)
+
+        threading.Thread(target=export, daemon=True).start()
+        return stop
@@ -0,0 +1,121 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+
+from kilt.ks.anchor_graph import build_anchor_graph, is_anchor_graph
+from kilt.ks.bloom_filter import build_page_filter, is_page_filter
+from kilt.ks.category_index import build_category_index, is_category_index
+from kilt.ks.offset_index import (
+    ANCHOR_GRAPH_DIRECTORY,
+    CATEGORY_INDEX_DIRECTORY,
+    PAGE_FILTER_DIRECTORY,
+    PARAGRAPH_STORE_DIRECTORY,
+    TITLE_INDEX_DIRECTORY,
+    URL_INDEX_DIRECTORY,
+)
+from kilt.ks.paragraph_store import build_paragraph_store, is_paragraph_store
+from kilt.ks.title_index import build_title_index
+from kilt.ks.url_index import UrlIndexWriter, build_url_index
+
+TITLE_PROJECTION = {"wikipedia_id": 1, "wikipedia_title": 1, "history": 1}
+
+
+def _get_directories(index_directory):
+    # as the KnowledgeSource arguments to open each index
+    return {
+        "title_index_directory": os.path.join(index_directory, TITLE_INDEX_DIRECTORY),
+        "url_index_directory": os.path.join(index_directory, URL_INDEX_DIRECTORY),
+        "paragraph_store_directory": os.path.join(
+            index_directory, PARAGRAPH_STORE_DIRECTORY
+        ),
+        "anchor_graph_directory": os.path.join(index_directory, ANCHOR_GRAPH_DIRECTORY),
+        "category_index_directory": os.path.join(
+            index_directory, CATEGORY_INDEX_DIRECTORY
+        ),
+        "page_filter_directory": os.path.join(index_directory, PAGE_FILTER_DIRECTORY),
+    }
+
+
+def get_optional_indexes(index_directory):
+    """Returns the build_mongo_indexes flags of the indexes already built."""
+    return {
+        "paragraph_store": is_paragraph_store(
+            os.path.join(index_directory, PARAGRAPH_STORE_DIRECTORY)
+        ),
+        "anchor_graph": is_anchor_graph(
+            os.path.join(index_directory, ANCHOR_GRAPH_DIRECTORY)
+        ),
+        "category_index": is_category_index(
+            os.path.join(index_directory, CATEGORY_INDEX_DIRECTORY)
+        ),
+        "page_filter": is_page_filter(
+            os.path.join(index_directory, PAGE_FILTER_DIRECTORY)
+        ),
+    }
+
+
+def build_mongo_indexes(
+    ks,
+    index_directory,
+    redirects=None,
+    paragraph_store=False,
+    anchor_graph=False,
+    category_index=False,
+    page_filter=False,
+    verbose=False,
+):
+    """
+    Builds the title and url indexes of the mongoDB knowledge source ks in
+    index_directory, plus the optional paragraph store, anchor graph,
+    category index and page filter, reading the pages from the collection.
+    """
+    directories = _get_directories(index_directory)
+
+    build_title_index(
+        ks.db.find({}, TITLE_PROJECTION), directories["title_index_directory"]
+    )
+    if verbose:
+        print("title index stored in {}".format(directories["title_index_directory"]))
+    if redirects is None:
+        writer = UrlIndexWriter(
+            directories["url_index_directory"], directories["title_index_directory"]
+        )
+        for page in ks.db.find({}, TITLE_PROJECTION):
+            writer.add(page)
+        writer.close()
+    else:
+        build_url_index(
+            ks.db.find({}, TITLE_PROJECTION),
+            directories["url_index_directory"],
+            redirects,
+        )
+    if verbose:
+        print("url index stored in {}".format(directories["url_index_directory"]))
+
+    if page_filter:
+        build_page_filter(
+            ks.db.find({}, TITLE_PROJECTION), directories["page_filter_directory"]
+        )
+        if verbose:
+            print(
+                "page filter stored in {}".format(directories["page_filter_directory"])
+            )
+    if paragraph_store:
+        build_paragraph_store(
+            ks.db.find({}, {"wikipedia_id": 1, "text": 1}),
+            directories["paragraph_store_directory"],
+            verbose=verbose,
+        )
+    if anchor_graph:
+        build_anchor_graph(ks, directories["anchor_graph_directory"], verbose=verbose)
+    if category_index:
+        build_category_index(
+            ks.db.find({}, {"wikipedia_id": 1, "categories": 1, "wikidata_info": 1}),
+            directories["category_index_directory"],
+            verbose=verbose,
+        )
+    return index_directory
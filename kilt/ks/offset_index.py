@@ -0,0 +1,388 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import bisect
+import json
+import os
+import re
+import sys
+from array import array
+from json.decoder import scanstring
+
+from kilt.ks.arrays import (
+    ArrayWriter,
+    MappedArray,
+    StringTable,
+    write_array,
+    write_sorted_pairs,
+    write_string_table,
+)
+from kilt.ks.title_index import TitleIndexWriter
+from kilt.ks.url_index import UrlIndexWriter
+
+INDEX_VERSION = 4
+
+META_FILE = "meta.json"
+IDS_FILE = "ids.q"
+RECORDS_FILE = "records.q"
+OFFSETS_FILE = "offsets.q"
+LENGTHS_FILE = "lengths.q"
+FIELDS_FILE = "fields.i"
+PARAGRAPH_FIRST_FILE = "paragraph_first.q"
+PARAGRAPH_OFFSETS_FILE = "paragraph_offsets.q"
+PARAGRAPH_LENGTHS_FILE = "paragraph_lengths.i"
+TITLES_PREFIX = "titles"
+TITLE_IDS_FILE = "title_ids.q"
+TITLE_INDEX_DIRECTORY = "title_index"
+URL_INDEX_DIRECTORY = "url_index"
+PARAGRAPH_STORE_DIRECTORY = "paragraph_store"
+ANCHOR_GRAPH_DIRECTORY = "anchor_graph"
+CATEGORY_INDEX_DIRECTORY = "category_index"
+PAGE_FILTER_DIRECTORY = "page_filter"
+
+# top-level fields of a knowledge source record whose position is indexed
+INDEXED_FIELDS = (
+    "_id",
+    "wikipedia_id",
+    "wikipedia_title",
+    "text",
+    "anchors",
+    "categories",
+    "history",
+    "wikidata_info",
+)
+
+_WS = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+def default_index_directory(ks_file):
+    return ks_file + ".index"
+
+
+def iter_records(ks_file, start=0, end=None):
+    """
+    Yields (offset, length, line) for every non-empty line of the jsonl
+    knowledge source, where offset and length are in bytes. start and end
+    restrict the scan to the lines starting in the byte range [start, end).
+    """
+    offset = start
+    with open(ks_file, "rb") as fin:
+        fin.seek(start)
+        for line in fin:
+            if end is not None and offset >= end:
+                break
+            length = len(line)
+            if line.strip():
+                yield offset, length, line
+            offset += length
+
+
+def get_record_id(page):
+    return int(page["_id"] if "_id" in page else page["wikipedia_id"])
+
+
+def _skip_ws(s, idx):
+    return _WS.match(s, idx).end()
+
+
+def scan_record(line):
+    """
+    Decodes a knowledge source record (a json object on a single line) and
+    returns (page, field_spans, paragraph_spans), where field_spans maps each
+    top-level field to the (start, end) byte span of its json value and
+    paragraph_spans lists the byte spans of the string literals in "text".
+    """
+    s = line.decode("utf-8")
+    page = {}
+    spans = {}
+    paragraphs = []
+
+    idx = _skip_ws(s, 0)
+    if s[idx] != "{":
+        raise ValueError("not a json object")
+    idx = _skip_ws(s, idx + 1)
+    while s[idx] != "}":
+        key, idx = scanstring(s, idx + 1)
+        idx = _skip_ws(s, idx)
+        if s[idx] != ":":
+            raise ValueError("expected ':' at {}".format(idx))
+        idx = _skip_ws(s, idx + 1)
+        start = idx
+        if key == "text" and s[idx] == "[":
+            value = []
+            idx = _skip_ws(s, idx + 1)
+            while s[idx] != "]":
+                if s[idx] != '"':
+                    raise ValueError("text is not a list of strings")
+                paragraph_start = idx
+                paragraph, idx = scanstring(s, idx + 1)
+                paragraphs.append((paragraph_start, idx))
+                value.append(paragraph)
+                idx = _skip_ws(s, idx)
+                if s[idx] == ",":
+                    idx = _skip_ws(s, idx + 1)
+            idx += 1
+        else:
+            value, idx = _decoder.raw_decode(s, idx)
+        page[key] = value
+        spans[key] = (start, idx)
+        idx = _skip_ws(s, idx)
+        if s[idx] == ",":
+            idx = _skip_ws(s, idx + 1)
+
+    # from character to byte positions
+    if len(s) != len(line):
+        positions = sorted(
+            set(x for span in list(spans.values()) + paragraphs for x in span)
+        )
+        to_bytes = {}
+        char_pos = 0
+        byte_pos = 0
+        for position in positions:
+            byte_pos += len(s[char_pos:position].encode("utf-8"))
+            char_pos = position
+            to_bytes[position] = byte_pos
+        spans = {k: (to_bytes[a], to_bytes[b]) for k, (a, b) in spans.items()}
+        paragraphs = [(to_bytes[a], to_bytes[b]) for a, b in paragraphs]
+
+    return page, spans, paragraphs
+
+
+def build_offset_index(ks_file, index_directory=None, verbose=False):
+    """
+    Scans the jsonl knowledge source once and stores a sidecar index with:
+     - wikipedia_id -> record number, sorted by id
+     - per record (in file order): byte offset and length, the relative byte
+       span of each of the INDEXED_FIELDS and the byte span of each paragraph
+     - a sorted title -> wikipedia_id table
+    plus the normalized title index (see kilt.ks.title_index) and the url
+    resolution tables (see kilt.ks.url_index, sharing the title index) built
+    in the same pass.
+    """
+    if index_directory is None:
+        index_directory = default_index_directory(ks_file)
+    os.makedirs(index_directory, exist_ok=True)
+
+    def writer(filename, typecode):
+        return ArrayWriter(os.path.join(index_directory, filename), typecode)
+
+    offsets = writer(OFFSETS_FILE, "q")
+    lengths = writer(LENGTHS_FILE, "q")
+    fields = writer(FIELDS_FILE, "i")
+    paragraph_first = writer(PARAGRAPH_FIRST_FILE, "q")
+    paragraph_offsets = writer(PARAGRAPH_OFFSETS_FILE, "q")
+    paragraph_lengths = writer(PARAGRAPH_LENGTHS_FILE, "i")
+
+    title_index_directory = os.path.join(index_directory, TITLE_INDEX_DIRECTORY)
+    title_index = TitleIndexWriter(title_index_directory)
+    url_index = UrlIndexWriter(
+        os.path.join(index_directory, URL_INDEX_DIRECTORY), title_index_directory
+    )
+
+    # taken before the scan, so that an edit during the build is detected
+    ks_stat = os.stat(ks_file)
+    ids = array("q")
+    titles = []
+    for n, (offset, length, line) in enumerate(iter_records(ks_file)):
+        if verbose and n % 100000 == 0:
+            sys.stdout.write("indexed {} pages\r".format(n))
+            sys.stdout.flush()
+        page, spans, paragraph_spans = scan_record(line)
+        wikipedia_id = get_record_id(page)
+        ids.append(wikipedia_id)
+        titles.append((page["wikipedia_title"].encode("utf-8"), wikipedia_id))
+        title_index.add(page)
+        url_index.add(page)
+
+        offsets.append(offset)
+        lengths.append(length)
+        for field in INDEXED_FIELDS:
+            start, end = spans.get(field, (-1, -1))
+            fields.append(start)
+            fields.append(end - start)
+        paragraph_first.append(paragraph_offsets.count)
+        for start, end in paragraph_spans:
+            paragraph_offsets.append(offset + start)
+            paragraph_lengths.append(end - start)
+    paragraph_first.append(paragraph_offsets.count)
+
+    for x in [
+        offsets,
+        lengths,
+        fields,
+        paragraph_first,
+        paragraph_offsets,
+        paragraph_lengths,
+    ]:
+        x.close()
+
+    # record numbers are the positions in file order
+    write_sorted_pairs(
+        os.path.join(index_directory, IDS_FILE),
+        os.path.join(index_directory, RECORDS_FILE),
+        ids,
+        range(len(ids)),
+    )
+
+    titles.sort()
+    write_string_table(
+        os.path.join(index_directory, TITLES_PREFIX),
+        (x[0].decode("utf-8") for x in titles),
+    )
+    write_array(
+        os.path.join(index_directory, TITLE_IDS_FILE), "q", (x[1] for x in titles)
+    )
+
+    title_index.close()
+    url_index.close()
+
+    with open(os.path.join(index_directory, META_FILE), "w") as fout:
+        json.dump(
+            {
+                "version": INDEX_VERSION,
+                "ks_file": os.path.abspath(ks_file),
+                "ks_size": ks_stat.st_size,
+                "ks_mtime_ns": ks_stat.st_mtime_ns,
+                "num_pages": len(ids),
+            },
+            fout,
+        )
+
+    if verbose:
+        print("indexed {} pages in {}".format(len(ids), index_directory))
+    return index_directory
+
+
+def is_valid_index(ks_file, index_directory):
+    meta_file = os.path.join(index_directory, META_FILE)
+    if not os.path.isfile(meta_file):
+        return False
+    with open(meta_file, "r") as fin:
+        meta = json.load(fin)
+    if meta.get("version") != INDEX_VERSION:
+        return False
+    # an edit that keeps the size still changes the modification time
+    ks_stat = os.stat(ks_file)
+    return (
+        meta["ks_size"] == ks_stat.st_size
+        and meta["ks_mtime_ns"] == ks_stat.st_mtime_ns
+    )
+
+
+class OffsetIndex:
+    """Memory-mapped reader for the index written by build_offset_index."""
+
+    def __init__(self, index_directory):
+        self.index_directory = index_directory
+
+        def mapped(filename, typecode):
+            return MappedArray(os.path.join(index_directory, filename), typecode)
+
+        self.ids = mapped(IDS_FILE, "q")
+        self.records = mapped(RECORDS_FILE, "q")
+        self.offsets = mapped(OFFSETS_FILE, "q")
+        self.lengths = mapped(LENGTHS_FILE, "q")
+        self.fields = mapped(FIELDS_FILE, "i")
+        self.paragraph_first = mapped(PARAGRAPH_FIRST_FILE, "q")
+        self.paragraph_offsets = mapped(PARAGRAPH_OFFSETS_FILE, "q")
+        self.paragraph_lengths = mapped(PARAGRAPH_LENGTHS_FILE, "i")
+        self.titles = StringTable(os.path.join(index_directory, TITLES_PREFIX))
+        self.title_ids = mapped(TITLE_IDS_FILE, "q")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def record_number(self, wikipedia_id):
+        """Returns the position of the page in the file (in records) or -1."""
+        try:
+            wikipedia_id = int(wikipedia_id)
+        except (TypeError, ValueError):
+            return -1
+        pos = bisect.bisect_left(self.ids, wikipedia_id)
+        if pos < len(self.ids) and self.ids[pos] == wikipedia_id:
+            return self.records[pos]
+        return -1
+
+    def location(self, record):
+        """Returns (offset, length) in bytes of a record."""
+        return self.offsets[record], self.lengths[record]
+
+    def partition_range(self, partition, num_partitions):
+        """
+        Splits the records in num_partitions contiguous parts of about the
+        same size in bytes and returns the byte range [start, end) of one.
+        """
+        if num_partitions <= 0 or partition < 0 or partition >= num_partitions:
+            raise ValueError(
+                "invalid partition {}/{}".format(partition, num_partitions)
+            )
+        num_records = len(self.offsets)
+        if num_records == 0:
+            return 0, 0
+        total = self.offsets[num_records - 1] + self.lengths[num_records - 1]
+
+        def boundary(k):
+            if k >= num_partitions:
+                return total
+            record = bisect.bisect_left(self.offsets, total * k // num_partitions)
+            return self.offsets[record] if record < num_records else total
+
+        return boundary(partition), boundary(partition + 1)
+
+    def lookup(self, wikipedia_id):
+        """Returns (offset, length) of the page record or None."""
+        record = self.record_number(wikipedia_id)
+        if record < 0:
+            return None
+        return self.location(record)
+
+    def field_span(self, record, field):
+        """
+        Returns (offset, length) in bytes of the json value of a field of the
+        record, or None if the record does not have the field.
+        """
+        base = 2 * (record * len(INDEXED_FIELDS) + INDEXED_FIELDS.index(field))
+        start = self.fields[base]
+        if start < 0:
+            return None
+        return self.offsets[record] + start, self.fields[base + 1]
+
+    def num_paragraphs(self, record):
+        return self.paragraph_first[record + 1] - self.paragraph_first[record]
+
+    def paragraph_span(self, record, paragraph_id):
+        """
+        Returns (offset, length) in bytes of the json string literal of a
+        paragraph, or None if the paragraph does not exist.
+        """
+        if paragraph_id < 0 or paragraph_id >= self.num_paragraphs(record):
+            return None
+        flat = self.paragraph_first[record] + paragraph_id
+        return self.paragraph_offsets[flat], self.paragraph_lengths[flat]
+
+    def lookup_title(self, wikipedia_title):
+        """Returns the wikipedia_id for an exact title or None."""
+        key = str(wikipedia_title).encode("utf-8")
+        pos = bisect.bisect_left(self.titles, key)
+        if pos < len(self.titles) and self.titles[pos] == key:
+            return self.title_ids[pos]
+        return None
+
+    def close(self):
+        for x in [
+            self.ids,
+            self.records,
+            self.offsets,
+            self.lengths,
+            self.fields,
+            self.paragraph_first,
+            self.paragraph_offsets,
+            self.paragraph_lengths,
+            self.titles,
+            self.title_ids,
+        ]:
+            x.close()
@@ -0,0 +1,111 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import threading
+from collections import OrderedDict
+
+PAGE_OVERHEAD_BYTES = 1024
+ANCHOR_BYTES = 128
+
+
+def estimate_page_size(page):
+    """Cheap approximation of the memory held by a knowledge source record."""
+    size = PAGE_OVERHEAD_BYTES
+    for paragraph in page.get("text", []):
+        size += len(paragraph)
+    size += ANCHOR_BYTES * len(page.get("anchors", []))
+    return size
+
+
+class PageCache:
+    """
+    Thread-safe LRU cache of knowledge source pages bounded by the
+    approximate size of the cached pages (see estimate_page_size).
+    Pages are keyed by wikipedia_id and can also be reached through any
+    title they have been requested with. Cached pages are shared between
+    callers and must not be modified.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._pages = OrderedDict()  # wikipedia_id -> (page, size, titles)
+        self._titles = {}  # title -> wikipedia_id
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def _get(self, wikipedia_id):
+        entry = self._pages.get(wikipedia_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._pages.move_to_end(wikipedia_id)
+        self.hits += 1
+        return entry[0]
+
+    def get(self, wikipedia_id):
+        with self._lock:
+            return self._get(str(wikipedia_id))
+
+    def get_by_title(self, wikipedia_title):
+        with self._lock:
+            wikipedia_id = self._titles.get(wikipedia_title)
+            if wikipedia_id is None:
+                self.misses += 1
+                return None
+            return self._get(wikipedia_id)
+
+    def put(self, page, wikipedia_title=None):
+        wikipedia_id = str(page["wikipedia_id"])
+        size = estimate_page_size(page)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            entry = self._pages.pop(wikipedia_id, None)
+            if entry is not None:
+                titles = entry[2]
+                self.current_bytes -= entry[1]
+            else:
+                titles = set()
+            if wikipedia_title is not None:
+                titles.add(wikipedia_title)
+                self._titles[wikipedia_title] = wikipedia_id
+            self._pages[wikipedia_id] = (page, size, titles)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                evicted_id, (_, evicted_size, evicted_titles) = self._pages.popitem(
+                    last=False
+                )
+                for title in evicted_titles:
+                    if self._titles.get(title) == evicted_id:
+                        del self._titles[title]
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._titles.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "pages": len(self._pages),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests > 0 else 0.0,
+            }
@@ -0,0 +1,145 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import bisect
+import os
+import sys
+
+from kilt.ks.arrays import ArrayWriter, MappedArray, MappedFile, write_array
+from kilt.ks.offset_index import get_record_id
+
+IDS_FILE = "ids.q"
+RECORDS_FILE = "records.q"
+PARAGRAPH_FIRST_FILE = "paragraph_first.q"
+TEXT_FILE = "text.bin"
+TEXT_OFFSETS_FILE = "text_offsets.q"
+CHAR_LENGTHS_FILE = "char_lengths.q"
+
+
+def build_paragraph_store(pages, directory, verbose=False):
+    """
+    Stores the paragraphs of all the pages as one utf-8 blob addressed by a
+    flat offsets array, so that (wikipedia_id, paragraph_id) resolves to a
+    byte range without decoding the page. pages is an iterable of knowledge
+    source records (only wikipedia_id and text are used).
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    paragraph_first = ArrayWriter(os.path.join(directory, PARAGRAPH_FIRST_FILE), "q")
+    text_offsets = ArrayWriter(os.path.join(directory, TEXT_OFFSETS_FILE), "q")
+    char_lengths = ArrayWriter(os.path.join(directory, CHAR_LENGTHS_FILE), "q")
+    ids = []
+    offset = 0
+
+    with open(os.path.join(directory, TEXT_FILE), "wb") as fout:
+        for n, page in enumerate(pages):
+            if verbose and n % 100000 == 0:
+                sys.stdout.write("stored {} pages\r".format(n))
+                sys.stdout.flush()
+            ids.append((get_record_id(page), n))
+            paragraph_first.append(char_lengths.count)
+            for paragraph in page["text"]:
+                encoded = paragraph.encode("utf-8")
+                text_offsets.append(offset)
+                char_lengths.append(len(paragraph))
+                fout.write(encoded)
+                offset += len(encoded)
+
+    paragraph_first.append(char_lengths.count)
+    text_offsets.append(offset)
+    for x in [paragraph_first, text_offsets, char_lengths]:
+        x.close()
+
+    ids.sort()
+    write_array(os.path.join(directory, IDS_FILE), "q", (x[0] for x in ids))
+    write_array(os.path.join(directory, RECORDS_FILE), "q", (x[1] for x in ids))
+
+    if verbose:
+        print("stored {} paragraphs of {} pages".format(char_lengths.count, len(ids)))
+    return directory
+
+
+def is_paragraph_store(directory):
+    return os.path.isfile(os.path.join(directory, RECORDS_FILE))
+
+
+class ParagraphStore:
+    """Memory-mapped reader for the store written by build_paragraph_store."""
+
+    def __init__(self, directory):
+        def mapped(filename):
+            return MappedArray(os.path.join(directory, filename), "q")
+
+        self.ids = mapped(IDS_FILE)
+        self.records = mapped(RECORDS_FILE)
+        self.paragraph_first = mapped(PARAGRAPH_FIRST_FILE)
+        self.text_offsets = mapped(TEXT_OFFSETS_FILE)
+        self.char_lengths = mapped(CHAR_LENGTHS_FILE)
+        self.text = MappedFile(os.path.join(directory, TEXT_FILE))
+
+    def _record(self, wikipedia_id):
+        try:
+            wikipedia_id = int(wikipedia_id)
+        except (TypeError, ValueError):
+            return -1
+        pos = bisect.bisect_left(self.ids, wikipedia_id)
+        if pos == len(self.ids) or self.ids[pos] != wikipedia_id:
+            return -1
+        return self.records[pos]
+
+    def num_paragraphs(self, wikipedia_id):
+        """Returns the number of paragraphs of a page (0 if not found)."""
+        record = self._record(wikipedia_id)
+        if record < 0:
+            return 0
+        return self.paragraph_first[record + 1] - self.paragraph_first[record]
+
+    def _paragraph_index(self, wikipedia_id, paragraph_id):
+        record = self._record(wikipedia_id)
+        if record < 0:
+            return -1
+        first = self.paragraph_first[record]
+        paragraph_id = int(paragraph_id)
+        if paragraph_id < 0 or first + paragraph_id >= self.paragraph_first[record + 1]:
+            return -1
+        return first + paragraph_id
+
+    def get_paragraph(self, wikipedia_id, paragraph_id):
+        """Returns the text of a paragraph or None."""
+        index = self._paragraph_index(wikipedia_id, paragraph_id)
+        if index < 0:
+            return None
+        start = self.text_offsets[index]
+        end = self.text_offsets[index + 1]
+        return self.text.buffer[start:end].decode("utf-8")
+
+    def get_span(self, wikipedia_id, paragraph_id, start_character, end_character):
+        """
+        Returns paragraph[start_character:end_character], reading only the
+        bytes of the span when the paragraph is ascii.
+        """
+        index = self._paragraph_index(wikipedia_id, paragraph_id)
+        if index < 0:
+            return None
+        start = self.text_offsets[index]
+        end = self.text_offsets[index + 1]
+        if end - start != self.char_lengths[index]:
+            # multi-byte characters: offsets are not byte offsets
+            text = self.text.buffer[start:end].decode("utf-8")
+            return text[start_character:end_character]
+        span = slice(start_character, end_character).indices(end - start)
+        return self.text.buffer[start + span[0] : start + span[1]].decode("utf-8")
+
+    def close(self):
+        for x in [
+            self.ids,
+            self.records,
+            self.paragraph_first,
+            self.text_offsets,
+            self.char_lengths,
+            self.text,
+        ]:
+            x.close()
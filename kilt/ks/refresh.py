@@ -0,0 +1,190 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import json
+
+from pymongo import ReplaceOne
+
+from kilt.ks.mongo_indexes import build_mongo_indexes, get_optional_indexes
+from kilt.ks.offset_index import get_record_id, iter_records
+
+BATCH_SIZE = 1000
+
+
+def page_hash(page):
+    """
+    Digest of the content of a page that the derived artifacts depend on:
+    its title, text and anchors.
+    """
+    content = json.dumps(
+        [page.get("wikipedia_title"), page.get("text"), page.get("anchors")],
+        sort_keys=True,
+    )
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def hash_pages(pages):
+    """Returns a wikipedia_id -> page_hash dict for an iterable of pages."""
+    return {get_record_id(page): page_hash(page) for page in pages}
+
+
+def diff_knowledge_sources(old_pages, new_pages):
+    """
+    Compares two snapshots of the knowledge source (iterables of pages) and
+    returns {"added": [...], "removed": [...], "changed": [...]} with the
+    sorted wikipedia_ids of each kind. Only the hashes of the old snapshot
+    are kept in memory.
+    """
+    old_hashes = hash_pages(old_pages)
+    added = []
+    changed = []
+    for page in new_pages:
+        wikipedia_id = get_record_id(page)
+        old_hash = old_hashes.pop(wikipedia_id, None)
+        if old_hash is None:
+            added.append(wikipedia_id)
+        elif old_hash != page_hash(page):
+            changed.append(wikipedia_id)
+    return {
+        "added": sorted(added),
+        "removed": sorted(old_hashes.keys()),
+        "changed": sorted(changed),
+    }
+
+
+def save_delta(delta, filename):
+    with open(filename, "w") as fout:
+        json.dump(delta, fout)
+
+
+def load_delta(filename):
+    with open(filename, "r") as fin:
+        return json.load(fin)
+
+
+def _iter_new_pages(new_ks, wikipedia_ids, batch_size=BATCH_SIZE):
+    for i in range(0, len(wikipedia_ids), batch_size):
+        batch = wikipedia_ids[i : i + batch_size]
+        for wikipedia_id, page in zip(batch, new_ks.get_pages_by_ids(batch)):
+            if page is None:
+                raise ValueError(
+                    "page {} of the delta is not in the new knowledge source".format(
+                        wikipedia_id
+                    )
+                )
+            yield page
+
+
+def apply_delta_to_file(ks_file, new_ks, delta, output_file):
+    """
+    Writes the refreshed jsonl knowledge source to output_file: the records
+    of ks_file in the same order, with removed pages dropped and changed
+    pages replaced by their version in new_ks, followed by the added pages.
+    Unchanged records are copied byte for byte.
+    """
+    removed = set(delta["removed"])
+    changed = set(delta["changed"])
+    with open(output_file, "wb") as fout:
+        for _, _, line in iter_records(ks_file):
+            page = None
+            if removed or changed:
+                page = json.loads(line)
+                wikipedia_id = get_record_id(page)
+                if wikipedia_id in removed:
+                    continue
+                if wikipedia_id in changed:
+                    page = new_ks.get_page_by_id(wikipedia_id)
+                    fout.write(json.dumps(page).encode("utf-8") + b"\n")
+                    continue
+            fout.write(line if line.endswith(b"\n") else line + b"\n")
+        for page in _iter_new_pages(new_ks, delta["added"]):
+            fout.write(json.dumps(page).encode("utf-8") + b"\n")
+    return output_file
+
+
+def apply_delta_to_mongo(
+    ks, new_ks, delta, batch_size=BATCH_SIZE, index_directory=None, redirects=None
+):
+    """
+    Updates the mongoDB collection of ks in place: removed pages are
+    deleted, changed and added pages are replaced or inserted with their
+    version in new_ks. The indexes built from the collection in
+    index_directory (see kilt.ks.mongo_indexes) are then rebuilt, as they
+    would not know the added and renamed pages; ks must not have any index
+    open, since they would go stale.
+    """
+    open_indexes = [
+        name
+        for name in [
+            "title_index",
+            "url_index",
+            "paragraph_store",
+            "anchor_graph",
+            "category_index",
+            "page_filter",
+        ]
+        if getattr(ks, name) is not None
+    ]
+    if open_indexes:
+        raise ValueError(
+            "{} would be stale after the refresh, open the knowledge source "
+            "without indexes and rebuild them with index_directory".format(
+                ", ".join(open_indexes)
+            )
+        )
+
+    removed = [str(wikipedia_id) for wikipedia_id in delta["removed"]]
+    for i in range(0, len(removed), batch_size):
+        ks.db.delete_many({"_id": {"$in": removed[i : i + batch_size]}})
+
+    requests = []
+    for page in _iter_new_pages(new_ks, delta["changed"] + delta["added"]):
+        requests.append(ReplaceOne({"_id": page["_id"]}, page, upsert=True))
+        if len(requests) == batch_size:
+            ks.db.bulk_write(requests, ordered=False)
+            requests = []
+    if requests:
+        ks.db.bulk_write(requests, ordered=False)
+
+    if ks.page_cache is not None:
+        ks.page_cache.clear()
+
+    if index_directory is not None:
+        build_mongo_indexes(
+            ks,
+            index_directory,
+            redirects=redirects,
+            **get_optional_indexes(index_directory)
+        )
+
+
+def apply_delta_to_chunks(chunks_file, delta, new_chunks, output_file):
+    """
+    Refreshes the merged output of scripts/create_kilt_data_paragraphs.py
+    (lines of "<id>\\t<json chunk>"): the chunks of removed and changed pages
+    are dropped and new_chunks (the chunks of the changed and added pages)
+    are appended with ids following the largest existing one, so that the
+    ids of the untouched chunks stay valid for the downstream indexes.
+    Returns the ids given to the new chunks.
+    """
+    stale = set(str(x) for x in delta["removed"] + delta["changed"])
+    last_id = 0
+    with open(chunks_file, "r") as fin, open(output_file, "w") as fout:
+        for line in fin:
+            elements = line.split("\t")
+            if len(elements) != 2:
+                continue
+            last_id = max(last_id, int(elements[0]))
+            if str(json.loads(elements[1])["wikipedia_id"]) in stale:
+                continue
+            fout.write(line)
+        new_ids = []
+        for chunk in new_chunks:
+            last_id += 1
+            fout.write("{}\t{}\n".format(last_id, json.dumps(chunk)))
+            new_ids.append(last_id)
+    return new_ids
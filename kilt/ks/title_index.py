@@ -0,0 +1,168 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+import os
+import unicodedata
+import urllib.parse as urlparse
+import zlib
+from urllib.parse import parse_qs
+
+from kilt.ks.arrays import MappedArray, StringTable, write_array, write_string_table
+
+META_FILE = "meta.json"
+KEYS_PREFIX = "keys"
+BUCKETS_FILE = "buckets.q"
+POSTINGS_OFFSETS_FILE = "postings_offsets.q"
+POSTINGS_FILE = "postings.q"
+
+
+def normalize_title(title):
+    """
+    Key shared by all the spellings of a title that should resolve to the
+    same page: NFKD-normalized, case-folded and insensitive to underscores
+    and repeated whitespace.
+    """
+    title = unicodedata.normalize("NFKD", str(title)).casefold()
+    return " ".join(title.replace("_", " ").split())
+
+
+def get_alternate_titles(page):
+    """
+    Titles the page was known by according to its history (e.g. the title in
+    the revision url before the page was renamed).
+    """
+    titles = []
+    history = page.get("history") or {}
+    if history.get("title"):
+        titles.append(history["title"])
+    if history.get("url"):
+        record = parse_qs(urlparse.urlparse(history["url"]).query)
+        if "title" in record:
+            titles.append(record["title"][0])
+    return [title for title in titles if title != page["wikipedia_title"]]
+
+
+def _bucket(key, num_buckets):
+    return zlib.crc32(key.encode("utf-8")) % num_buckets
+
+
+class TitleIndexWriter:
+    """
+    Accumulates the normalized titles of the pages one at a time (only
+    wikipedia_id, wikipedia_title and history are read) and writes the hash
+    table of build_title_index on close.
+    """
+
+    def __init__(self, index_directory):
+        os.makedirs(index_directory, exist_ok=True)
+        self.index_directory = index_directory
+        self._postings = {}
+
+    def add_titles(self, wikipedia_id, titles):
+        for title in titles:
+            ids = self._postings.setdefault(normalize_title(title), [])
+            if wikipedia_id not in ids:
+                ids.append(wikipedia_id)
+
+    def add(self, page):
+        self.add_titles(
+            int(page["wikipedia_id"]),
+            [page["wikipedia_title"]] + get_alternate_titles(page),
+        )
+
+    def close(self):
+        postings = self._postings
+        num_buckets = max(1, 2 * len(postings))
+        keys = sorted(postings.keys(), key=lambda k: (_bucket(k, num_buckets), k))
+
+        buckets = [0] * (num_buckets + 1)
+        for key in keys:
+            buckets[_bucket(key, num_buckets) + 1] += 1
+        for i in range(num_buckets):
+            buckets[i + 1] += buckets[i]
+
+        offsets = [0]
+        for key in keys:
+            offsets.append(offsets[-1] + len(postings[key]))
+
+        index_directory = self.index_directory
+        write_string_table(os.path.join(index_directory, KEYS_PREFIX), keys)
+        write_array(os.path.join(index_directory, BUCKETS_FILE), "q", buckets)
+        write_array(os.path.join(index_directory, POSTINGS_OFFSETS_FILE), "q", offsets)
+        write_array(
+            os.path.join(index_directory, POSTINGS_FILE),
+            "q",
+            (wikipedia_id for key in keys for wikipedia_id in postings[key]),
+        )
+        with open(os.path.join(index_directory, META_FILE), "w") as fout:
+            json.dump({"num_buckets": num_buckets, "num_keys": len(keys)}, fout)
+        self._postings = {}
+
+
+def build_title_index(pages, index_directory):
+    """
+    Builds a hash table from normalized title (current and alternate titles)
+    to the list of wikipedia_ids of the candidate pages.
+    pages is an iterable of knowledge source records (only wikipedia_id,
+    wikipedia_title and history are used).
+    """
+    writer = TitleIndexWriter(index_directory)
+    for page in pages:
+        writer.add(page)
+    writer.close()
+    return index_directory
+
+
+def is_title_index(index_directory):
+    return os.path.isfile(os.path.join(index_directory, META_FILE))
+
+
+class TitleIndex:
+    """Memory-mapped reader for the hash table written by build_title_index."""
+
+    def __init__(self, index_directory):
+        with open(os.path.join(index_directory, META_FILE), "r") as fin:
+            self.num_buckets = json.load(fin)["num_buckets"]
+        self.keys = StringTable(os.path.join(index_directory, KEYS_PREFIX))
+        self.buckets = MappedArray(os.path.join(index_directory, BUCKETS_FILE), "q")
+        self.postings_offsets = MappedArray(
+            os.path.join(index_directory, POSTINGS_OFFSETS_FILE), "q"
+        )
+        self.postings = MappedArray(os.path.join(index_directory, POSTINGS_FILE), "q")
+
+    def lookup(self, title):
+        """Returns the wikipedia_ids of all the candidate pages for title."""
+        key = normalize_title(title)
+        bucket = _bucket(key, self.num_buckets)
+        encoded = key.encode("utf-8")
+        for i in range(self.buckets[bucket], self.buckets[bucket + 1]):
+            if self.keys[i] == encoded:
+                start = self.postings_offsets[i]
+                end = self.postings_offsets[i + 1]
+                return [str(self.postings[j]) for j in range(start, end)]
+        return []
+
+    def close(self):
+        for x in [self.keys, self.buckets, self.postings_offsets, self.postings]:
+            x.close()
+
+
+def rank_candidates(title, pages):
+    """
+    Orders candidate pages: exact title first, then normalized title matches
+    and finally pages matching through an alternate title.
+    """
+    key = normalize_title(title)
+
+    def rank(page):
+        if page["wikipedia_title"] == title:
+            return 0
+        if normalize_title(page["wikipedia_title"]) == key:
+            return 1
+        return 2
+
+    return sorted(pages, key=rank)
@@ -0,0 +1,200 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import bisect
+import json
+import os
+import urllib.parse as urlparse
+from array import array
+from urllib.parse import parse_qs, unquote
+
+from kilt.ks.arrays import MappedArray, write_sorted_pairs
+from kilt.ks.title_index import TitleIndex, TitleIndexWriter, normalize_title
+
+CURIDS_FILE = "curids.q"
+CURID_IDS_FILE = "curid_ids.q"
+OLDIDS_FILE = "oldids.q"
+OLDID_IDS_FILE = "oldid_ids.q"
+META_FILE = "meta.json"
+TITLE_INDEX_DIRECTORY = "titles"
+
+
+def parse_wikipedia_url(url):
+    """
+    Returns (curid, oldid, title) from a wikipedia url, any of which can be
+    None. http/https/missing scheme and desktop/mobile hosts are handled the
+    same way, titles are url-decoded.
+    """
+    url = url.strip().replace("&amp;", "&")
+    if "://" not in url:
+        url = "https://" + url.lstrip("/")
+    parsed = urlparse.urlparse(url)
+    record = parse_qs(parsed.query)
+
+    def param(name):
+        values = record.get(name)
+        if values and values[0].strip().isdigit():
+            return int(values[0])
+        return None
+
+    title = None
+    if "title" in record:
+        title = record["title"][0]
+    elif "/wiki/" in parsed.path:
+        title = unquote(parsed.path.split("/wiki/", 1)[1])
+    else:
+        last = unquote(parsed.path.rstrip("/").split("/")[-1])
+        if last and not last.endswith(".php"):
+            title = last
+
+    if title is not None:
+        title = title.replace("_", " ").strip() or None
+
+    return param("curid"), param("oldid"), title
+
+
+def load_redirects(filename):
+    """Reads a tsv file of redirect_title<TAB>target_title pairs."""
+    redirects = []
+    with open(filename, "r") as fin:
+        for line in fin:
+            elements = line.rstrip("\n").split("\t")
+            if len(elements) == 2:
+                redirects.append((elements[0], elements[1]))
+    return redirects
+
+
+class UrlIndexWriter:
+    """
+    Accumulates the page ids, revision ids and titles of the pages one at a
+    time (only wikipedia_id, wikipedia_title and history are read) and writes
+    the tables of build_url_index on close. With title_index_directory, the
+    url index resolves titles with that title index (built from the same
+    pages) instead of storing its own copy.
+    """
+
+    def __init__(self, index_directory, title_index_directory=None):
+        os.makedirs(index_directory, exist_ok=True)
+        self.index_directory = index_directory
+        self.curids = array("q")
+        self.curid_ids = array("q")
+        self.oldids = array("q")
+        self.oldid_ids = array("q")
+        if title_index_directory is None:
+            title_index_directory = os.path.join(index_directory, TITLE_INDEX_DIRECTORY)
+            self.titles = TitleIndexWriter(title_index_directory)
+        else:
+            self.titles = None
+        self.title_index_directory = os.path.relpath(
+            title_index_directory, index_directory
+        )
+
+    def add(self, page):
+        wikipedia_id = int(page["wikipedia_id"])
+        history = page.get("history") or {}
+        self.curids.append(int(history.get("pageid", wikipedia_id)))
+        self.curid_ids.append(wikipedia_id)
+        if history.get("revid"):
+            self.oldids.append(int(history["revid"]))
+            self.oldid_ids.append(wikipedia_id)
+        if self.titles is not None:
+            self.titles.add(page)
+
+    def close(self):
+        for filename, ids_filename, keys, values in [
+            (CURIDS_FILE, CURID_IDS_FILE, self.curids, self.curid_ids),
+            (OLDIDS_FILE, OLDID_IDS_FILE, self.oldids, self.oldid_ids),
+        ]:
+            write_sorted_pairs(
+                os.path.join(self.index_directory, filename),
+                os.path.join(self.index_directory, ids_filename),
+                keys,
+                values,
+            )
+        if self.titles is not None:
+            self.titles.close()
+        with open(os.path.join(self.index_directory, META_FILE), "w") as fout:
+            json.dump({"title_index": self.title_index_directory}, fout)
+
+
+def build_url_index(pages, index_directory, redirects=None):
+    """
+    Builds the offline url -> wikipedia_id resolution tables:
+     - curid (page id) and oldid (revision id) from the page history
+     - titles, alternate titles and the given redirects as a title index
+    pages is an iterable of knowledge source records (wikipedia_id,
+    wikipedia_title and history are used), redirects an optional iterable of
+    (redirect_title, target_title) pairs.
+    """
+    writer = UrlIndexWriter(index_directory)
+    exact_titles = {}
+    for page in pages:
+        writer.add(page)
+        if redirects is not None:
+            exact_titles[normalize_title(page["wikipedia_title"])] = int(
+                page["wikipedia_id"]
+            )
+
+    if redirects is not None:
+        for redirect_title, target_title in redirects:
+            wikipedia_id = exact_titles.get(normalize_title(target_title))
+            if wikipedia_id is not None:
+                writer.titles.add_titles(wikipedia_id, [redirect_title])
+
+    writer.close()
+    return index_directory
+
+
+def is_url_index(index_directory):
+    return os.path.isfile(os.path.join(index_directory, CURIDS_FILE))
+
+
+class UrlIndex:
+    """Memory-mapped reader for the tables written by build_url_index."""
+
+    def __init__(self, index_directory):
+        def mapped(filename):
+            return MappedArray(os.path.join(index_directory, filename), "q")
+
+        self.curids = mapped(CURIDS_FILE)
+        self.curid_ids = mapped(CURID_IDS_FILE)
+        self.oldids = mapped(OLDIDS_FILE)
+        self.oldid_ids = mapped(OLDID_IDS_FILE)
+        title_index_directory = TITLE_INDEX_DIRECTORY
+        meta_file = os.path.join(index_directory, META_FILE)
+        if os.path.isfile(meta_file):
+            with open(meta_file, "r") as fin:
+                title_index_directory = json.load(fin)["title_index"]
+        self.titles = TitleIndex(
+            os.path.normpath(os.path.join(index_directory, title_index_directory))
+        )
+
+    @staticmethod
+    def _search(keys, values, key):
+        pos = bisect.bisect_left(keys, key)
+        if pos < len(keys) and keys[pos] == key:
+            return str(values[pos])
+        return None
+
+    def resolve(self, url):
+        """Returns the candidate wikipedia_ids for a wikipedia url."""
+        curid, oldid, title = parse_wikipedia_url(url)
+        if curid is not None:
+            wikipedia_id = self._search(self.curids, self.curid_ids, curid)
+            if wikipedia_id is not None:
+                return [wikipedia_id]
+        if oldid is not None:
+            wikipedia_id = self._search(self.oldids, self.oldid_ids, oldid)
+            if wikipedia_id is not None:
+                return [wikipedia_id]
+        if title is not None:
+            return self.titles.lookup(title)
+        return []
+
+    def close(self):
+        for x in [self.curids, self.curid_ids, self.oldids, self.oldid_ids]:
+            x.close()
+        self.titles.close()
@@ -0,0 +1,123 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import threading
+from collections import OrderedDict
+
+ENTRY_OVERHEAD_BYTES = 512
+TOKEN_BYTES = 120
+POSTING_BYTES = 8
+
+
+def estimate_entry_size(tokens):
+    """Cheap approximation of the memory held by a tokenized paragraph."""
+    size = ENTRY_OVERHEAD_BYTES
+    for token in tokens:
+        size += TOKEN_BYTES + len(token)
+    return size
+
+
+def estimate_index_size(token_index):
+    """Cheap approximation of the memory held by a page token index."""
+    size = ENTRY_OVERHEAD_BYTES
+    for token, paragraph_ids in token_index.items():
+        size += TOKEN_BYTES + len(token) + POSTING_BYTES * len(paragraph_ids)
+    return size
+
+
+class TokenCache:
+    """
+    Thread-safe LRU cache of the paragraph tokenizations computed by
+    match_answer, bounded by their approximate size (see
+    estimate_entry_size). Entries are keyed by (wikipedia_id, paragraph_id,
+    normalize_text, tokenizer) and hold the tokens, their character offsets
+    and the set of tokens; page token indexes (see
+    kilt_utils.build_page_token_index) are stored with a None paragraph_id.
+    The text an entry was computed from is kept with it, so that a page that
+    changed since it was tokenized is never served stale tokens. Cached
+    entries are shared between callers and must not be modified.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (text, value, size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        # e.g. sent to a worker process: an empty cache of the same size
+        return {"max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_bytes"])
+
+    def get(self, key, text):
+        """
+        Returns the value stored for key, or None on a miss or if it was
+        computed from a different text.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != text:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def contains(self, key, text):
+        """Like get, without updating the recency or the hit statistics."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] == text
+
+    def put(self, key, paragraph, tokens, offsets, token_set=None):
+        """Stores a tokenization and returns it as (tokens, offsets, token_set)."""
+        if token_set is None:
+            token_set = frozenset(tokens)
+        value = (tokens, offsets, token_set)
+        self.put_value(key, paragraph, value, estimate_entry_size(tokens))
+        return value
+
+    def put_value(self, key, text, value, size):
+        size += len(text) if isinstance(text, str) else sum(len(x) for x in text)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.current_bytes -= entry[2]
+            self._entries[key] = (text, value, size)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted[2]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "paragraphs": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests > 0 else 0.0,
+            }
@@ -0,0 +1,66 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import re
+from collections import namedtuple
+
+SPACY_MODEL = "en_core_web_sm"
+
+# text and character offset, like the spacy tokens used by match_answer
+Token = namedtuple("Token", ["text", "idx"])
+
+APOSTROPHES = "'’"
+
+TOKEN_PATTERN = re.compile(
+    r"(?:[^\W\d_]\.){{2,}}"  # abbreviations: U.S., e.g.
+    r"|\d+(?:[.,:/]\d+)*(?![^\W_])"  # numbers: 1,000.5 12:30 1/2
+    r"|\w+(?=n[{a}]t\b)"  # do|n't
+    r"|n[{a}]t\b"
+    r"|[{a}](?:s|re|ve|ll|d|m)\b"  # clitics: 's 're 've 'll 'd 'm
+    r"|\w+"
+    r"|\.{{2,}}|-{{2,}}"  # ellipses and dashes
+    r"|\S".format(a=APOSTROPHES),  # any other character, e.g. punctuation
+    re.IGNORECASE,
+)
+
+
+class RegexTokenizer:
+    """
+    Lightweight replacement for the spacy pipeline in match_answer: calling
+    it on a text returns its tokens (with text and idx, the character offset
+    in the text) split on whitespace and punctuation following the spacy
+    english tokenizer closely enough to recover answer spans.
+    """
+
+    tokenizer_name = "regex"
+
+    def __call__(self, text):
+        return [
+            Token(match.group(), match.start())
+            for match in TOKEN_PATTERN.finditer(text)
+        ]
+
+    def pipe(self, texts, batch_size=None, n_process=1, disable=()):
+        """Same arguments as the spacy Language.pipe, only texts is used."""
+        for text in texts:
+            yield self(text)
+
+
+def load_tokenizer(tokenizer="spacy"):
+    """
+    Returns the nlp callable of match_answer: the spacy english pipeline
+    ("spacy"), a RegexTokenizer ("regex") or None for whitespace tokens
+    without character offsets ("split").
+    """
+    if tokenizer == "spacy":
+        import spacy
+
+        return spacy.load(SPACY_MODEL)
+    if tokenizer == "regex":
+        return RegexTokenizer()
+    if tokenizer == "split":
+        return None
+    raise ValueError("unknown tokenizer {}".format(tokenizer))
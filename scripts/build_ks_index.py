@@ -0,0 +1,143 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import json
+import os
+
+from kilt.knowledge_source import FileKnowledgeSource, KnowledgeSource
+from kilt.ks.anchor_graph import build_anchor_graph
+from kilt.ks.bloom_filter import build_page_filter
+from kilt.ks.category_index import build_category_index
+from kilt.ks.mongo_indexes import build_mongo_indexes
+from kilt.ks.offset_index import (
+    ANCHOR_GRAPH_DIRECTORY,
+    CATEGORY_INDEX_DIRECTORY,
+    PAGE_FILTER_DIRECTORY,
+    PARAGRAPH_STORE_DIRECTORY,
+    URL_INDEX_DIRECTORY,
+    build_offset_index,
+    default_index_directory,
+    iter_records,
+)
+from kilt.ks.paragraph_store import build_paragraph_store
+from kilt.ks.url_index import build_url_index, load_redirects
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--ks_file",
+        default=None,
+        type=str,
+        help="path to the jsonl knowledge source (kilt_knowledgesource.json)",
+    )
+
+    parser.add_argument(
+        "--mongo",
+        action="store_true",
+        help="build the title and url indexes reading pages from mongoDB",
+    )
+
+    parser.add_argument(
+        "--redirects",
+        default=None,
+        type=str,
+        help="optional tsv file of redirect_title<TAB>target_title for the url index",
+    )
+
+    parser.add_argument(
+        "--mongo_connection_string",
+        default=None,
+        type=str,
+    )
+
+    parser.add_argument(
+        "--index_directory",
+        default=None,
+        type=str,
+        help="where to store the index (default: <ks_file>.index)",
+    )
+
+    parser.add_argument(
+        "--paragraph_store",
+        action="store_true",
+        help="also store the paragraphs for get_paragraph / get_span lookups",
+    )
+
+    parser.add_argument(
+        "--anchor_graph",
+        action="store_true",
+        help="also resolve all the anchors and store the link graph",
+    )
+
+    parser.add_argument(
+        "--category_index",
+        action="store_true",
+        help="also store the category and wikidata id indexes",
+    )
+
+    parser.add_argument(
+        "--page_filter",
+        action="store_true",
+        help="also store a Bloom filter of the titles and ids to skip failed lookups",
+    )
+
+    args = parser.parse_args()
+
+    redirects = load_redirects(args.redirects) if args.redirects else None
+
+    if args.mongo:
+        if args.index_directory == None:
+            parser.error("--index_directory is required with --mongo")
+        build_mongo_indexes(
+            KnowledgeSource(args.mongo_connection_string),
+            args.index_directory,
+            redirects=redirects,
+            paragraph_store=args.paragraph_store,
+            anchor_graph=args.anchor_graph,
+            category_index=args.category_index,
+            page_filter=args.page_filter,
+            verbose=True,
+        )
+    else:
+        if args.ks_file == None:
+            parser.error("--ks_file is required")
+        if args.index_directory == None:
+            args.index_directory = default_index_directory(args.ks_file)
+        build_offset_index(args.ks_file, args.index_directory, verbose=True)
+        if redirects:
+            # rebuild the url tables including the redirects
+            build_url_index(
+                (json.loads(line) for _, _, line in iter_records(args.ks_file)),
+                os.path.join(args.index_directory, URL_INDEX_DIRECTORY),
+                redirects,
+            )
+        if args.paragraph_store:
+            build_paragraph_store(
+                (json.loads(line) for _, _, line in iter_records(args.ks_file)),
+                os.path.join(args.index_directory, PARAGRAPH_STORE_DIRECTORY),
+                verbose=True,
+            )
+        if args.anchor_graph:
+            ks = FileKnowledgeSource(args.ks_file, args.index_directory)
+            build_anchor_graph(
+                ks,
+                os.path.join(args.index_directory, ANCHOR_GRAPH_DIRECTORY),
+                verbose=True,
+            )
+            ks.close()
+        if args.category_index:
+            build_category_index(
+                (json.loads(line) for _, _, line in iter_records(args.ks_file)),
+                os.path.join(args.index_directory, CATEGORY_INDEX_DIRECTORY),
+                verbose=True,
+            )
+        if args.page_filter:
+            build_page_filter(
+                (json.loads(line) for _, _, line in iter_records(args.ks_file)),
+                os.path.join(args.index_directory, PAGE_FILTER_DIRECTORY),
+            )
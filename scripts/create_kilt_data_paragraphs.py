@@ -16,7 +16,11 @@ import spacy
 from tqdm import tqdm, trange
 
 import kilt.kilt_utils as utils
-from kilt.knowledge_source import KnowledgeSource
+from kilt.knowledge_source import FileKnowledgeSource, KnowledgeSource
+from kilt.ks.refresh import apply_delta_to_chunks, load_delta
+
+# documents chunked by each thread at a time when reading a partition
+PARTITION_BATCH_SIZE = 1000
 
 
 def create_chunk(document, buffer, paragraph_id, paragraph, section):
@@ -155,6 +159,20 @@ def load_all_documents_from_ks(cursor, steps, n):
     return documents
 
 
+def load_partition(rank, num_partitions, batch_size, ks_file=None):
+    # stream a disjoint slice of the knowledge source in batches of at most
+    # batch_size documents, no preprocess step needed
+    ks = FileKnowledgeSource(ks_file) if ks_file else KnowledgeSource()
+    documents = []
+    for document in ks.iter_partition(rank, num_partitions):
+        documents.append(document)
+        if len(documents) == batch_size:
+            yield documents
+            documents = []
+    if documents:
+        yield documents
+
+
 def preprocess_data(num_threads, folder):
 
     ks = KnowledgeSource()
@@ -168,39 +186,78 @@ def preprocess_data(num_threads, folder):
     store_chunks(ducuments, num_threads, folder)
 
 
-def main(rank, num_threads, folder, chunk_size):
-
-    print("loading chunk {}".format(rank), flush=True)
-    documents = load_chunk(rank, folder)
-
-    arguments = [
-        {
-            "rank": rank,
-            "id": id,
-            "documents": chunk,
-            "nlp": spacy.load("en_core_web_sm"),
-            "chunk_size": chunk_size,
-        }
-        for id, chunk in enumerate(utils.chunk_it(documents, num_threads))
-    ]
+def main(rank, num_threads, folder, chunk_size, num_partitions=None, ks_file=None):
 
-    print("starting {} threads in {}".format(num_threads, rank))
-    pool = ThreadPool(num_threads)
-    results = pool.map(run_thread, arguments)
+    if num_partitions:
+        print("loading partition {}/{}".format(rank, num_partitions), flush=True)
+        batches = load_partition(
+            rank, num_partitions, num_threads * PARTITION_BATCH_SIZE, ks_file
+        )
+    else:
+        print("loading chunk {}".format(rank), flush=True)
+        batches = [load_chunk(rank, folder)]
 
     f = open(os.path.join(folder, "kilt_{}.jsonl".format(rank)), "w+",)
 
     i = 1
-    for output in results:
-        for msg in output:
-            f.write("{}\t{}\n".format(i, json.dumps(msg)))
-            i += 1
+    for results in chunk_batches(batches, rank, num_threads, chunk_size):
+        for output in results:
+            for msg in output:
+                f.write("{}\t{}\n".format(i, json.dumps(msg)))
+                i += 1
     f.close()
-    pool.terminate()
-    pool.join()
     print("done {}".format(rank))
 
 
+def chunk_batches(batches, rank, num_threads, chunk_size):
+    # chunks one batch of documents at a time on the same threads and models
+    nlps = [spacy.load("en_core_web_sm") for _ in range(num_threads)]
+
+    print("starting {} threads in {}".format(num_threads, rank))
+    pool = ThreadPool(num_threads)
+    try:
+        for documents in batches:
+            arguments = [
+                {
+                    "rank": rank,
+                    "id": id,
+                    "documents": chunk,
+                    "nlp": nlps[id],
+                    "chunk_size": chunk_size,
+                }
+                for id, chunk in enumerate(utils.chunk_it(documents, num_threads))
+            ]
+            yield pool.map(run_thread, arguments)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def chunk_documents(documents, rank, num_threads, chunk_size):
+    return list(chunk_batches([documents], rank, num_threads, chunk_size))[0]
+
+
+def refresh(num_threads, folder, chunk_size, delta_file, ks_file=None):
+    # re-chunk only the changed and added pages of the refreshed knowledge source
+    delta = load_delta(delta_file)
+    ks = FileKnowledgeSource(ks_file) if ks_file else KnowledgeSource()
+    documents = [
+        document
+        for document in ks.get_pages_by_ids(delta["changed"] + delta["added"])
+        if document
+    ]
+    print("chunking {} documents".format(len(documents)), flush=True)
+    results = chunk_documents(documents, 0, num_threads, chunk_size)
+
+    new_ids = apply_delta_to_chunks(
+        os.path.join(folder, "kilt.jsonl"),
+        delta,
+        [msg for output in results for msg in output],
+        os.path.join(folder, "kilt_refreshed.jsonl"),
+    )
+    print("done, {} new chunks".format(len(new_ids)))
+
+
 def merge_files(num_threads, folder):
 
     f = open(os.path.join(folder, "kilt.jsonl"), "w+")
@@ -230,7 +287,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--step",
         type=str,
-        choices=["preprocess", "main", "merge"],
+        choices=["preprocess", "main", "merge", "refresh"],
         help="step to exectue",
     )
 
@@ -250,6 +307,27 @@ if __name__ == "__main__":
         "--threads", default=None, type=int, help="number of threads",
     )
 
+    parser.add_argument(
+        "--partitions",
+        default=None,
+        type=int,
+        help="number of ranks reading disjoint partitions of the knowledge source directly (no preprocess step)",
+    )
+
+    parser.add_argument(
+        "--ks_file",
+        default=None,
+        type=str,
+        help="read the jsonl knowledge source instead of mongoDB",
+    )
+
+    parser.add_argument(
+        "--delta",
+        default=None,
+        type=str,
+        help="delta of the knowledge source written by scripts/refresh_ks.py (refresh step)",
+    )
+
     args = parser.parse_args()
 
     if args.threads == None:
@@ -265,7 +343,18 @@ if __name__ == "__main__":
             num_threads=args.threads,
             folder=args.folder,
             chunk_size=args.chunk_size,
+            num_partitions=args.partitions,
+            ks_file=args.ks_file,
         )
     # step 3
     elif args.step == "merge":
-        merge_files(num_threads=args.threads, folder=args.folder)
+        merge_files(num_threads=args.partitions or args.threads, folder=args.folder)
+    # refresh the merged chunks after a knowledge source refresh
+    elif args.step == "refresh":
+        refresh(
+            num_threads=args.threads,
+            folder=args.folder,
+            chunk_size=args.chunk_size,
+            delta_file=args.delta,
+            ks_file=args.ks_file,
+        )
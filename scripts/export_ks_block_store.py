@@ -0,0 +1,65 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+
+from kilt.knowledge_source import FileKnowledgeSource, KnowledgeSource
+from kilt.ks.block_store import (
+    COMPRESSION_LEVEL,
+    PAGES_PER_BLOCK,
+    export_block_store,
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--ks_file",
+        default=None,
+        type=str,
+        help="jsonl knowledge source to export (default: read from mongoDB)",
+    )
+
+    parser.add_argument(
+        "--mongo_connection_string",
+        default=None,
+        type=str,
+    )
+
+    parser.add_argument(
+        "--output_directory",
+        required=True,
+        type=str,
+        help="block store directory",
+    )
+
+    parser.add_argument(
+        "--pages_per_block",
+        default=PAGES_PER_BLOCK,
+        type=int,
+    )
+
+    parser.add_argument(
+        "--compression_level",
+        default=COMPRESSION_LEVEL,
+        type=int,
+        help="zstd level",
+    )
+
+    args = parser.parse_args()
+
+    if args.ks_file:
+        ks = FileKnowledgeSource(args.ks_file)
+    else:
+        ks = KnowledgeSource(args.mongo_connection_string)
+
+    export_block_store(
+        ks.get_all_pages_cursor(),
+        args.output_directory,
+        pages_per_block=args.pages_per_block,
+        compression_level=args.compression_level,
+        verbose=True,
+    )
@@ -12,6 +12,9 @@ import argparse
 
 from kilt.knowledge_source import KnowledgeSource
 
+# mentions whose pages are looked up together
+BATCH_SIZE = 1000
+
 
 def write_output(filename, data):
     with open(filename, "w+") as outfile:
@@ -117,6 +120,7 @@ print("labels:", len(labels))
 missing_pages = 0
 with open(args.test_entities_filename, "r") as fin:
     lines = fin.readlines()
+    kb_titles = []
     for line in tqdm(lines):
         entity = json.loads(line)
         title = entity["title"]
@@ -125,11 +129,16 @@ with open(args.test_entities_filename, "r") as fin:
         if kb_idx in labels:
             labels[kb_idx] = True
             title = title.replace("&amp;", "&")
-            page = ks.get_page_by_title(title)
-            if page:
-                kb2id[kb_idx] = page["wikipedia_id"]
-            else:
-                missing_pages += 1
+            kb_titles.append((kb_idx, title))
+
+    pages = ks.get_pages_by_titles(
+        [title for _, title in kb_titles], fields=["wikipedia_id"]
+    )
+    for (kb_idx, _), page in zip(kb_titles, pages):
+        if page:
+            kb2id[kb_idx] = page["wikipedia_id"]
+        else:
+            missing_pages += 1
 
 c = 0
 for label, found in labels.items():
@@ -143,6 +152,55 @@ for label, found in labels.items():
             c += 1
 print(f"missing {c}/{len(labels)} labels in ks")
 
+
+def map_mentions(mentions):
+    # the titles of a batch of mentions are fetched in one bulk lookup
+    wikipedia_ids = list(set(str(kb2id[label_id]) for _, label_id in mentions))
+    pages = ks.get_pages_by_ids(wikipedia_ids, fields=["wikipedia_title"])
+    id2page = dict(zip(wikipedia_ids, pages))
+
+    kilt_records = []
+    for data, label_id in mentions:
+        wikipedia_id = kb2id[label_id]
+        page = id2page[str(wikipedia_id)]
+
+        input_text = (
+            str(data["context_left"]).strip()
+            + " "
+            + ent_start_token
+            + " "
+            + str(data["mention"]).strip()
+            + " "
+            + ent_end_token
+            + " "
+            + str(data["context_right"]).strip()
+        )
+
+        # rename
+        data["left_context"] = data.pop("context_left")
+        data["right_context"] = data.pop("context_right")
+
+        kilt_records.append(
+            {
+                "id": data["query_id"],
+                "input": input_text,
+                "output": [
+                    {
+                        "answer": page["wikipedia_title"],
+                        "provenance": [
+                            {
+                                "wikipedia_id": wikipedia_id,
+                                "title": page["wikipedia_title"],
+                            }
+                        ],
+                    }
+                ],
+                "meta": data,
+            }
+        )
+    return kilt_records
+
+
 for idx, filename in enumerate(
     [args.test_mentions_filename, args.train_mentions_filename]
 ):
@@ -150,49 +208,18 @@ for idx, filename in enumerate(
     missing = 0
     with open(filename, "r") as fin:
         lines = fin.readlines()
+        mentions = []
         for line in lines:
             data = json.loads(line)
             label_id = str(data["label_id"]).strip()
             if label_id in kb2id:
-                wikipedia_id = kb2id[label_id]
-                page = ks.get_page_by_id(wikipedia_id)
-
-                input_text = (
-                    str(data["context_left"]).strip()
-                    + " "
-                    + ent_start_token
-                    + " "
-                    + str(data["mention"]).strip()
-                    + " "
-                    + ent_end_token
-                    + " "
-                    + str(data["context_right"]).strip()
-                )
-
-                # rename
-                data["left_context"] = data.pop("context_left")
-                data["right_context"] = data.pop("context_right")
-
-                kilt_records.append(
-                    {
-                        "id": data["query_id"],
-                        "input": input_text,
-                        "output": [
-                            {
-                                "answer": page["wikipedia_title"],
-                                "provenance": [
-                                    {
-                                        "wikipedia_id": wikipedia_id,
-                                        "title": page["wikipedia_title"],
-                                    }
-                                ],
-                            }
-                        ],
-                        "meta": data,
-                    }
-                )
+                mentions.append((data, label_id))
+                if len(mentions) == BATCH_SIZE:
+                    kilt_records.extend(map_mentions(mentions))
+                    mentions = []
             else:
                 missing += 1
+        kilt_records.extend(map_mentions(mentions))
 
     if idx == 1:
         print("missing {}/{} points in train".format(missing, len(lines)))
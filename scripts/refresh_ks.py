@@ -0,0 +1,118 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+
+from kilt.knowledge_source import FileKnowledgeSource, KnowledgeSource
+from kilt.ks.refresh import (
+    apply_delta_to_file,
+    apply_delta_to_mongo,
+    diff_knowledge_sources,
+    load_delta,
+    save_delta,
+)
+from kilt.ks.url_index import load_redirects
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--step",
+        type=str,
+        required=True,
+        choices=["diff", "apply_file", "apply_mongo"],
+        help="diff two snapshots, then apply the delta to a jsonl file or to mongoDB",
+    )
+
+    parser.add_argument(
+        "--old_ks_file",
+        default=None,
+        type=str,
+        help="jsonl of the current knowledge source (default: read from mongoDB)",
+    )
+
+    parser.add_argument(
+        "--new_ks_file",
+        required=True,
+        type=str,
+        help="jsonl knowledge source built from the newer dump",
+    )
+
+    parser.add_argument(
+        "--delta",
+        required=True,
+        type=str,
+        help="json file of the added, removed and changed wikipedia ids",
+    )
+
+    parser.add_argument(
+        "--output_file",
+        default=None,
+        type=str,
+        help="refreshed jsonl knowledge source (apply_file)",
+    )
+
+    parser.add_argument(
+        "--mongo_connection_string",
+        default=None,
+        type=str,
+    )
+
+    parser.add_argument(
+        "--index_directory",
+        default=None,
+        type=str,
+        help="indexes built with scripts/build_ks_index.py --mongo, rebuilt after apply_mongo",
+    )
+
+    parser.add_argument(
+        "--redirects",
+        default=None,
+        type=str,
+        help="tsv file of redirects the url index was built with (apply_mongo)",
+    )
+
+    args = parser.parse_args()
+
+    new_ks = FileKnowledgeSource(args.new_ks_file)
+
+    if args.step == "diff":
+        if args.old_ks_file:
+            old_ks = FileKnowledgeSource(args.old_ks_file)
+        else:
+            old_ks = KnowledgeSource(args.mongo_connection_string)
+        delta = diff_knowledge_sources(
+            old_ks.get_all_pages_cursor(), new_ks.get_all_pages_cursor()
+        )
+        save_delta(delta, args.delta)
+        print(
+            "added: {} removed: {} changed: {}".format(
+                len(delta["added"]), len(delta["removed"]), len(delta["changed"])
+            )
+        )
+    elif args.step == "apply_file":
+        if args.old_ks_file == None or args.output_file == None:
+            parser.error("--old_ks_file and --output_file are required")
+        apply_delta_to_file(
+            args.old_ks_file, new_ks, load_delta(args.delta), args.output_file
+        )
+        print("refreshed knowledge source stored in {}".format(args.output_file))
+    elif args.step == "apply_mongo":
+        if args.index_directory == None:
+            print(
+                "WARNING: without --index_directory the indexes built from "
+                "mongoDB are not rebuilt and will be stale"
+            )
+        apply_delta_to_mongo(
+            KnowledgeSource(args.mongo_connection_string),
+            new_ks,
+            load_delta(args.delta),
+            index_directory=args.index_directory,
+            redirects=load_redirects(args.redirects) if args.redirects else None,
+        )
+        print("mongoDB knowledge source refreshed")
+        if args.index_directory:
+            print("indexes in {} rebuilt".format(args.index_directory))
@@ -32,8 +32,9 @@ setuptools.setup(
         "pymongo",
         "pytest",
         "rouge",
-        "spacy>=2.1.8",
+        "spacy>=2.2.2",
         "torch",
         "tqdm",
+        "zstandard",
     ],
 )
@@ -0,0 +1,194 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import unittest
+import itertools
+import json
+import os
+import tempfile
+from unittest import mock
+
+from kilt import dataset_mapper
+from kilt import kilt_utils as utils
+from kilt.datasets import entity_linking
+from kilt.datasets.base_dataset import Dataset
+
+
+class UpperCaseDataset(Dataset):
+    # maps each line without looking up the knowledge source
+    def __init__(self, name, lines, output_file):
+        super().__init__(name)
+        self.lines = lines
+        self.output_file = output_file
+        self.pids = None
+
+    def get_chunks(self, num_chunks):
+        return utils.chunk_it(self.lines, num_chunks)
+
+    def process_chunk(self, chunk, ks, chunk_id):
+        kilt_data = [{"id": line, "input": line.upper()} for line in chunk]
+        return kilt_data, [os.getpid()]
+
+    def postprocess_metadata(self, metadata):
+        self.pids = set(pid for pids in metadata for pid in pids)
+
+
+class StreamingUpperCaseDataset(UpperCaseDataset):
+    streaming = True
+
+    def iter_records(self):
+        yield from self.lines
+
+
+class TestMapDataset(unittest.TestCase):
+    def test_map_dataset(self):
+        lines = ["line {}".format(i) for i in range(100)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for dataset_class, use_processes in itertools.product(
+                [UpperCaseDataset, StreamingUpperCaseDataset], [False, True]
+            ):
+                output_file = os.path.join(tmpdir, "output.jsonl")
+                dataset = dataset_class("test", lines, output_file)
+                self.assertEqual(
+                    dataset.is_streaming(), dataset_class == StreamingUpperCaseDataset
+                )
+                dataset_mapper.map_dataset(
+                    dataset,
+                    use_processes=use_processes,
+                    chunk_size=7,
+                    max_pending_chunks=2,
+                )
+                with open(output_file, "r") as fin:
+                    self.assertEqual(
+                        [json.loads(line) for line in fin],
+                        [{"id": line, "input": line.upper()} for line in lines],
+                    )
+                if use_processes:
+                    self.assertNotIn(os.getpid(), dataset.pids)
+                else:
+                    self.assertEqual(dataset.pids, {os.getpid()})
+
+    def test_resume_map_dataset(self):
+        lines = ["line {}".format(i) for i in range(100)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            shard_directory = os.path.join(tmpdir, "shards")
+            output_file = os.path.join(tmpdir, "output.jsonl")
+
+            class FailingDataset(StreamingUpperCaseDataset):
+                # pre-empted after a few chunks
+                def process_chunk(self, chunk, ks, chunk_id):
+                    if chunk_id >= 3:
+                        raise RuntimeError("pre-empted")
+                    return super().process_chunk(chunk, ks, chunk_id)
+
+            dataset = FailingDataset("test", lines, output_file)
+            with self.assertRaises(RuntimeError):
+                dataset_mapper.map_dataset(
+                    dataset,
+                    chunk_size=10,
+                    max_pending_chunks=1,
+                    shard_directory=shard_directory,
+                )
+            self.assertFalse(os.path.exists(output_file))
+            self.assertEqual(
+                sorted(dataset_mapper.load_manifest(shard_directory)), [0, 1, 2]
+            )
+
+            # the chunk size of the first run is kept
+            dataset = StreamingUpperCaseDataset("test", lines, output_file)
+            processed = []
+            process_chunk = dataset.process_chunk
+
+            def record_chunk(chunk, ks, chunk_id):
+                processed.append(chunk_id)
+                return process_chunk(chunk, ks, chunk_id)
+
+            dataset.process_chunk = record_chunk
+            dataset_mapper.map_dataset(
+                dataset, chunk_size=7, shard_directory=shard_directory
+            )
+            self.assertEqual(sorted(processed), list(range(3, 10)))
+            with open(output_file, "r") as fin:
+                self.assertEqual(
+                    [json.loads(line) for line in fin],
+                    [{"id": line, "input": line.upper()} for line in lines],
+                )
+            self.assertEqual(dataset.pids, {os.getpid()})
+
+    def test_failed_writer(self):
+        lines = ["line {}".format(i) for i in range(100)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # the output file cannot be created
+            output_file = os.path.join(tmpdir, "missing", "output.jsonl")
+            dataset = StreamingUpperCaseDataset("test", lines, output_file)
+            with self.assertRaises(FileNotFoundError):
+                dataset_mapper.map_dataset(dataset, chunk_size=7, max_pending_chunks=1)
+
+            # a shard cannot be written after a few chunks
+            shard_directory = os.path.join(tmpdir, "shards")
+            output_file = os.path.join(tmpdir, "output.jsonl")
+            os.makedirs(dataset_mapper.get_shard_file(shard_directory, 3))
+            dataset = StreamingUpperCaseDataset("test", lines, output_file)
+            with self.assertRaises(OSError):
+                dataset_mapper.map_dataset(
+                    dataset,
+                    chunk_size=7,
+                    max_pending_chunks=1,
+                    shard_directory=shard_directory,
+                )
+            self.assertFalse(os.path.exists(output_file))
+            self.assertEqual(
+                sorted(dataset_mapper.load_manifest(shard_directory)), [0, 1, 2]
+            )
+
+
+class TestEntityLinkingDataset(unittest.TestCase):
+    def test_iter_records(self):
+        lines = [
+            "-DOCSTART- (1)\n",
+            "Paris\tB\tParis\tParis\thttp://en.wikipedia.org/wiki/Paris\t1\n",
+            "is\n",
+            "-DOCSTART- (2)\n",
+            "in\n",
+            "France\tB\tFrance\tFrance\thttp://en.wikipedia.org/wiki/France\t2\n",
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_file = os.path.join(tmpdir, "input.tsv")
+            with open(input_file, "w") as fout:
+                fout.writelines(lines)
+            with mock.patch.object(entity_linking, "KnowledgeSource") as ks_class:
+                ks_class.return_value.get_page_from_url.side_effect = lambda url: {
+                    "wikipedia_id": url[-1],
+                    "wikipedia_title": url.split("/")[-1],
+                }
+                dataset = entity_linking.EntityLinkingDataset(
+                    "test", input_file, None, None, None, None
+                )
+                self.assertTrue(dataset.is_streaming())
+                documents = list(dataset.iter_records())
+                self.assertEqual(documents, [lines[:3], lines[3:]])
+
+                # the documents are mapped as in a single chunk
+                kilt_data = [
+                    record
+                    for document in documents
+                    for record in dataset.process_chunk([document], None)[0]
+                ]
+                self.assertEqual(
+                    [
+                        (record["input"].strip(), record["id"].split("_")[-1])
+                        for record in kilt_data
+                    ],
+                    [
+                        ("[START_ENT] Paris [END_ENT] is", "1:0"),
+                        ("in [START_ENT] France [END_ENT]", "2:0"),
+                    ],
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
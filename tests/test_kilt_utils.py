@@ -0,0 +1,320 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import unittest
+import random
+import warnings
+
+from kilt import kilt_utils as utils
+from kilt.token_cache import TokenCache
+from kilt.tokenizer import RegexTokenizer, load_tokenizer
+
+
+def scan_bleu_span(paragraph_tokens, answer_tokens, max_bleu, start_token, end_token):
+    # exhaustive search over all the windows, as match_answer used to do
+    updated = False
+    for init in range(len(paragraph_tokens)):
+        for end in range(init, len(paragraph_tokens)):
+            BLEU = utils.get_bleu(paragraph_tokens[init : end + 1], answer_tokens)
+            if (
+                not max_bleu
+                or BLEU > max_bleu
+                or (
+                    BLEU == max_bleu
+                    and end_token
+                    and start_token
+                    and (end + 1 - init) < (end_token - start_token)
+                )
+            ):
+                max_bleu = BLEU
+                start_token = init
+                end_token = end
+                updated = True
+            if max_bleu == 1:
+                break
+        if max_bleu == 1:
+            break
+    return max_bleu, start_token, end_token, updated
+
+
+class TestMatchAnswer(unittest.TestCase):
+    def test_find_bleu_span(self):
+        rng = random.Random(0)
+        vocabulary = ["a", "b", "c", "d", "e", "f", " ", ""]
+        states = [(None, None, None), (0, None, None), (0.3, 2, 5), (0.1, 0, 3)]
+        with warnings.catch_warnings():
+            # zero n-gram overlaps in nltk
+            warnings.simplefilter("ignore")
+            for _ in range(300):
+                paragraph_tokens = [
+                    rng.choice(vocabulary) for _ in range(rng.randint(0, 15))
+                ]
+                answer_tokens = [
+                    rng.choice(vocabulary) for _ in range(rng.randint(0, 6))
+                ]
+                state = rng.choice(states)
+                self.assertEqual(
+                    utils.find_bleu_span(paragraph_tokens, answer_tokens, *state),
+                    scan_bleu_span(paragraph_tokens, answer_tokens, *state),
+                )
+
+    def test_match_answer(self):
+        page = {
+            "wikipedia_title": "Michael Jordan",
+            "text": [
+                "Michael Jordan\n",
+                "He played 15 seasons in the National Basketball Association.\n",
+                "He won six NBA championships with the Chicago Bulls.\n",
+            ],
+        }
+        self.assertEqual(
+            utils.match_answer("the Chicago Bulls", page), (2, 34, 51, 1.0)
+        )
+        paragraph_id, _, _, bleu = utils.match_answer(
+            "six championships with the Bulls", page
+        )
+        self.assertEqual(paragraph_id, 2)
+        self.assertGreater(bleu, 0)
+        self.assertLess(bleu, 1)
+
+    def test_token_cache(self):
+        page = {
+            "wikipedia_id": "123",
+            "wikipedia_title": "Michael Jordan",
+            "text": [
+                "Michael Jordan\n",
+                "He played 15 seasons in the National Basketball Association.\n",
+                "He won six NBA championships with the Chicago Bulls.\n",
+            ],
+        }
+        answers = [
+            "six championships with the Bulls",
+            "fifteen seasons in the Basketball Association",
+            "NBA championships Chicago",
+        ]
+        token_cache = TokenCache(1 << 20)
+        for answer in answers + answers:
+            self.assertEqual(
+                utils.match_answer(answer, page, token_cache=token_cache),
+                utils.match_answer(answer, page),
+            )
+        stats = token_cache.stats()
+        self.assertEqual(stats["paragraphs"], len(page["text"]))
+        self.assertEqual(stats["misses"], len(page["text"]))
+        self.assertEqual(stats["hits"], (2 * len(answers) - 1) * len(page["text"]))
+
+        # a changed page is tokenized again
+        page["text"][2] = "He won six NBA titles with the Chicago Bulls.\n"
+        self.assertEqual(
+            utils.match_answer(answers[0], page, token_cache=token_cache),
+            utils.match_answer(answers[0], page),
+        )
+        self.assertEqual(token_cache.stats()["misses"], len(page["text"]) + 1)
+
+        # bounded by memory
+        token_cache = TokenCache(2000)
+        utils.match_answer(answers[0], page, token_cache=token_cache)
+        self.assertLessEqual(token_cache.stats()["bytes"], 2000)
+        self.assertGreater(token_cache.stats()["evictions"], 0)
+
+    def test_find_exact_matches(self):
+        page = {
+            "wikipedia_id": "1",
+            "wikipedia_title": "Test",
+            "text": ["", "The Bulls won.", "", "the bulls won", "bulls", "a\x00b"],
+        }
+        answers = ["The Bulls", "bulls", "Bulls won", "s\nthe", "", "Lakers", "a\x00b"]
+        self.assertEqual(
+            utils.find_exact_matches(answers, page),
+            [(1, 0), (3, 4), (1, 4), False, (0, 0), False, None],
+        )
+        self.assertEqual(
+            utils.find_exact_matches(answers, page, normalize_text=False)[:2],
+            [(1, 0), (3, 4)],
+        )
+        for answer, exact_match in zip(
+            answers, utils.find_exact_matches(answers, page)
+        ):
+            self.assertEqual(
+                utils.match_answer(answer, page, exact_match=exact_match),
+                utils.match_answer(answer, page),
+            )
+
+    def test_match_answers_batch(self):
+        rng = random.Random(0)
+        vocabulary = ["a", "b", "c", "d", "e", "The", "f.", "g,", "h"]
+        pages = [
+            {
+                "wikipedia_id": str(i),
+                "wikipedia_title": "Test {}".format(i),
+                "text": [
+                    " ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 12)))
+                    for _ in range(rng.randint(1, 8))
+                ],
+            }
+            for i in range(10)
+        ]
+        pairs = [
+            (
+                " ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 4))),
+                rng.choice(pages),
+            )
+            for _ in range(100)
+        ]
+
+        class CountingTokenizer(RegexTokenizer):
+            calls = 0
+
+            def __call__(self, text):
+                self.calls += 1
+                return super().__call__(text)
+
+        nlp = CountingTokenizer()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for kwargs in [{}, {"normalize_text": False}]:
+                expected = [
+                    utils.match_answer(answer, page, nlp=RegexTokenizer(), **kwargs)
+                    for answer, page in pairs
+                ]
+                nlp.calls = 0
+                self.assertEqual(
+                    utils.match_answers_batch(pairs, nlp=nlp, batch_size=8, **kwargs),
+                    expected,
+                )
+                # answers are tokenized by match_answer, paragraphs only once
+                self.assertLessEqual(
+                    nlp.calls,
+                    len(pairs) + sum(len(page["text"]) for page in pages),
+                )
+            self.assertEqual(
+                utils.match_answers_batch(pairs),
+                [utils.match_answer(answer, page) for answer, page in pairs],
+            )
+
+    def test_token_index(self):
+        rng = random.Random(0)
+        vocabulary = ["a", "b", "c", "d", "e", "The", "f.", "g,", "h"]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for _ in range(200):
+                page = {
+                    "wikipedia_id": "1",
+                    "wikipedia_title": "Test",
+                    "text": [
+                        " ".join(
+                            rng.choice(vocabulary) for _ in range(rng.randint(1, 12))
+                        )
+                        for _ in range(rng.randint(1, 8))
+                    ],
+                }
+                answer = " ".join(
+                    rng.choice(vocabulary) for _ in range(rng.randint(1, 4))
+                )
+                normalize_text = rng.random() < 0.8
+                self.assertEqual(
+                    utils.match_answer(
+                        answer,
+                        page,
+                        normalize_text=normalize_text,
+                        use_token_index=True,
+                    ),
+                    utils.match_answer(answer, page, normalize_text=normalize_text),
+                )
+
+        # only the candidate paragraphs are tokenized
+        page = {
+            "wikipedia_id": "2",
+            "wikipedia_title": "List of numbers",
+            "text": ["number {} is not the answer".format(i) for i in range(1000)]
+            + ["he won six NBA championships with the Chicago Bulls"],
+        }
+        token_cache = TokenCache(1 << 20)
+        self.assertEqual(
+            utils.match_answer(
+                "six championships Bulls",
+                page,
+                MAX_PARAGRAPH_CANDIDATE=1,
+                token_cache=token_cache,
+                use_token_index=True,
+            ),
+            utils.match_answer(
+                "six championships Bulls", page, MAX_PARAGRAPH_CANDIDATE=1
+            ),
+        )
+        # the page index and the single candidate
+        self.assertEqual(token_cache.stats()["paragraphs"], 2)
+
+
+class TestRegexTokenizer(unittest.TestCase):
+    def test_tokens(self):
+        tokenizer = RegexTokenizer()
+        text = "I don't know John's U.S. policy, e.g. 1,000.5 dollars in the 1990s..."
+        tokens = tokenizer(text)
+        self.assertEqual(
+            [token.text for token in tokens],
+            [
+                "I",
+                "do",
+                "n't",
+                "know",
+                "John",
+                "'s",
+                "U.S.",
+                "policy",
+                ",",
+                "e.g.",
+                "1,000.5",
+                "dollars",
+                "in",
+                "the",
+                "1990s",
+                "...",
+            ],
+        )
+        for token in tokens:
+            self.assertEqual(text[token.idx : token.idx + len(token.text)], token.text)
+
+    def test_load_tokenizer(self):
+        self.assertIsInstance(load_tokenizer("regex"), RegexTokenizer)
+        self.assertIsNone(load_tokenizer("split"))
+        with self.assertRaises(ValueError):
+            load_tokenizer("unknown")
+
+    def test_match_answer(self):
+        page = {
+            "wikipedia_id": "123",
+            "wikipedia_title": "Michael Jordan",
+            "text": [
+                "Michael Jordan\n",
+                "He won six NBA championships (1991-1993, 1996-1998) with the Bulls.\n",
+            ],
+        }
+        nlp = RegexTokenizer()
+        answer = "six championships, with the Bulls"
+        paragraph_id, start_character, end_character, bleu = utils.match_answer(
+            answer, page, nlp=nlp
+        )
+        self.assertEqual(paragraph_id, 1)
+        self.assertEqual(
+            page["text"][1][start_character:end_character], ") with the Bulls"
+        )
+        self.assertLess(bleu, 1)
+        # offsets are unreliable without a tokenizer
+        self.assertEqual(utils.match_answer(answer, page)[1:3], (-1, -1))
+        # the spacy and regex tokenizations are cached separately
+        token_cache = TokenCache(1 << 20)
+        utils.match_answer(answer, page, token_cache=token_cache)
+        self.assertEqual(
+            utils.match_answer(answer, page, nlp=nlp, token_cache=token_cache),
+            (paragraph_id, start_character, end_character, bleu),
+        )
+        self.assertEqual(token_cache.stats()["hits"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
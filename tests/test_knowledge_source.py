@@ -0,0 +1,783 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+
+import unittest
+import importlib.resources
+import asyncio
+import json
+import os
+import pickle
+import signal
+import tempfile
+from unittest import mock
+
+from kilt.knowledge_source import (
+    AsyncKnowledgeSource,
+    BlockKnowledgeSource,
+    FileKnowledgeSource,
+    KnowledgeSource,
+)
+from kilt.ks.anchor_graph import AnchorGraph, build_anchor_graph
+from kilt.ks.block_store import export_block_store
+from kilt.ks.bloom_filter import PageFilter, build_page_filter
+from kilt.ks.category_index import build_category_index
+from kilt.ks.mongo_indexes import build_mongo_indexes
+from kilt.ks.page_cache import PageCache, estimate_page_size
+from kilt.ks.paragraph_store import build_paragraph_store
+from kilt.ks.refresh import (
+    apply_delta_to_chunks,
+    apply_delta_to_file,
+    apply_delta_to_mongo,
+    diff_knowledge_sources,
+)
+import tests.test_data as test_data
+
+
+class TestFileKnowledgeSource(unittest.TestCase):
+    def setUp(self):
+        with importlib.resources.open_text(test_data, "ks.jsonl") as ks_file:
+            self.ks_filename = ks_file.name
+            self.pages = [json.loads(line) for line in ks_file]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index_directory = os.path.join(self.tmp_dir.name, "index")
+        self.ks = FileKnowledgeSource(
+            self.ks_filename, index_directory=self.index_directory
+        )
+
+    def tearDown(self):
+        self.ks.close()
+        self.tmp_dir.cleanup()
+
+    def test_get_page_by_id(self):
+        self.assertEqual(self.ks.get_num_pages(), len(self.pages))
+        for page in self.pages:
+            self.assertEqual(self.ks.get_page_by_id(page["wikipedia_id"]), page)
+            self.assertEqual(self.ks.get_page_by_id(int(page["_id"])), page)
+        self.assertIsNone(self.ks.get_page_by_id("123"))
+        self.assertIsNone(self.ks.get_page_by_id("not an id"))
+
+    def test_get_page_by_title(self):
+        page = self.ks.get_page_by_title("Michael Jordan")
+        self.assertEqual(page["wikipedia_id"], "20455")
+        self.assertEqual(self.ks.get_page_by_title("Café")["wikipedia_id"], "180211")
+        self.assertIsNone(self.ks.get_page_by_title("Michael"))
+
+    def test_projection(self):
+        for page in self.pages:
+            projected = self.ks.get_page_by_id(
+                page["wikipedia_id"], fields=["wikipedia_title"]
+            )
+            self.assertEqual(
+                projected,
+                {"_id": page["_id"], "wikipedia_title": page["wikipedia_title"]},
+            )
+            for start, end in [(0, 1), (1, 3), (2, 100), (50, 60), (1, 1), (3, 1)]:
+                projected = self.ks.get_page_by_id(
+                    page["wikipedia_id"],
+                    fields=["wikipedia_title", "text"],
+                    paragraphs=(start, end),
+                )
+                self.assertEqual(projected["text"], page["text"][start:end])
+
+        projected = self.ks.get_page_by_title("Café", paragraphs=(1, 2))
+        self.assertEqual(
+            projected["text"],
+            ["A café is an establishment which primarily serves coffee."],
+        )
+        self.assertEqual(projected["anchors"], [])
+
+    def test_get_pages_by_title(self):
+        for title in [
+            "Email marketing",
+            "email MARKETING",
+            "Email_marketing",
+            " Email  marketing ",
+            "E-mail marketing",  # alternate title from the history url
+        ]:
+            pages = self.ks.get_pages_by_title(title)
+            self.assertEqual([page["wikipedia_id"] for page in pages], ["1101759"])
+
+        for title in ["CAFÉ", "Cafe\u0301"]:
+            pages = self.ks.get_pages_by_title(title)
+            self.assertEqual([page["wikipedia_id"] for page in pages], ["180211"])
+
+        self.assertEqual(self.ks.get_pages_by_title("Marketing"), [])
+
+    def test_get_pages_by_ids(self):
+        ids = ["6466", "123", "1101759", 6466]
+        pages = self.ks.get_pages_by_ids(ids)
+        self.assertEqual(len(pages), len(ids))
+        self.assertEqual(pages[0]["wikipedia_title"], "Chicago Bulls")
+        self.assertIsNone(pages[1])
+        self.assertEqual(pages[2]["wikipedia_title"], "Email marketing")
+        self.assertEqual(pages[3], pages[0])
+
+        pages = self.ks.get_pages_by_ids(ids, fields=["wikipedia_title"])
+        self.assertEqual(pages[0], {"_id": "6466", "wikipedia_title": "Chicago Bulls"})
+        self.assertIsNone(pages[1])
+        self.assertEqual(
+            self.ks.get_pages_by_titles(["Email", "Missing"], fields=["wikipedia_id"]),
+            [{"_id": "9738", "wikipedia_id": "9738"}, None],
+        )
+
+    def test_get_pages_by_titles(self):
+        titles = ["Email", "Missing page", "Michael Jordan"]
+        pages = self.ks.get_pages_by_titles(titles)
+        self.assertEqual(
+            [page["wikipedia_id"] if page else None for page in pages],
+            ["9738", None, "20455"],
+        )
+
+    def test_get_page_from_url(self):
+        page = self.ks.get_page_from_url("https://en.wikipedia.org/wiki/Chicago_Bulls")
+        self.assertEqual(page["wikipedia_id"], "6466")
+
+    def test_get_page_from_url_offline(self):
+        for url in [
+            "https://en.wikipedia.org/wiki/Chicago_Bulls",
+            "http://en.m.wikipedia.org/wiki/Chicago%20Bulls#History",
+            "en.wikipedia.org/wiki/chicago_bulls",
+            "https://en.wikipedia.org/w/index.php?curid=6466",
+            "https://en.wikipedia.org/w/index.php?title=Foo&amp;oldid=900006466",
+        ]:
+            page = self.ks.get_page_from_url(url)
+            self.assertEqual(page["wikipedia_id"], "6466")
+
+        url = "https://en.wikipedia.org/w/index.php?title=E-mail_marketing&oldid=1"
+        self.assertEqual(self.ks.get_page_from_url(url)["wikipedia_id"], "1101759")
+        url = "https://en.wikipedia.org/wiki/Caf%C3%A9"
+        self.assertEqual(self.ks.get_page_from_url(url)["wikipedia_id"], "180211")
+
+        # no live wikipedia calls when the url index is available
+        self.assertIsNone(self.ks.get_page_from_url("https://example.com/missing"))
+
+        # titles are resolved with the shared title index
+        self.assertFalse(
+            os.path.exists(os.path.join(self.index_directory, "url_index", "titles"))
+        )
+
+    def test_get_all_pages_cursor(self):
+        self.assertEqual(list(self.ks.get_all_pages_cursor()), self.pages)
+
+    def test_iter_partition(self):
+        for num_partitions in range(1, 2 * len(self.pages)):
+            partitions = [
+                list(self.ks.iter_partition(partition, num_partitions))
+                for partition in range(num_partitions)
+            ]
+            self.assertEqual(sum(partitions, []), self.pages)
+        with self.assertRaises(ValueError):
+            list(self.ks.iter_partition(2, 2))
+
+    def test_get_paragraph(self):
+        def check():
+            for page in self.pages:
+                for paragraph_id, paragraph in enumerate(page["text"]):
+                    self.assertEqual(
+                        self.ks.get_paragraph(page["wikipedia_id"], paragraph_id),
+                        paragraph,
+                    )
+                    for start, end in [(0, 5), (2, 9), (3, 1000), (-4, -1)]:
+                        self.assertEqual(
+                            self.ks.get_span(
+                                page["wikipedia_id"], paragraph_id, start, end
+                            ),
+                            paragraph[start:end],
+                        )
+                self.assertIsNone(
+                    self.ks.get_paragraph(page["wikipedia_id"], len(page["text"]))
+                )
+                self.assertIsNone(self.ks.get_paragraph(page["wikipedia_id"], -1))
+            self.assertEqual(self.ks.get_span(180211, 1, 2, 6), "café")
+            self.assertIsNone(self.ks.get_paragraph("123", 0))
+            self.assertIsNone(self.ks.get_span("123", 0, 0, 5))
+
+        # from the pages
+        check()
+        # from the paragraph store
+        self.ks.open_paragraph_store(
+            build_paragraph_store(
+                self.pages, os.path.join(self.tmp_dir.name, "paragraphs")
+            )
+        )
+        check()
+
+    def test_anchor_graph(self):
+        with self.assertRaises(ValueError):
+            self.ks.get_out_links(9738)
+        self.ks.open_anchor_graph(
+            build_anchor_graph(self.ks, os.path.join(self.tmp_dir.name, "graph"))
+        )
+        # "Internet%20standard" is not in the knowledge source
+        self.assertEqual(self.ks.get_out_links("9738"), [(1101759, 2), (27675, 4)])
+        self.assertEqual(self.ks.get_in_links(9738), [(1101759, 1), (27675, 1)])
+        self.assertEqual(self.ks.get_out_links(20455), [(6466, 2)])
+        self.assertEqual(self.ks.get_in_links(20455), [(6466, 2)])
+        self.assertEqual(self.ks.get_out_links(180211), [])
+        self.assertEqual(self.ks.get_in_links(180211), [])
+        self.assertEqual(self.ks.get_in_links("123"), [])
+
+    def test_anchor_graph_cursor_order(self):
+        class ReorderingKnowledgeSource:
+            # e.g. mongoDB cursors, whose order is not stable between scans
+            def __init__(self, pages):
+                self.pages = pages
+                self.scans = 0
+
+            def get_all_pages_cursor(self):
+                self.scans += 1
+                return iter(self.pages if self.scans % 2 else self.pages[::-1])
+
+        expected = AnchorGraph(
+            build_anchor_graph(self.ks, os.path.join(self.tmp_dir.name, "graph"))
+        )
+        graph = AnchorGraph(
+            build_anchor_graph(
+                ReorderingKnowledgeSource(self.pages),
+                os.path.join(self.tmp_dir.name, "reordered_graph"),
+            )
+        )
+        for page in self.pages:
+            self.assertEqual(
+                graph.out_links(page["wikipedia_id"]),
+                expected.out_links(page["wikipedia_id"]),
+            )
+            self.assertEqual(
+                graph.in_links(page["wikipedia_id"]),
+                expected.in_links(page["wikipedia_id"]),
+            )
+        self.assertEqual(graph.out_links(20455), [(6466, 2)])
+        self.assertEqual(
+            os.listdir(os.path.join(self.tmp_dir.name, "reordered_graph")),
+            os.listdir(os.path.join(self.tmp_dir.name, "graph")),
+        )
+        graph.close()
+        expected.close()
+
+    def test_category_index(self):
+        with self.assertRaises(ValueError):
+            self.ks.get_ids_by_category("Email")
+        self.ks.open_category_index(
+            build_category_index(
+                self.pages, os.path.join(self.tmp_dir.name, "categories")
+            )
+        )
+        self.assertEqual(self.ks.get_ids_by_category("Email"), [9738, 27675, 1101759])
+        self.assertEqual(self.ks.get_ids_by_category("Chicago Bulls"), [6466])
+        self.assertEqual(self.ks.get_ids_by_category("Chicago"), [])
+        self.assertEqual(self.ks.get_id_by_qid("Q41421"), 20455)
+        self.assertEqual(self.ks.get_id_by_qid("Q1"), None)
+        self.assertEqual(self.ks.get_id_by_qid("not a qid"), None)
+        self.assertEqual(self.ks.get_qid_by_id("1101759"), "Q1317349")
+        self.assertEqual(self.ks.get_qid_by_id(123), None)
+        page = self.ks.get_page_by_qid("Q128109", fields=["wikipedia_title"])
+        self.assertEqual(page["wikipedia_title"], "Chicago Bulls")
+
+    def test_page_filter(self):
+        page_filter = PageFilter(
+            build_page_filter(self.pages, os.path.join(self.tmp_dir.name, "filter"))
+        )
+        for page in self.pages:
+            self.assertTrue(page_filter.might_contain_id(page["wikipedia_id"]))
+            self.assertTrue(page_filter.might_contain_title(page["wikipedia_title"]))
+        self.assertTrue(page_filter.might_contain_title("e-mail_MARKETING"))
+        self.assertFalse(page_filter.might_contain_id("not an id"))
+        misses = [str(wikipedia_id) for wikipedia_id in range(1000)]
+        self.assertLess(sum(map(page_filter.might_contain_id, misses)), 50)
+
+        self.ks.open_page_filter(os.path.join(self.tmp_dir.name, "filter"))
+        with mock.patch.object(
+            self.ks, "_fetch_pages_by_ids", wraps=self.ks._fetch_pages_by_ids
+        ) as fetch:
+            self.assertEqual(
+                self.ks.get_pages_by_ids(["20455", "not an id", "6466"]),
+                [self.pages[3], None, self.pages[4]],
+            )
+            fetch.assert_called_once_with(["20455", "6466"], None)
+        self.assertEqual(self.ks.get_page_by_title("Café"), self.pages[5])
+        self.assertIsNone(self.ks.get_page_by_title("Michael"))
+
+    def test_lookup_stats(self):
+        stats = self.ks.enable_lookup_stats(slow_threshold=0)
+        self.ks.get_page_by_id(20455)
+        self.ks.get_page_by_id("123")
+        self.ks.get_pages_by_ids(["20455", "6466"])
+        with self.assertLogs("KILT", level="WARNING"):
+            self.ks.get_page_from_url("https://en.wikipedia.org/wiki/Chicago_Bulls")
+        self.ks.get_page_from_url("https://en.wikipedia.org/wiki/Unknown_page")
+
+        snapshot = stats.snapshot()
+        methods = snapshot["methods"]
+        self.assertEqual(methods["get_page_by_id"]["count"], 2)
+        self.assertEqual(methods["get_pages_by_ids"]["count"], 3)
+        self.assertEqual(methods["get_page_from_url"]["count"], 2)
+        self.assertGreater(methods["get_pages_by_ids"]["bytes"], 0)
+        self.assertLessEqual(
+            methods["get_page_by_id"]["p50"], methods["get_page_by_id"]["p99"]
+        )
+        self.assertEqual(snapshot["events"], {"url_index": 1, "url_not_found": 1})
+        self.assertEqual(json.loads(stats.to_json())["events"], snapshot["events"])
+
+        prometheus_file = os.path.join(self.tmp_dir.name, "ks.prom")
+        text = stats.to_prometheus(prometheus_file)
+        self.assertIn('kilt_ks_lookup_seconds_count{method="get_page_by_id"} 2', text)
+        self.assertIn('kilt_ks_events_total{event="url_index"} 1', text)
+        with open(prometheus_file, "r") as fin:
+            self.assertEqual(fin.read(), text)
+
+    def test_reuse_index(self):
+        with self.assertRaises(ValueError):
+            FileKnowledgeSource(
+                self.ks_filename,
+                index_directory=os.path.join(self.tmp_dir.name, "missing"),
+                build_index=False,
+            )
+        ks = FileKnowledgeSource(
+            self.ks_filename, index_directory=self.index_directory, build_index=False
+        )
+        self.assertEqual(ks.get_page_by_title("Email")["wikipedia_id"], "9738")
+        ks.close()
+
+    def test_stale_index(self):
+        # an edit of the knowledge source that keeps its size
+        ks_filename = os.path.join(self.tmp_dir.name, "ks.jsonl")
+        with open(self.ks_filename, "rb") as fin:
+            data = fin.read()
+        with open(ks_filename, "wb") as fout:
+            fout.write(data)
+        ks = FileKnowledgeSource(ks_filename, index_directory=self.index_directory)
+        ks.close()
+        with open(ks_filename, "wb") as fout:
+            fout.write(data.replace(b"Chicago Bulls", b"Chicago Bears"))
+        stat = os.stat(ks_filename)
+        os.utime(ks_filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        with self.assertRaises(ValueError):
+            FileKnowledgeSource(
+                ks_filename, index_directory=self.index_directory, build_index=False
+            )
+        ks = FileKnowledgeSource(ks_filename, index_directory=self.index_directory)
+        self.assertEqual(ks.get_page_by_id(6466)["wikipedia_title"], "Chicago Bears")
+        ks.close()
+
+
+class TestKnowledgeSource(unittest.TestCase):
+    def test_lazy_fork_safe_client(self):
+        ks = KnowledgeSource(
+            "mongodb://127.0.0.1:27017/admin",
+            collection="pages",
+            max_pool_size=4,
+            server_selection_timeout_ms=1000,
+            read_preference="secondaryPreferred",
+        )
+        self.assertIsNone(ks._client)
+        client = ks.client
+        self.assertIs(ks.client, client)
+        self.assertEqual(client.options.pool_options.max_pool_size, 4)
+        self.assertEqual(client.options.server_selection_timeout, 1)
+        self.assertEqual(client.read_preference.mongos_mode, "secondaryPreferred")
+        self.assertEqual(ks.db.name, "pages")
+
+        # as in a forked child
+        ks._pid = -1
+        self.assertIsNot(ks.client, client)
+        client.close()
+
+        ks.enable_page_cache(2**20)
+        ks.enable_lookup_stats(slow_threshold=0.5)
+        copy = pickle.loads(pickle.dumps(ks))
+        self.assertIsNone(copy._client)
+        self.assertEqual(copy.collection, "pages")
+        self.assertEqual(copy.client_options, ks.client_options)
+        self.assertEqual(copy.page_cache.max_bytes, 2**20)
+        self.assertEqual(copy.lookup_stats.slow_threshold, 0.5)
+        ks.close()
+        copy.close()
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires fork")
+    def test_fork_with_held_client_lock(self):
+        ks = KnowledgeSource("mongodb://127.0.0.1:27017/admin")
+        with ks._client_lock:
+            # as if another thread was creating the client at the fork
+            pid = os.fork()
+            if pid == 0:
+                # killed by the alarm if the client lock is still held
+                signal.alarm(10)
+                try:
+                    ks.client
+                except Exception:
+                    os._exit(1)
+                os._exit(0)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        ks.close()
+
+    def test_empty_paragraph_range(self):
+        with importlib.resources.open_text(test_data, "ks.jsonl") as ks_file:
+            page = json.loads(ks_file.readline())
+        ks = KnowledgeSource("mongodb://127.0.0.1:27017/admin")
+
+        def find_one(query, projection):
+            # text is not fetched, $slice needs a positive count
+            self.assertEqual(projection.get("text", 0), 0)
+            if projection.get("text") == 0:
+                return {k: v for k, v in page.items() if k != "text"}
+            return {k: v for k, v in page.items() if k in projection}
+
+        with mock.patch.object(
+            KnowledgeSource, "db", new_callable=mock.PropertyMock
+        ) as db:
+            db.return_value.find_one.side_effect = find_one
+            for paragraphs in [(1, 1), (3, 1)]:
+                projected = ks.get_page_by_id(page["_id"], paragraphs=paragraphs)
+                self.assertEqual(projected["text"], [])
+                self.assertEqual(projected["wikipedia_title"], page["wikipedia_title"])
+                projected = ks.get_page_by_title(
+                    page["wikipedia_title"], fields=["text"], paragraphs=paragraphs
+                )
+                self.assertEqual(projected, {"_id": page["_id"], "text": []})
+        ks.close()
+
+    def test_open_paragraph_range(self):
+        with importlib.resources.open_text(test_data, "ks.jsonl") as ks_file:
+            page = json.loads(ks_file.readline())
+        ks = KnowledgeSource("mongodb://127.0.0.1:27017/admin")
+
+        def find_one(query, projection):
+            # as mongoDB applies $slice
+            projected = dict(page)
+            text_slice = (projection or {}).get("text", {}).get("$slice")
+            if isinstance(text_slice, int):
+                self.assertLess(text_slice, 0)
+                projected["text"] = page["text"][text_slice:]
+            elif text_slice is not None:
+                skip, limit = text_slice
+                self.assertGreaterEqual(skip, 0)
+                self.assertGreater(limit, 0)
+                projected["text"] = page["text"][skip : skip + limit]
+            return projected
+
+        with mock.patch.object(
+            KnowledgeSource, "db", new_callable=mock.PropertyMock
+        ) as db:
+            db.return_value.find_one.side_effect = find_one
+            for paragraphs in [(1, None), (-2, None), (None, 2), (0, -1), (-3, -1)]:
+                projected = ks.get_page_by_id(page["_id"], paragraphs=paragraphs)
+                self.assertEqual(projected["text"], page["text"][slice(*paragraphs)])
+        ks.close()
+
+
+class TestRefresh(unittest.TestCase):
+    def setUp(self):
+        with importlib.resources.open_text(test_data, "ks.jsonl") as ks_file:
+            self.ks_filename = ks_file.name
+            self.pages = [json.loads(line) for line in ks_file]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+        # newer snapshot: Café removed, Email edited, one page added
+        self.new_pages = [json.loads(json.dumps(page)) for page in self.pages[:-1]]
+        self.new_pages[1]["text"][1] += " It is not a new invention."
+        self.new_pages[1]["history"]["revid"] += 1
+        self.new_pages[3]["history"]["revid"] += 1
+        self.new_pages.append(
+            {
+                "_id": "3392",
+                "wikipedia_id": "3392",
+                "wikipedia_title": "Basketball",
+                "text": ["Basketball\n", "Basketball is a team sport.\n"],
+                "anchors": [],
+                "categories": "Basketball",
+                "history": {"revid": 900003392, "pageid": 3392},
+                "wikidata_info": {"wikidata_id": "Q5372"},
+            }
+        )
+        self.new_ks_filename = os.path.join(self.tmp_dir.name, "new_ks.jsonl")
+        with open(self.new_ks_filename, "w") as fout:
+            for page in self.new_pages:
+                fout.write(json.dumps(page) + "\n")
+        self.delta = diff_knowledge_sources(self.pages, self.new_pages)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_diff(self):
+        # a new revision with the same text and anchors is not a change
+        self.assertEqual(
+            self.delta, {"added": [3392], "removed": [180211], "changed": [9738]}
+        )
+        self.assertEqual(
+            diff_knowledge_sources(self.pages, self.pages),
+            {"added": [], "removed": [], "changed": []},
+        )
+
+    def test_apply_delta_to_file(self):
+        new_ks = FileKnowledgeSource(
+            self.new_ks_filename,
+            index_directory=os.path.join(self.tmp_dir.name, "new_index"),
+        )
+        output_file = os.path.join(self.tmp_dir.name, "refreshed.jsonl")
+        apply_delta_to_file(self.ks_filename, new_ks, self.delta, output_file)
+        new_ks.close()
+
+        with open(output_file, "r") as fin:
+            refreshed = [json.loads(line) for line in fin]
+        # unchanged pages are copied from the old snapshot
+        self.assertEqual(
+            refreshed,
+            self.pages[:1] + self.new_pages[1:2] + self.pages[2:5] + self.new_pages[5:],
+        )
+
+    def test_apply_delta_to_mongo(self):
+        class Collection:
+            # the parts of a pymongo collection used by the refresh
+            def __init__(self, pages):
+                self.pages = {page["_id"]: page for page in pages}
+
+            def find(self, query, projection=None):
+                for page in list(self.pages.values()):
+                    if all(page.get(k) in v["$in"] for k, v in query.items()):
+                        if projection is not None:
+                            page = {
+                                k: v
+                                for k, v in page.items()
+                                if k == "_id" or k in projection
+                            }
+                        yield page
+
+            def find_one(self, query, projection=None):
+                query = {k: {"$in": [v]} for k, v in query.items()}
+                return next(self.find(query, projection), None)
+
+            def delete_many(self, query):
+                for wikipedia_id in query["_id"]["$in"]:
+                    self.pages.pop(wikipedia_id, None)
+
+            def bulk_write(self, requests, ordered):
+                for request in requests:
+                    self.pages[request._doc["_id"]] = request._doc
+
+        index_directory = os.path.join(self.tmp_dir.name, "mongo_index")
+        directories = {
+            "title_index_directory": os.path.join(index_directory, "title_index"),
+            "url_index_directory": os.path.join(index_directory, "url_index"),
+            "page_filter_directory": os.path.join(index_directory, "page_filter"),
+            "anchor_graph_directory": os.path.join(index_directory, "anchor_graph"),
+        }
+        new_ks = FileKnowledgeSource(
+            self.new_ks_filename,
+            index_directory=os.path.join(self.tmp_dir.name, "new_index"),
+        )
+        with mock.patch.object(
+            KnowledgeSource, "db", new_callable=mock.PropertyMock
+        ) as db:
+            db.return_value = Collection(self.pages)
+            ks = KnowledgeSource()
+            build_mongo_indexes(
+                ks, index_directory, page_filter=True, anchor_graph=True
+            )
+
+            # the indexes opened on the knowledge source would go stale
+            indexed_ks = KnowledgeSource(**directories)
+            with self.assertRaises(ValueError):
+                apply_delta_to_mongo(indexed_ks, new_ks, self.delta)
+            indexed_ks.close()
+
+            apply_delta_to_mongo(
+                ks, new_ks, self.delta, index_directory=index_directory
+            )
+            self.assertEqual(
+                sorted(db.return_value.pages),
+                sorted(page["_id"] for page in self.new_pages),
+            )
+
+            indexed_ks = KnowledgeSource(**directories)
+            self.assertEqual(
+                indexed_ks.get_page_by_id("3392")["wikipedia_title"], "Basketball"
+            )
+            self.assertEqual(
+                indexed_ks.get_page_by_title("Basketball")["wikipedia_id"], "3392"
+            )
+            page = indexed_ks.get_page_from_url(
+                "https://en.wikipedia.org/wiki/Basketball"
+            )
+            self.assertEqual(page["wikipedia_id"], "3392")
+            self.assertIsNone(indexed_ks.get_page_by_id("180211"))
+            self.assertEqual(indexed_ks.get_pages_by_title("Café"), [])
+            self.assertEqual(indexed_ks.get_out_links(20455), [(6466, 2)])
+            indexed_ks.close()
+        ks.close()
+        new_ks.close()
+
+    def test_apply_delta_to_chunks(self):
+        chunks_file = os.path.join(self.tmp_dir.name, "kilt.jsonl")
+        with open(chunks_file, "w") as fout:
+            for i, page in enumerate(self.pages, 1):
+                chunk = {"wikipedia_id": page["wikipedia_id"], "text": page["text"][1]}
+                fout.write("{}\t{}\n".format(i, json.dumps(chunk)))
+        new_chunks = [
+            {"wikipedia_id": page["wikipedia_id"], "text": page["text"][1]}
+            for page in [self.new_pages[1], self.new_pages[5]]
+        ]
+        output_file = os.path.join(self.tmp_dir.name, "kilt_refreshed.jsonl")
+        new_ids = apply_delta_to_chunks(
+            chunks_file, self.delta, new_chunks, output_file
+        )
+        self.assertEqual(new_ids, [7, 8])
+
+        with open(output_file, "r") as fin:
+            lines = [line.split("\t") for line in fin]
+        self.assertEqual([int(x[0]) for x in lines], [1, 3, 4, 5, 7, 8])
+        self.assertEqual(
+            [json.loads(x[1])["wikipedia_id"] for x in lines],
+            ["1101759", "27675", "20455", "6466", "9738", "3392"],
+        )
+
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        with importlib.resources.open_text(test_data, "ks.jsonl") as ks_file:
+            self.pages = [json.loads(line) for line in ks_file]
+
+    def test_eviction_by_size(self):
+        sizes = [estimate_page_size(page) for page in self.pages]
+        cache = PageCache(sizes[0] + sizes[1])
+        cache.put(self.pages[0], wikipedia_title="E-mail marketing")
+        cache.put(self.pages[1])
+        self.assertEqual(cache.get(self.pages[0]["wikipedia_id"]), self.pages[0])
+
+        # the least recently used page (pages[1]) is evicted
+        cache.put(self.pages[2])
+        self.assertIsNone(cache.get(self.pages[1]["wikipedia_id"]))
+        self.assertEqual(cache.get_by_title("E-mail marketing"), self.pages[0])
+        self.assertLessEqual(cache.current_bytes, cache.max_bytes)
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+
+    def test_knowledge_source_cache(self):
+        with importlib.resources.open_text(test_data, "ks.jsonl") as ks_file:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                ks = FileKnowledgeSource(
+                    ks_file.name, index_directory=tmp_dir, page_cache_bytes=2**20
+                )
+                for _ in range(3):
+                    page = ks.get_page_by_title("Michael Jordan")
+                    self.assertEqual(page["wikipedia_id"], "20455")
+                    self.assertEqual(ks.get_page_by_id(20455), page)
+                pages = ks.get_pages_by_ids(["20455", "6466", "123"])
+                self.assertEqual(pages[0], page)
+                self.assertIsNone(pages[2])
+
+                stats = ks.page_cache.stats()
+                self.assertEqual(stats["pages"], 2)
+                self.assertEqual(stats["hits"], 6)
+
+                # the pages returned are copies of the cached ones
+                pages[0]["text"].append("changed")
+                pages[1]["wikipedia_title"] = "changed"
+                self.assertEqual(ks.get_page_by_id(20455), page)
+                self.assertEqual(
+                    ks.get_page_by_id(6466)["wikipedia_title"], "Chicago Bulls"
+                )
+                ks.close()
+
+
+class TestAsyncKnowledgeSource(unittest.TestCase):
+    def test_lookups(self):
+        with importlib.resources.open_text(test_data, "ks.jsonl") as ks_file:
+            pages = [json.loads(line) for line in ks_file]
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                ks = FileKnowledgeSource(ks_file.name, index_directory=tmp_dir)
+
+                batches = []
+                get_pages_by_ids = ks.get_pages_by_ids
+
+                def counting_get_pages_by_ids(wikipedia_ids):
+                    batches.append(len(wikipedia_ids))
+                    return get_pages_by_ids(wikipedia_ids)
+
+                ks.get_pages_by_ids = counting_get_pages_by_ids
+                async_ks = AsyncKnowledgeSource(ks, max_in_flight=2, batch_size=4)
+
+                async def run():
+                    by_id = await asyncio.gather(
+                        *[
+                            async_ks.get_page_by_id(page["wikipedia_id"])
+                            for page in pages * 2
+                        ],
+                        async_ks.get_page_by_id("123"),
+                    )
+                    by_title = await asyncio.gather(
+                        *[
+                            async_ks.get_page_by_title(page["wikipedia_title"])
+                            for page in pages
+                        ]
+                    )
+                    by_url = await async_ks.get_page_from_url(
+                        "https://en.wikipedia.org/wiki/Michael_Jordan"
+                    )
+                    projected = await async_ks.get_page_by_id(
+                        "20455", fields=["text"], paragraphs=(0, 1)
+                    )
+                    return by_id, by_title, by_url, projected
+
+                by_id, by_title, by_url, projected = asyncio.run(run())
+                self.assertEqual(by_id, pages * 2 + [None])
+                self.assertEqual(by_title, pages)
+                self.assertEqual(by_url["wikipedia_id"], "20455")
+                self.assertEqual(projected["text"], ["Michael Jordan\n"])
+                # 13 id lookups coalesced in batches of at most 4
+                self.assertEqual(batches[:4], [4, 4, 4, 1])
+
+                # the same instance on a new event loop
+                by_id, by_title, by_url, projected = asyncio.run(run())
+                self.assertEqual(by_id, pages * 2 + [None])
+                self.assertEqual(by_title, pages)
+                self.assertFalse(async_ks._tasks)
+
+                async_ks.close()
+                ks.close()
+
+
+class TestBlockKnowledgeSource(unittest.TestCase):
+    def test_lookups(self):
+        with importlib.resources.open_text(test_data, "ks.jsonl") as ks_file:
+            pages = [json.loads(line) for line in ks_file]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            export_block_store(pages, tmp_dir, pages_per_block=4)
+            ks = BlockKnowledgeSource(tmp_dir, cached_blocks=1)
+
+            self.assertEqual(ks.get_num_pages(), len(pages))
+            self.assertEqual(list(ks.get_all_pages_cursor()), pages)
+            for page in reversed(pages):
+                self.assertEqual(ks.get_page_by_id(page["wikipedia_id"]), page)
+                self.assertEqual(ks.get_page_by_title(page["wikipedia_title"]), page)
+            self.assertIsNone(ks.get_page_by_id("123"))
+            self.assertEqual(
+                ks.get_pages_by_ids(["180211", "123", "1101759"]),
+                [pages[-1], None, pages[0]],
+            )
+            self.assertEqual(
+                [
+                    page["wikipedia_id"]
+                    for page in ks.get_pages_by_title("e-mail marketing")
+                ],
+                ["1101759"],
+            )
+            page = ks.get_page_from_url(
+                "https://en.wikipedia.org/w/index.php?curid=20455"
+            )
+            self.assertEqual(page["wikipedia_title"], "Michael Jordan")
+            partitions = [list(ks.iter_partition(i, 3)) for i in range(3)]
+            self.assertEqual(sum(partitions, []), pages)
+            for start, end in [(1, 3), (1, 1), (3, 1)]:
+                projected = ks.get_page_by_id(
+                    pages[0]["wikipedia_id"], fields=["text"], paragraphs=(start, end)
+                )
+                self.assertEqual(projected["text"], pages[0]["text"][start:end])
+            ks.close()